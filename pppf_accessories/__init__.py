@@ -1,6 +1,8 @@
-from .blast import  stream_blast_results
+from .blast import stream_blast_results, stream_blast_columns, BlastResult
+from .files import open_file
+from .cache import LRUCache
 from .formatting import color, colour
 
 __all__ = [
-    'color', 'colour', 'stream_blast_results'
-]
\ No newline at end of file
+    'color', 'colour', 'open_file', 'stream_blast_results', 'stream_blast_columns', 'BlastResult', 'LRUCache'
+]
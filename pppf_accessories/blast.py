@@ -1,60 +1,154 @@
 """
 Parse a blast file and create a blast result object
+
+The blast files are tab separated (-outfmt 6, or the DIAMOND equivalent) and can be
+plain text or compressed with gzip, bzip2, xz, or zstandard (see open_file).
+
+Most of the time we only need a few of the columns. stream_blast_results() gives you a
+BlastResult for every line, and only converts the columns you use to numbers. For a big all vs. all
+file use stream_blast_columns() and just ask for the columns you need as a tuple.
 """
 
-import os
 import sys
+import time
 import argparse
-import gzip
+from operator import itemgetter
+
+from .files import open_file
+from .formatting import color
+
+# the names and types of the columns, in order. The last two are optional
+blast_columns = ['query', 'db', 'percent_id', 'alignment_length', 'gaps', 'mismatches', 'query_start', 'query_end',
+                 'db_start', 'db_end', 'evalue', 'bitscore', 'query_length', 'subject_length']
+blast_types = [str, str, float, int, int, int, int, int, int, int, float, float, int, int]
+
+_column_types = {c: (i, t) for i, (c, t) in enumerate(zip(blast_columns, blast_types))}
+
 
 class BlastResult():
-    def __init__(self, query, db, percent_id, alignment_length, gaps, mismatches, query_start, query_end, db_start, db_end,
-                 evalue, bitscore, query_length=None, subject_length=None):
-        self.query = query
-        self.db = db
-        self.alignment_length = int(alignment_length)
-        self.percent_id = float(percent_id)
-        self.gaps = int(gaps)
-        self.mismatches = int(mismatches)
-        self.query_start = int(query_start)
-        self.query_end = int(query_end)
-        self.db_start = int(db_start)
-        self.db_end = int(db_end)
-        self.evalue = float(evalue)
-        self.bitscore = float(bitscore)
-        if query_length:
-            self.query_length = int(query_length)
-        if subject_length:
-            self.subject_length = int(subject_length)
+    """
+    One line of a blast file. We keep the columns as strings, and convert a column to a number
+    when you use it, so you only pay for the columns you need. (If you use a number a lot,
+    keep it in a variable.) query_length and subject_length are None if they are not in the file.
+    """
+
+    __slots__ = ('query', 'db', '_fields')
 
+    def __init__(self, *fields):
+        """
+        :param fields: the columns (strings) in blast_columns order
+        """
+        self.query = fields[0]
+        self.db = fields[1]
+        self._fields = fields
+
+    def __repr__(self):
+        return "BlastResult(" + ", ".join(self._fields) + ")"
+
+
+def _column_property(i, t):
+    """
+    A property that converts column i of a BlastResult
+    :param i: the column
+    :param t: the type of the column
+    :return: the property
+    """
+    if i >= 12:
+        # the optional columns
+        return property(lambda self: t(self._fields[i]) if len(self._fields) > i and self._fields[i] else None)
+    return property(lambda self: t(self._fields[i]))
+
+
+for (_i, (_c, _t)) in enumerate(zip(blast_columns, blast_types)):
+    if _t is not str:
+        setattr(BlastResult, _c, _column_property(_i, _t))
 
 
 def stream_blast_results(blastf, verbose=False):
     """
     Parse a tab-separated blast file and stream the results
     :param blastf: the file to stream
+    :param verbose: more output
     :return: a stream of BlastResults
     """
 
-    if blastf.endswith('.gz'):
-        qin = gzip.open(blastf, 'rt')
-    else:
-        qin = open(blastf, 'r')
+    with open_file(blastf) as qin:
+        for l in qin:
+            yield BlastResult(*l.rstrip("\r\n").split("\t"))
 
-    while True:
-        l = qin.readline()
-        if not l:
-            break
-        p = l.strip().split("\t")
-        #if verbose:
-        #    sys.stderr.write("LINE: {}\n".format(p))
-        br = BlastResult(*p)
-        yield br
 
-    return None
+def _optional(t):
+    """
+    A converter for an optional column, which may be missing or empty
+    :param t: the type of the column
+    :return: a function that converts the column, or returns None
+    """
+    return lambda v: t(v) if v else None
+
+
+def _column_getter(columns):
+    """
+    Make a function that gets some columns from a split line and converts them.
+    :param columns: the names of the columns
+    :return: a function that takes the list of fields and returns a tuple
+    """
+
+    for c in columns:
+        if c not in _column_types:
+            sys.stderr.write(f"{color.RED}FATAL: {c} is not a blast column. Use one of {blast_columns}{color.ENDC}\n")
+            sys.exit(-1)
+    indexes = [_column_types[c][0] for c in columns]
+    get = itemgetter(*indexes)
+    if len(indexes) == 1:
+        # itemgetter only returns a tuple when there is more than one item
+        get = lambda p, g=get: (g(p),)
+
+    # the position and converter of each column that is not a string
+    converters = tuple((j, _optional(t) if i >= 12 else t) for (j, (i, t)) in
+                       enumerate(_column_types[c] for c in columns) if t is not str)
+    if not converters:
+        # nothing to convert
+        return get
+
+    # the optional columns may not be in the file, so we pad the fields with empty columns
+    padding = [''] * (len(blast_columns) - 12) if max(indexes) >= 12 else []
+
+    def getter(p):
+        values = list(get(p + padding if padding else p))
+        for (j, t) in converters:
+            values[j] = t(values[j])
+        return tuple(values)
+
+    return getter
+
+
+def stream_blast_columns(blastf, columns=('query', 'db', 'bitscore'), verbose=False):
+    """
+    Parse a tab-separated blast file and stream just some of the columns
+    :param blastf: the file to stream
+    :param columns: the names of the columns you want (see blast_columns)
+    :param verbose: more output
+    :return: a stream of tuples of those columns
+    """
+
+    getter = _column_getter(columns)
+    with open_file(blastf) as qin:
+        for l in qin:
+            yield getter(l.rstrip("\r\n").split("\t"))
+
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="")
-    parser.add_argument('-f', help='')
+    parser = argparse.ArgumentParser(description="Read a blast file and print some of the columns")
+    parser.add_argument('-f', help='blast file (can be compressed)', required=True)
+    parser.add_argument('-c', help='columns to print (default: query db bitscore)', nargs='+',
+                        default=['query', 'db', 'bitscore'], choices=blast_columns)
     parser.add_argument('-v', help='verbose output', action="store_true")
     args = parser.parse_args()
+
+    start = time.time()
+    n = 0
+    for r in stream_blast_columns(args.f, args.c, args.v):
+        print("\t".join(map(str, r)))
+        n += 1
+    if args.v:
+        sys.stderr.write(f"{color.GREEN}Read {n:,} lines in {time.time() - start:.1f} seconds{color.ENDC}\n")
@@ -0,0 +1,85 @@
+"""
+A small, thread-safe, least recently used cache that counts its hits and misses.
+
+functools.lru_cache does this for a function, but we want to fill the cache from
+batch queries as well as single lookups, and cache answers that are None.
+"""
+
+import threading
+from collections import OrderedDict
+
+__author__ = 'Rob Edwards'
+
+
+class LRUCache:
+    """
+    A least recently used cache with a maximum size.
+
+    :ivar maxsize: the maximum number of entries. None means the cache is not bounded
+    :ivar hits: the number of lookups we found in the cache
+    :ivar misses: the number of lookups we did not find
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+        Create a new cache
+        :param maxsize: the maximum number of entries. None means the cache is not bounded
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get a value from the cache, and count the hit or miss
+        :param key: the key
+        :param default: what to return if the key is not in the cache
+        :return: the value or default
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Add a value to the cache, removing the least recently used entries if it is full
+        :param key: the key
+        :param value: the value
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        The cache statistics
+        :return: a dict of hits, misses, size, and maxsize
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
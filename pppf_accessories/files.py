@@ -0,0 +1,47 @@
+"""
+Open plain or compressed files.
+
+We recognize the compression from the file extension: .gz, .bz2, and .xz are
+handled by the standard library, .zst needs the zstandard module.
+"""
+
+import io
+import sys
+import bz2
+import gzip
+import lzma
+
+from .formatting import color
+
+__author__ = 'Rob Edwards'
+
+
+def open_file(filename, mode='r'):
+    """
+    Open a file that may be compressed
+    :param filename: the file to open
+    :param mode: the mode to open the file in. Text mode ('r' or 'rt') unless you add a 'b'
+    :return: the open file handle
+    """
+
+    if 'b' not in mode and 't' not in mode:
+        mode += 't'
+
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    if filename.endswith('.bz2'):
+        return bz2.open(filename, mode)
+    if filename.endswith('.xz'):
+        return lzma.open(filename, mode)
+    if filename.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            sys.stderr.write(f"{color.RED}FATAL: Please install zstandard to read {filename}{color.ENDC}\n")
+            sys.exit(-1)
+        fh = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+        if 'b' in mode:
+            return fh
+        return io.TextIOWrapper(fh)
+    return open(filename, mode.replace('t', ''))
+
@@ -3,12 +3,22 @@ Definitions for the pppf_cluster methods
 """
 
 from .load_clusters_to_database import read_mmseqs_clusters, add_functions_to_clusters, insert_cluster_metadata, insert_into_database
-from .cluster import Cluster
-from .cluster_functions import proteinid_to_function, proteinid_to_all_functions
+from .load_clusters_to_database import stream_mmseqs_clusters, load_cluster_definition, load_clusters
+from .load_clusters_to_database import update_only_hypothetical
+from .cluster import Cluster, ClusterMembers
+from .cluster_functions import proteinid_to_function, proteinid_to_all_functions, proteinids_to_functions
+from .cluster_functions import use_function_index, proteinids_to_all_functions, proteinids_to_clusters
+from .function_index import FunctionIndex, build_function_index
+from .cluster_members import get_members, all_cluster_members, normalize_cluster_members, unclustered_proteins
+from .annotation_service import AnnotationService
 
 __all__ = [
     'read_mmseqs_clusters', 'add_functions_to_clusters', 'insert_cluster_metadata', 'insert_into_database',
-    'Cluster', 'proteinid_to_function', 'proteinid_to_all_functions'
+    'stream_mmseqs_clusters', 'load_cluster_definition', 'load_clusters', 'update_only_hypothetical',
+    'Cluster', 'ClusterMembers', 'proteinid_to_function', 'proteinid_to_all_functions', 'proteinids_to_functions',
+    'use_function_index', 'proteinids_to_all_functions', 'proteinids_to_clusters', 'FunctionIndex', 'build_function_index',
+    'get_members', 'all_cluster_members', 'normalize_cluster_members', 'unclustered_proteins',
+    'AnnotationService'
 ]
 
 
@@ -0,0 +1,342 @@
+"""
+A small, local, read-only annotation service for the cluster database.
+
+Load the cluster database (and optionally a function index, see function_index.py) once,
+and then answer batches of md5sum lookups over HTTP, on a TCP port or a unix socket, rather
+than starting a new process and opening the database for every lookup.
+
+All the requests and responses are JSON:
+
+    POST /functions         {"md5s": [...]} -> {"functions": {md5sum: function or null}}
+    POST /all_functions     {"md5s": [...]} -> {"all_functions": {md5sum: {function: count}}}
+    POST /clusters          {"md5s": [...]} -> {"clusters": {md5sum: [cluster, ...]}}
+    GET  /metrics           the number of requests, errors, and latency of each endpoint, and the cache hits
+    GET  /health            {"status": "ok"}
+
+We keep a pool of read-only connections to the database and run the queries in threads,
+so a slow batch does not block the other requests. The functions are cached in the
+cluster_functions LRU cache, which all the connections share.
+
+This is only meant for local use: there is no authentication.
+
+e.g.
+    python pppf_clusters/annotation_service.py -c clusters.sql -x clusters.idx
+    curl -d '{"md5s": ["0123..."]}' http://127.0.0.1:8765/functions
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+from collections import deque
+from statistics import mean, quantiles
+
+from pppf_accessories import color
+from pppf_databases.md5_keys import register_md5_functions
+from pppf_clusters.cluster_functions import proteinids_to_functions, proteinids_to_all_functions, \
+    proteinids_to_clusters, use_function_index, protein_functions
+
+__author__ = 'Rob Edwards'
+
+# the most md5sums we will look up in one request
+max_md5s = 100000
+
+# the largest request body we will read (bytes)
+max_body = 8 * 1024 * 1024
+
+# how many recent latencies to keep for each endpoint
+latency_window = 10000
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 500: 'Internal Server Error'}
+
+
+def connect_read_only(dbname, verbose=False):
+    """
+    Open a read-only connection to a database that we can use from any thread
+    :param dbname: the database file name
+    :param verbose: more output
+    :return: the database connection
+    """
+    if not os.path.exists(dbname):
+        sys.stderr.write(f"{color.RED}FATAL: {dbname} does not exist. Cannot connect{color.ENDC}\n")
+        sys.exit(-1)
+
+    conn = sqlite3.connect(f"file:{os.path.abspath(dbname)}?mode=ro", uri=True, check_same_thread=False)
+    register_md5_functions(conn)
+    return conn
+
+
+class Metrics:
+    """
+    The number of requests, errors, and recent latencies of each endpoint
+    """
+
+    def __init__(self, window=latency_window):
+        """
+        :param window: how many recent latencies to keep for each endpoint
+        """
+        self.started = time.time()
+        self.window = window
+        self.requests = {}
+        self.errors = {}
+        self.md5s = {}
+        self.latencies = {}
+
+    def record(self, endpoint, seconds, n=0, error=False):
+        """
+        Record a request
+        :param endpoint: the endpoint (e.g. /functions)
+        :param seconds: how long the request took
+        :param n: how many md5sums were in the request
+        :param error: was there an error
+        """
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        self.md5s[endpoint] = self.md5s.get(endpoint, 0) + n
+        if error:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        self.latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds * 1000)
+
+    def summary(self):
+        """
+        :return: a dict of the metrics that we can dump as JSON. The latencies are in milliseconds
+        """
+        endpoints = {}
+        for e in self.requests:
+            lat = sorted(self.latencies[e])
+            # compute both percentiles the same way, so p50 is never more than p95
+            q = quantiles(lat, n=20, method='inclusive') if len(lat) > 1 else [lat[0]] * 19
+            endpoints[e] = {
+                'requests': self.requests[e],
+                'errors': self.errors.get(e, 0),
+                'md5s': self.md5s[e],
+                'latency_ms': {
+                    'mean': round(mean(lat), 3),
+                    'p50': round(q[9], 3),
+                    'p95': round(q[18], 3),
+                    'max': round(lat[-1], 3),
+                }
+            }
+        return {'uptime': round(time.time() - self.started, 1), 'endpoints': endpoints,
+                'cache': protein_functions.stats()}
+
+
+class AnnotationService:
+    """
+    Answer md5sum lookups from a cluster database
+
+    :ivar clustersdb: the cluster database
+    :ivar metrics: the Metrics for this service
+    """
+
+    def __init__(self, clustersdb, poolsize=4, indexfile=None, verbose=False):
+        """
+        :param clustersdb: the cluster database
+        :param poolsize: the number of read-only database connections
+        :param indexfile: a function index to use for the functions
+        :param verbose: more output
+        """
+        self.clustersdb = clustersdb
+        self.poolsize = poolsize
+        self.verbose = verbose
+        self.metrics = Metrics()
+        self._pool = None
+        if indexfile:
+            use_function_index(indexfile, verbose)
+        self.lookups = {
+            '/functions': ('functions', proteinids_to_functions),
+            '/all_functions': ('all_functions', proteinids_to_all_functions),
+            '/clusters': ('clusters', proteinids_to_clusters),
+        }
+
+    async def open(self):
+        """
+        Open the pool of read-only connections
+        """
+        self._pool = asyncio.Queue()
+        for _ in range(self.poolsize):
+            self._pool.put_nowait(connect_read_only(self.clustersdb, self.verbose))
+        if self.verbose:
+            sys.stderr.write(f"{color.GREEN}Opened {self.poolsize} connections to {self.clustersdb}{color.ENDC}\n")
+
+    def close(self):
+        """
+        Close all the database connections
+        """
+        while self._pool and not self._pool.empty():
+            self._pool.get_nowait().close()
+
+    async def lookup(self, endpoint, md5s):
+        """
+        Look up some md5sums with one of the connections from the pool
+        :param endpoint: the endpoint (e.g. /functions)
+        :param md5s: the list of md5sums
+        :return: the dict to return
+        """
+        (name, func) = self.lookups[endpoint]
+        conn = await self._pool.get()
+        try:
+            found = await asyncio.get_running_loop().run_in_executor(None, func, md5s, conn.cursor())
+        finally:
+            self._pool.put_nowait(conn)
+        return {name: found}
+
+    async def respond(self, method, path, body):
+        """
+        Answer one request
+        :param method: the HTTP method
+        :param path: the request path
+        :param body: the request body
+        :return: the status and the dict to return
+        """
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics.summary()
+        if path not in self.lookups:
+            return 404, {'error': f'no such endpoint {path}'}
+        if method != 'POST':
+            return 405, {'error': f'use POST for {path}'}
+
+        try:
+            md5s = json.loads(body)['md5s']
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'the request must be JSON like {"md5s": [...]}'}
+        if not isinstance(md5s, list) or not all(isinstance(m, str) for m in md5s):
+            return 400, {'error': 'md5s must be a list of strings'}
+        if len(md5s) > max_md5s:
+            return 413, {'error': f'at most {max_md5s} md5s in each request'}
+        return 200, await self.lookup(path, md5s)
+
+    async def handle(self, reader, writer):
+        """
+        Handle an HTTP/1.1 connection. We read Content-Length bodies and keep the connection
+        open until the client closes it or asks us to.
+        :param reader: the asyncio StreamReader
+        :param writer: the asyncio StreamWriter
+        """
+        try:
+            while True:
+                try:
+                    (request, headers) = await self.read_headers(reader)
+                except (ValueError, asyncio.LimitOverrunError):
+                    # a line was longer than the StreamReader limit (64 KiB)
+                    await self.send(writer, 431, {'error': 'the request line or a header is too long'}, False)
+                    break
+                if not request:
+                    break
+                start = time.perf_counter()
+                try:
+                    (method, target, version) = request.decode('latin-1').split()
+                except ValueError:
+                    await self.send(writer, 400, {'error': 'bad request line'}, False)
+                    break
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                length = headers.get('content-length', '0') or '0'
+                if not (length.isascii() and length.isdigit()):
+                    # int() would also take -5, +5, or 1_000
+                    await self.send(writer, 400, {'error': f'bad Content-Length: {length}'}, False)
+                    break
+                length = int(length)
+                if length > max_body:
+                    await self.send(writer, 413, {'error': f'the request is larger than {max_body} bytes'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                path = target.split('?')[0]
+                n = 0
+                try:
+                    (status, result) = await self.respond(method, path, body)
+                    if status == 200 and path in self.lookups:
+                        n = len(result[self.lookups[path][0]])
+                except Exception as e:
+                    sys.stderr.write(f"{color.RED}ERROR: {method} {path}: {e}{color.ENDC}\n")
+                    (status, result) = (500, {'error': str(e)})
+                await self.send(writer, status, result, keep_alive)
+                if path != '/metrics':
+                    # don't keep metrics for every path that someone tries
+                    endpoint = path if path in self.lookups or path == '/health' else 'other'
+                    self.metrics.record(endpoint, time.perf_counter() - start, n, status != 200)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_headers(self, reader):
+        """
+        Read the request line and the headers
+        :param reader: the asyncio StreamReader
+        :return: the request line (empty if the client closed the connection) and a dict of the headers
+        """
+        request = await reader.readline()
+        headers = {}
+        while request:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (k, _, v) = line.decode('latin-1').partition(':')
+            headers[k.strip().lower()] = v.strip()
+        return request, headers
+
+    async def send(self, writer, status, result, keep_alive):
+        """
+        Write a JSON response
+        :param writer: the asyncio StreamWriter
+        :param status: the HTTP status
+        :param result: the dict to return
+        :param keep_alive: will we keep the connection open
+        """
+        body = json.dumps(result).encode('utf-8')
+        writer.write((f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+                      "Content-Type: application/json\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(service, host='127.0.0.1', port=8765, unix_socket=None, verbose=False):
+    """
+    Run the annotation service until it is interrupted
+    :param service: the AnnotationService
+    :param host: the host to listen on
+    :param port: the port to listen on
+    :param unix_socket: listen on this unix socket instead of host and port
+    :param verbose: more output
+    """
+    await service.open()
+    if unix_socket:
+        server = await asyncio.start_unix_server(service.handle, path=unix_socket)
+        where = unix_socket
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+        where = f"http://{host}:{port}"
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Annotation service listening on {where}{color.ENDC}\n")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A local read-only service to look up protein functions and clusters')
+    parser.add_argument('-c', help='cluster database', required=True)
+    parser.add_argument('-x', help='binary function index to use for the functions (see function_index.py)')
+    parser.add_argument('-p', help='number of read-only database connections (default=4)', type=int, default=4)
+    parser.add_argument('-H', help='host to listen on (default=127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('-P', help='port to listen on (default=8765)', type=int, default=8765)
+    parser.add_argument('-u', help='listen on this unix socket instead of a port')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(AnnotationService(args.c, args.p, args.x, args.v), args.H, args.P, args.u, args.v))
+    except KeyboardInterrupt:
+        pass
@@ -1,10 +1,81 @@
 """
-A class representing a cluster of proteins
+A class representing a cluster of proteins.
+
+We may have a million or more clusters in memory, so these are kept small: the
+Cluster uses __slots__ rather than a __dict__, and the members are kept in a
+ClusterMembers set that stores md5sums as 16 byte digests rather than 32 character
+strings.
 """
 
+import re
+import sys
+from collections.abc import Set
 from uuid import uuid4
 from pppf_lib import is_hypothetical
 
+_md5 = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ClusterMembers(Set):
+    """
+    A compact, read only set of the members of a cluster. It behaves like a set of
+    strings, but we keep the md5sums as one sorted bytes object of 16 byte digests
+    (and anything else in a frozenset).
+    """
+
+    __slots__ = ('_digests', '_others')
+
+    def __init__(self, members=()):
+        """
+        Create the set of members
+        :param members: an iterable of the members (usually md5sums)
+        """
+        digests = set()
+        others = set()
+        for m in members:
+            if isinstance(m, str) and _md5.match(m):
+                digests.add(bytes.fromhex(m))
+            else:
+                others.add(m)
+        self._digests = b"".join(sorted(digests))
+        self._others = frozenset(others)
+
+    def __len__(self):
+        return len(self._digests) // 16 + len(self._others)
+
+    def __iter__(self):
+        for i in range(0, len(self._digests), 16):
+            yield self._digests[i:i+16].hex()
+        yield from self._others
+
+    def __contains__(self, m):
+        if not (isinstance(m, str) and _md5.match(m)):
+            return m in self._others
+        d = bytes.fromhex(m)
+        lo = 0
+        hi = len(self._digests) // 16
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._digests[mid*16:mid*16+16] < d:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self._digests[lo*16:lo*16+16] == d
+
+    def __repr__(self):
+        return f"ClusterMembers({set(self)!r})"
+
+    def __getstate__(self):
+        return {'_digests': self._digests, '_others': self._others}
+
+    def __setstate__(self, state):
+        self._digests = state['_digests']
+        self._others = state['_others']
+
+    def __reduce__(self):
+        return (self.__class__, (), self.__getstate__())
+
+
 class Cluster:
     """
     A cluster of sequences has an ID that should be unique, an exemplar sequence, and a set of members.
@@ -15,7 +86,7 @@ class Cluster:
 
     :ivar id: A unique ID. If not provided we will calculate one
     :ivar exmmplar: The exemplar sequence
-    :ivar members: a list or set (or settable object) of the members of the cluster
+    :ivar members: a (read only) set of the members of the cluster
     :ivar longest_id: the id of the longest protein or None if not set
     :ivar longest_len: the length of the longest protein or None if not set
     :ivar shortest_id: the id of the shortest protein or None if not set
@@ -23,12 +94,16 @@ class Cluster:
     :ivar average_size: the average size of the members of the set or None if not set
     :ivar number_of_members: the number of members in the cluster
     :ivar number_of_functions: the number of unique functions in the cluster
-    :ivar functions: a dict of functions and their frequency
+    :ivar functions: a dict of functions and their frequency. We intern the function strings as they are shared by many clusters
     :ivar function: the most abundant function
     :ivar only_hypothetical: True is the set only has proteins whose functions are hypothetical.
 
     """
 
+    __slots__ = ('id', 'exemplar', 'members', 'longest_id', 'longest_len', 'shortest_id', 'shortest_len',
+                 'average_size', 'number_of_members', 'functions', 'function', 'number_of_functions',
+                 'only_hypothetical')
+
     def __init__(self, id, exemplar, members):
         """
         Initiate a cluster of sequences
@@ -41,8 +116,7 @@ class Cluster:
         else:
             self.id = str(uuid4())
         self.exemplar = exemplar
-        self.members = set(members)
-        self.members.add(exemplar)
+        self.members = ClusterMembers(list(members) + [exemplar])
         self.longest_id = None
         self.longest_len = None
         self.shortest_id = None
@@ -54,6 +128,21 @@ class Cluster:
         self.number_of_functions = 0
         self.only_hypothetical = None
 
+    def set_functions(self, functions):
+        """
+        Set the functions (and the number of functions) for this cluster
+        :param functions: a dict of functions and their frequency
+        """
+        self.functions = {sys.intern(f) if isinstance(f, str) else f: n for f, n in functions.items()}
+        self.number_of_functions = len(self.functions)
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def is_hypothetical(self):
         """
         Is the function associated with this class hypothetical?
@@ -1,15 +1,90 @@
 """
-Extract the functions associated with a cluster
+Extract the functions associated with a cluster.
+
+We keep the functions we have looked up in a bounded LRU cache (protein_functions), including
+the proteins that are not in a cluster. To annotate a lot of proteins use
+proteinids_to_functions(), which looks them up with a few IN (...) queries rather than one
+query per protein. proteinids_to_all_functions() and proteinids_to_clusters() do the same
+for all the functions and all the clusters of each protein.
+
+To answer lookups from other programs without opening the database every time, see
+annotation_service.py.
+
+For a lot of lookups you can also use a binary function index (see function_index.py)
+instead of the database: call use_function_index() and proteinid_to_function() and
+proteinids_to_functions() will look the proteins up in the index.
 """
 
 import os
 import sys
 import argparse
 import json
-from pppf_accessories import color
+from pppf_accessories import color, LRUCache
 from pppf_databases import connect_to_db, disconnect
+from pppf_databases.md5_keys import md5_key, md5_hex, md5_format
+from .function_index import FunctionIndex
+
+# the (function, functions) for each protein md5sum we have looked up, or None if it is not in a cluster
+protein_functions = LRUCache(maxsize=500000)
+
+# how many md5sums to look up in each query
+chunk_size = 500
+
+# the FunctionIndex to use instead of the database, if any
+function_index = None
+
+_missing = object()
+
+
+def use_function_index(indexfile, verbose=False):
+    """
+    Look up the functions in a binary function index rather than the cluster database.
+    :param indexfile: the index file from function_index.py. None to go back to using the database
+    :param verbose: more output
+    :return: the FunctionIndex
+    """
+
+    global function_index
+
+    if function_index is not None:
+        function_index.close()
+    function_index = FunctionIndex(indexfile) if indexfile else None
+    if verbose and function_index is not None:
+        sys.stderr.write(f"{color.GREEN}Using the function index {indexfile} with {len(function_index):,} proteins{color.ENDC}\n")
+    return function_index
+
+
+def _query_functions(proteinids, clusterdb_cursor):
+    """
+    Look up the functions for some proteins with one query. If a protein is in more than one
+    cluster we use the first one.
+    :param proteinids: a list of protein md5sums (at most chunk_size)
+    :param clusterdb_cursor: the database cursor
+    :return: a dict of [protein id: (function, all functions)] for the proteins that are in a cluster
+    """
+
+    fmt = md5_format(clusterdb_cursor.connection)
+    # the protein ids for each md5sum we will read back from the database
+    keys = {}
+    for p in proteinids:
+        try:
+            keys.setdefault(md5_hex(md5_key(p, fmt)), []).append(p)
+        except ValueError:
+            # not an md5sum, so it is not in a cluster
+            continue
+    if not keys:
+        return {}
+
+    sql = "select md5cluster.protein_md5sum, function, functions from md5cluster " + \
+          "join cluster on md5cluster.cluster = cluster.cluster_rowid " + \
+          f"where md5cluster.protein_md5sum in ({','.join(['?'] * len(keys))}) " + \
+          "order by md5cluster.protein_md5sum, md5cluster.cluster"
+    found = {}
+    for (m, fn, fns) in clusterdb_cursor.execute(sql, [md5_key(k, fmt) for k in keys]):
+        for p in keys[md5_hex(m)]:
+            found.setdefault(p, (fn, fns))
+    return found
 
-protein_functions = {}
 
 def get_functions(proteinid, clusterdb_cursor, verbose=False):
     """
@@ -17,12 +92,27 @@ def get_functions(proteinid, clusterdb_cursor, verbose=False):
     :param proteinid: the protein id to search
     :param clusterdb_cursor: the database cursor
     :param verbose: more output
-    :return: tple of [function, all functions]
+    :return: tple of [function, all functions] or None if the protein is not in a cluster
     """
 
-    sql = "select function, functions from cluster left join md5cluster on md5cluster.cluster = cluster.cluster_rowid where md5cluster.protein_md5sum = ?;"
-    ex = clusterdb_cursor.execute(sql, [proteinid])
-    return ex.fetchone()
+    return _query_functions([proteinid], clusterdb_cursor).get(proteinid)
+
+
+def _cached_functions(proteinid, clusterdb_cursor, verbose=False):
+    """
+    Get the functions for a protein from the cache, or the database if we have not seen it
+    :param proteinid: the protein id to search
+    :param clusterdb_cursor: the database cursor
+    :param verbose: more output
+    :return: tple of [function, all functions] or None if the protein is not in a cluster
+    """
+
+    fns = protein_functions.get(proteinid, _missing)
+    if fns is _missing:
+        fns = get_functions(proteinid, clusterdb_cursor, verbose)
+        protein_functions.put(proteinid, fns)
+    return fns
+
 
 def proteinid_to_function(proteinid, clusterdb_cursor, verbose=False):
     """
@@ -33,12 +123,10 @@ def proteinid_to_function(proteinid, clusterdb_cursor, verbose=False):
     :return: str: the function of the protein or None if it is not in a cluster
     """
 
-    global protein_functions
-
-    if proteinid not in protein_functions:
-        protein_functions[proteinid] = get_functions(proteinid, clusterdb_cursor, verbose)
-
-    return protein_functions[proteinid][0]
+    if function_index is not None:
+        return function_index.function(proteinid)
+    fns = _cached_functions(proteinid, clusterdb_cursor, verbose)
+    return fns[0] if fns else None
 
 
 def proteinid_to_all_functions(proteinid, clusterdb_cursor, verbose=False):
@@ -47,29 +135,140 @@ def proteinid_to_all_functions(proteinid, clusterdb_cursor, verbose=False):
     :param proteinid: The protein md5 sum
     :param clusterdb_cursor: the cursor to the cluster database
     :param verbose: more output
-    :return: dict: the functions of the protein and their frequency
+    :return: dict: the functions of the protein and their frequency. This is empty if it is not in a cluster
     """
 
-    global protein_functions
+    fns = _cached_functions(proteinid, clusterdb_cursor, verbose)
+    return json.loads(fns[1]) if fns else {}
 
-    if proteinid not in protein_functions:
-        protein_functions[proteinid] = get_functions(proteinid, clusterdb_cursor, verbose)
 
-    return json.loads(protein_functions[proteinid][1])
+def _cached_batch(proteinids, clusterdb_cursor, verbose=False):
+    """
+    Get the functions for a lot of proteins. We look up the ones that are not in the
+    cache chunk_size at a time.
+    :param proteinids: an iterable of protein md5 sums
+    :param clusterdb_cursor: the cursor to the cluster database
+    :param verbose: more output
+    :return: dict: the (function, all functions) of each protein, or None if it is not in a cluster
+    """
+
+    results = {}
+    todo = []
+    for p in proteinids:
+        if p in results:
+            continue
+        results[p] = protein_functions.get(p, _missing)
+        if results[p] is _missing:
+            todo.append(p)
+
+    for i in range(0, len(todo), chunk_size):
+        chunk = todo[i:i+chunk_size]
+        found = _query_functions(chunk, clusterdb_cursor)
+        for p in chunk:
+            results[p] = found.get(p)
+            protein_functions.put(p, results[p])
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Looked up {len(todo):,} of {len(results):,} proteins in the database{color.ENDC}\n")
+    return results
+
+
+def proteinids_to_functions(proteinids, clusterdb_cursor, verbose=False):
+    """
+    Convert a lot of protein IDs to their functions, with a handful of queries
+    :param proteinids: an iterable of protein md5 sums
+    :param clusterdb_cursor: the cursor to the cluster database
+    :param verbose: more output
+    :return: dict: the function of each protein, or None if it is not in a cluster
+    """
+
+    if function_index is not None:
+        return {p: function_index.function(p) for p in proteinids}
+
+    return {p: fns[0] if fns else None for p, fns in _cached_batch(proteinids, clusterdb_cursor, verbose).items()}
+
+
+def proteinids_to_all_functions(proteinids, clusterdb_cursor, verbose=False):
+    """
+    Convert a lot of protein IDs to dicts of all their functions, with a handful of queries
+    :param proteinids: an iterable of protein md5 sums
+    :param clusterdb_cursor: the cursor to the cluster database
+    :param verbose: more output
+    :return: dict: the functions of each protein and their frequency. This is empty if it is not in a cluster
+    """
+
+    return {p: json.loads(fns[1]) if fns else {} for p, fns in _cached_batch(proteinids, clusterdb_cursor, verbose).items()}
+
+
+def proteinids_to_clusters(proteinids, clusterdb_cursor, verbose=False):
+    """
+    Get all the clusters that a lot of proteins are in (a protein can be in a cluster from each
+    cluster definition). These are not cached.
+    :param proteinids: an iterable of protein md5 sums
+    :param clusterdb_cursor: the cursor to the cluster database
+    :param verbose: more output
+    :return: dict: a list of clusters for each protein. Each cluster is a dict of cluster_rowid, uuid,
+        clusterdefinition, function, number_of_members, and only_hypothetical
+    """
+
+    fmt = md5_format(clusterdb_cursor.connection)
+    results = {p: [] for p in proteinids}
+    # the protein ids for each md5sum we will read back from the database
+    keys = {}
+    for p in results:
+        try:
+            keys.setdefault(md5_hex(md5_key(p, fmt)), []).append(p)
+        except ValueError:
+            # not an md5sum, so it is not in a cluster
+            continue
+    keys = list(keys.items())
+
+    columns = ['cluster_rowid', 'uuid', 'clusterdefinition', 'function', 'number_of_members', 'only_hypothetical']
+    for i in range(0, len(keys), chunk_size):
+        chunk = dict(keys[i:i+chunk_size])
+        ex = clusterdb_cursor.execute(
+            f"select md5cluster.protein_md5sum, {', '.join('cluster.' + c for c in columns)} from md5cluster " +
+            "join cluster on md5cluster.cluster = cluster.cluster_rowid " +
+            f"where md5cluster.protein_md5sum in ({','.join(['?'] * len(chunk))}) " +
+            "order by md5cluster.protein_md5sum, md5cluster.cluster", [md5_key(m, fmt) for m in chunk])
+        for row in ex:
+            for p in chunk[md5_hex(row[0])]:
+                results[p].append(dict(zip(columns, row[1:])))
+
+    return results
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description=" ")
-    parser.add_argument('-i', help='protein id', required=True)
+    parser = argparse.ArgumentParser(description="Get the functions of proteins from their clusters")
+    parser.add_argument('-i', help='protein id')
+    parser.add_argument('-f', help='file of protein ids, one per line. We print the function of each one')
     parser.add_argument('-c', help='cluster database', required=True)
+    parser.add_argument('-x', help='binary function index to use for the functions (see function_index.py)')
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
-    c= connect_to_db(args.c, args.v)
-    fn = proteinid_to_function(args.i, c.cursor(), args.v)
-    fns = proteinid_to_all_functions(args.i, c.cursor(), args.v)
-    fnstr = "\n".join([f"{x} -> {str(y)}" for x,y in sorted(fns.items(), key=lambda item: item[1], reverse=True)])
-    disconnect(c, args.v)
+    if args.x:
+        use_function_index(args.x, args.v)
+
+    if not args.i and not args.f:
+        sys.stderr.write(f"{color.RED}FATAL: Please provide a protein id (-i) or a file of them (-f){color.ENDC}\n")
+        sys.exit(-1)
 
-    print(f"The function of {args.i} is\n'{fn}'")
-    print(f'All the functions are:\n{fnstr}')
+    c = connect_to_db(args.c, args.v)
+
+    if args.f:
+        with open(args.f, 'r') as f:
+            ids = [l.strip() for l in f if l.strip()]
+        for p, fn in proteinids_to_functions(ids, c.cursor(), args.v).items():
+            print(f"{p}\t{fn}")
+        if args.v:
+            sys.stderr.write(f"{color.BLUE}Cache: {protein_functions.stats()}{color.ENDC}\n")
+
+    if args.i:
+        fn = proteinid_to_function(args.i, c.cursor(), args.v)
+        fns = proteinid_to_all_functions(args.i, c.cursor(), args.v)
+        fnstr = "\n".join([f"{x} -> {str(y)}" for x,y in sorted(fns.items(), key=lambda item: item[1], reverse=True)])
+        print(f"The function of {args.i} is\n'{fn}'")
+        print(f'All the functions are:\n{fnstr}')
+
+    disconnect(c, args.v)
@@ -0,0 +1,160 @@
+"""
+Read the members of the clusters in the cluster database.
+
+By default the members of each cluster are in two places: cluster.members is a comma
+separated list of the md5sums, and md5cluster has one row per member. In a normalized
+cluster database (create_databases.py -z, or one converted with this script)
+cluster.members is NULL and md5cluster is the only list of the members. That makes
+the database much smaller and reading cluster rows that do not need the members faster.
+
+The cluster_members setting in the pppf_metadata table is md5cluster for a normalized
+database (and text, or missing, otherwise). Use get_members() and all_cluster_members()
+to read the members, and you get the same answer for both.
+"""
+
+import sys
+import argparse
+from itertools import groupby
+
+from pppf_accessories import color
+from pppf_databases import connect_to_db, disconnect, table_schema
+from pppf_databases.define_database_tables import define_metadata_table
+from pppf_databases.md5_keys import md5_key, md5_hex, md5_format, md5_convert_sql, get_metadata, set_metadata
+
+
+def members_are_normalized(clconn, schema='main'):
+    """
+    Is md5cluster the only list of cluster members?
+    :param clconn: the cluster database connection
+    :param schema: the database schema of the cluster database
+    :return: True if cluster.members is not used
+    """
+    return get_metadata(clconn, 'cluster_members', 'text', schema) == 'md5cluster'
+
+
+def get_members(cluster_rowid, clusterdb_cursor, verbose=False):
+    """
+    Get the members of a cluster
+    :param cluster_rowid: the cluster rowid
+    :param clusterdb_cursor: the cursor to the cluster database
+    :param verbose: more output
+    :return: a list of the member md5sums, or None if there is no such cluster
+    """
+
+    row = clusterdb_cursor.execute("select members from cluster where cluster_rowid = ?", [cluster_rowid]).fetchone()
+    if not row:
+        return None
+    if row[0] is not None:
+        return row[0].split(",")
+    ex = clusterdb_cursor.execute("select protein_md5sum from md5cluster where cluster = ? order by md5cluster_rowid",
+                                  [cluster_rowid])
+    return [md5_hex(m) for (m,) in ex]
+
+
+def all_cluster_members(clconn, clusterdefinition=None, verbose=False):
+    """
+    Get the members of all the clusters (or all the clusters in one cluster definition)
+    :param clconn: the cluster database connection
+    :param clusterdefinition: only the clusters with this clusterdefinition_rowid
+    :param verbose: more output
+    :return: a generator of (cluster_rowid, list of member md5sums)
+    """
+
+    where = "" if clusterdefinition is None else " where c.clusterdefinition = ?"
+    args = [] if clusterdefinition is None else [clusterdefinition]
+    if not members_are_normalized(clconn):
+        ex = clconn.cursor().execute(f"select c.cluster_rowid, c.members from cluster c{where}", args)
+        for (rowid, members) in ex:
+            yield rowid, members.split(",") if members else []
+        return
+
+    ex = clconn.cursor().execute(f"""
+        select m.cluster, m.protein_md5sum from md5cluster m join cluster c on c.cluster_rowid = m.cluster{where}
+        order by m.cluster, m.md5cluster_rowid""", args)
+    for rowid, rows in groupby(ex, key=lambda r: r[0]):
+        yield rowid, [md5_hex(m) for (_, m) in rows]
+
+
+def unclustered_proteins(conn, verbose=False):
+    """
+    Get the protein sequences that are not in any cluster. We do this as one anti-join
+    in SQLite, so conn must have both the phage and cluster databases
+    (see connect_to_phage_and_clusters).
+    :param conn: the connection to both databases
+    :param verbose: more output
+    :return: a generator of (md5sum, protein sequence)
+    """
+
+    phage_schema = table_schema(conn, 'protein_sequence')
+    cluster_schema = table_schema(conn, 'md5cluster')
+    md5sql = md5_convert_sql('ps.protein_md5sum', md5_format(conn, phage_schema), md5_format(conn, cluster_schema))
+    ex = conn.cursor().execute(f"""
+        SELECT ps.protein_md5sum, ps.protein_sequence FROM {phage_schema}.protein_sequence ps
+        WHERE NOT EXISTS (SELECT 1 FROM {cluster_schema}.md5cluster m WHERE m.protein_md5sum = {md5sql})""")
+    for (m, s) in ex:
+        yield md5_hex(m), s
+
+
+def normalize_cluster_members(clconn, verbose=False):
+    """
+    Convert an existing cluster database so that md5cluster is the only list of the
+    members. We add any members that are missing from md5cluster, and then remove
+    cluster.members. This is all one transaction. Run VACUUM afterwards to get the space back.
+    :param clconn: the cluster database connection
+    :param verbose: more output
+    :return: the number of md5cluster rows we added
+    """
+
+    define_metadata_table(clconn, verbose)
+    if members_are_normalized(clconn):
+        if verbose:
+            sys.stderr.write(f"{color.BLUE}The cluster members are already normalized{color.ENDC}\n")
+        return 0
+
+    fmt = md5_format(clconn)
+    c = clconn.cursor()
+    added = 0
+    try:
+        # the md5cluster rows are grouped by cluster and we step through them with the clusters
+        clusters = clconn.cursor().execute("select cluster_rowid, members from cluster where members is not null " +
+                                           "order by cluster_rowid")
+        md5s = groupby(clconn.cursor().execute("select cluster, protein_md5sum from md5cluster order by cluster"),
+                       key=lambda r: r[0])
+        (mcl, mrows) = next(md5s, (None, []))
+        missing = []
+        for (rowid, members) in clusters:
+            while mcl is not None and mcl < rowid:
+                (mcl, mrows) = next(md5s, (None, []))
+            known = {md5_hex(m) for (_, m) in mrows} if mcl == rowid else set()
+            for m in members.split(","):
+                if m and m not in known:
+                    missing.append([md5_key(m, fmt), rowid])
+                    known.add(m)
+        c.executemany("INSERT INTO md5cluster (protein_md5sum, cluster) VALUES (?,?)", missing)
+        added = len(missing)
+        c.execute("UPDATE cluster SET members = NULL")
+        set_metadata(clconn, 'cluster_members', 'md5cluster')
+        clconn.commit()
+    except BaseException:
+        clconn.rollback()
+        raise
+
+    if verbose:
+        sys.stderr.write(f"{color.BLUE}Added {added:,} members to md5cluster and removed cluster.members{color.ENDC}\n")
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Only store the cluster members in the md5cluster table')
+    parser.add_argument('-c', help='cluster SQLite database', required=True)
+    parser.add_argument('-n', help='do not vacuum the database afterwards', action='store_true')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    conn = connect_to_db(args.c, args.v)
+    normalize_cluster_members(conn, args.v)
+    if not args.n:
+        if args.v:
+            sys.stderr.write(f"{color.GREEN}Vacuuming the database{color.ENDC}\n")
+        conn.execute("VACUUM")
+    disconnect(conn, args.v)
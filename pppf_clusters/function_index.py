@@ -0,0 +1,205 @@
+"""
+A binary index of protein md5sum -> cluster -> function that we can mmap, so that we
+can look up the functions of a lot of proteins without using SQLite.
+
+The file is:
+
+    header:     8 byte magic (PPPFIDX1), number of entries, number of functions (little endian uint64s)
+    entries:    sorted fixed width records of 16 byte md5 digest, cluster rowid (uint64), function id (uint32)
+    offsets:    number of functions + 1 uint64 offsets into the strings
+    strings:    the utf-8 function names, one after another
+
+Each function name is only stored once. A protein in more than one cluster has the first
+(lowest rowid) cluster, like proteinids_to_functions(). A function id of NO_FUNCTION
+means the cluster does not have a function.
+
+Opening the index only maps the file, so it is almost instant, and every process that
+opens the same file shares the same pages in memory. A lookup is a binary search over
+the entries.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+
+from pppf_accessories import color
+from pppf_databases import connect_to_db, disconnect
+from pppf_databases.md5_keys import md5_key
+
+MAGIC = b'PPPFIDX1'
+HEADER = struct.Struct('<8sQQ')
+ENTRY = struct.Struct('<16sQI')
+OFFSET = struct.Struct('<Q')
+NO_FUNCTION = 0xFFFFFFFF
+
+
+def build_function_index(clconn, indexfile, verbose=False):
+    """
+    Write the md5sum -> cluster -> function index for a cluster database
+    :param clconn: the cluster database connection
+    :param indexfile: the index file to write
+    :param verbose: more output
+    :return: the number of proteins in the index
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Writing the function index to {indexfile}{color.ENDC}\n")
+
+    # hex and binary md5sums sort the same way, so we can use the database order
+    ex = clconn.cursor().execute("""
+        SELECT m.protein_md5sum, m.cluster, c.function FROM md5cluster m JOIN cluster c ON c.cluster_rowid = m.cluster
+        ORDER BY m.protein_md5sum, m.cluster""")
+    functions = {}
+    n = 0
+    last = None
+    tmpfile = indexfile + ".tmp"
+    with open(tmpfile, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, 0, 0))
+        for (m, cluster, function) in ex:
+            digest = md5_key(m, 'blob')
+            if digest == last:
+                continue
+            last = digest
+            fid = NO_FUNCTION if function is None else functions.setdefault(function, len(functions))
+            out.write(ENTRY.pack(digest, cluster, fid))
+            n += 1
+
+        names = [f.encode('utf-8') for f in functions]
+        offset = 0
+        for name in names:
+            out.write(OFFSET.pack(offset))
+            offset += len(name)
+        out.write(OFFSET.pack(offset))
+        for name in names:
+            out.write(name)
+
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, n, len(names)))
+    os.replace(tmpfile, indexfile)
+
+    if verbose:
+        sys.stderr.write(f"{color.BLUE}Wrote {n:,} proteins and {len(names):,} functions{color.ENDC}\n")
+    return n
+
+
+class FunctionIndex:
+    """
+    Look up the cluster and function of protein md5sums in an index written by build_function_index()
+
+    :ivar indexfile: the index file
+    :ivar entries: the number of proteins in the index
+    :ivar number_of_functions: the number of different functions
+    """
+
+    def __init__(self, indexfile):
+        """
+        Open (mmap) an index
+        :param indexfile: the index file
+        """
+        self.indexfile = indexfile
+        with open(indexfile, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.entries, self.number_of_functions) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            sys.stderr.write(f"{color.RED}FATAL: {indexfile} is not a function index{color.ENDC}\n")
+            sys.exit(-1)
+        self._offsets = HEADER.size + self.entries * ENTRY.size
+        self._strings = self._offsets + (self.number_of_functions + 1) * OFFSET.size
+        self._names = {}
+
+    def _find(self, digest):
+        """
+        Binary search for a digest
+        :param digest: the 16 byte md5 digest
+        :return: the offset of the entry or None if it is not in the index
+        """
+        mm = self._mm
+        lo = 0
+        hi = self.entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = HEADER.size + mid * ENTRY.size
+            key = mm[pos:pos + 16]
+            if key < digest:
+                lo = mid + 1
+            elif key > digest:
+                hi = mid
+            else:
+                return pos
+        return None
+
+    def _function_name(self, fid):
+        """
+        Get the name of a function from its id
+        :param fid: the function id
+        :return: the function
+        """
+        if fid == NO_FUNCTION:
+            return None
+        if fid not in self._names:
+            (start,) = OFFSET.unpack_from(self._mm, self._offsets + fid * OFFSET.size)
+            (end,) = OFFSET.unpack_from(self._mm, self._offsets + (fid + 1) * OFFSET.size)
+            self._names[fid] = self._mm[self._strings + start:self._strings + end].decode('utf-8')
+        return self._names[fid]
+
+    def lookup(self, proteinid):
+        """
+        Get the cluster and function of a protein
+        :param proteinid: the protein md5sum (hex or 16 bytes)
+        :return: (cluster rowid, function) or None if the protein is not in a cluster
+        """
+        try:
+            digest = md5_key(proteinid, 'blob')
+        except ValueError:
+            return None
+        pos = self._find(digest)
+        if pos is None:
+            return None
+        (_, cluster, fid) = ENTRY.unpack_from(self._mm, pos)
+        return cluster, self._function_name(fid)
+
+    def function(self, proteinid):
+        """
+        Get the function of a protein
+        :param proteinid: the protein md5sum
+        :return: the function or None if the protein is not in a cluster
+        """
+        found = self.lookup(proteinid)
+        return found[1] if found else None
+
+    def close(self):
+        self._mm.close()
+
+    def __contains__(self, proteinid):
+        return self.lookup(proteinid) is not None
+
+    def __len__(self):
+        return self.entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or search a binary md5sum -> function index')
+    parser.add_argument('-c', help='cluster database to build the index from')
+    parser.add_argument('-x', help='the index file', required=True)
+    parser.add_argument('-i', help='protein id(s) to look up in the index', nargs='+')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    if args.c:
+        conn = connect_to_db(args.c, args.v)
+        build_function_index(conn, args.x, args.v)
+        disconnect(conn, args.v)
+
+    if args.i:
+        with FunctionIndex(args.x) as idx:
+            for p in args.i:
+                print(f"{p}\t{idx.function(p)}")
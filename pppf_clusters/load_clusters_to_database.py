@@ -31,33 +31,37 @@ Our cluster tables have these structures:
 
 import sys
 import json
+from itertools import groupby, islice
 
-from pppf_databases import connect_to_db, disconnect
+from pppf_databases import connect_to_db, disconnect, table_schema
+from pppf_databases.database_handles import table_has_column
+from pppf_databases.md5_keys import md5_key, md5_hex, md5_format, md5_convert_sql
 from .cluster import Cluster
-from pppf_accessories import color
+from .cluster_members import members_are_normalized
+from pppf_accessories import color, open_file
 
-def read_mmseqs_clusters(clf, verbose=False):
+def stream_mmseqs_clusters(clf, verbose=False):
     """
-    Read all the clusters at once and return an array of clusters.
+    Read the clusters one at a time. The file must be sorted (or at least grouped) by
+    the representative, as mmseqs writes it, and may be compressed.
     :param clf: mmseqs cluster file that has [id1, id2] where id1 is the representative of the cluster
     :param verbose: more output
-    :return: the list of clusters
+    :return: a generator of clusters
     """
 
-    cls = []
     cc = 0
     if verbose:
         sys.stderr.write(f"{color.GREEN}Reading {clf}{color.ENDC}\n")
 
     lastclid = None
     thiscls = set()
-    with open(clf, 'r') as f:
+    with open_file(clf) as f:
         for l in f:
             p = l.strip().split("\t")
             if lastclid != p[0]:
                 # this is a new cluster
                 if lastclid:
-                    cls.append(Cluster(None, lastclid, thiscls))
+                    yield Cluster(None, lastclid, thiscls)
                     cc += 1
                 lastclid = p[0]
                 thiscls = set()
@@ -65,84 +69,165 @@ def read_mmseqs_clusters(clf, verbose=False):
 
     # don't forget the last cluster!
     if lastclid:
-        cls.append(Cluster(None, lastclid, thiscls))
+        yield Cluster(None, lastclid, thiscls)
         cc += 1
 
     if verbose:
         sys.stderr.write(f"{color.BLUE}There were {cc} clusters{color.ENDC}\n")
-    return cls
 
 
-def add_functions_to_clusters(cls, phageconn, verbose=False):
+def read_mmseqs_clusters(clf, verbose=False):
+    """
+    Read all the clusters at once and return an array of clusters.
+    :param clf: mmseqs cluster file that has [id1, id2] where id1 is the representative of the cluster
+    :param verbose: more output
+    :return: the list of clusters
+    """
+
+    return list(stream_mmseqs_clusters(clf, verbose))
+
+
+def chunk_clusters(clusters, chunk_size=10000):
+    """
+    Split a stream of clusters into lists of clusters
+    :param clusters: an iterable of clusters
+    :param chunk_size: the number of clusters in each list
+    :return: a generator of lists of clusters
+    """
+
+    clusters = iter(clusters)
+    while True:
+        chunk = list(islice(clusters, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def add_functions_to_clusters(cls, phageconn, verbose=False, commit=True):
     """
     Add the protein functions to the clusters.
+
+    Rather than querying the protein table for every member, we put the (cluster, md5sum)
+    pairs into a temporary table and get the lengths and functions for all the clusters
+    with two grouped joins against the protein table.
+
     :param cls: The list of clusters
-    :param phageconn: The phage database connection
+    :param phageconn: The phage database connection (or a connection with the phage database attached)
     :param verbose: More output
+    :param commit: commit when we are done. Set this to False if phageconn is also the connection we are loading the clusters with
     :return: A modified list of cluster objects that includes the functions
     """
 
     if verbose:
         sys.stderr.write(f"{color.GREEN}Adding functions to clusters{color.ENDC}\n")
 
+    # the md5sums in the temporary table are in the same format as the protein table
+    fmt = md5_format(phageconn, table_schema(phageconn, 'protein'))
     cur = phageconn.cursor()
-    
+    cur.execute("DROP TABLE IF EXISTS temp.cluster_member")
+    cur.execute("CREATE TEMP TABLE cluster_member (cluster INTEGER, protein_md5sum TEXT)")
+    cur.executemany("INSERT INTO temp.cluster_member (cluster, protein_md5sum) VALUES (?,?)",
+                    ((cc, md5_key(m, fmt)) for cc, clu in enumerate(cls) for m in clu.members))
+    cur.execute("CREATE INDEX temp.cluster_member_idx ON cluster_member(cluster, protein_md5sum)")
+
     protein_info = {}
 
-    cn = len(cls)
+    # the lengths of the proteins for each member. Every protein with that md5sum counts
+    # towards the average, and we only save one row id (the last one).
+    # this should probably refer to the protein_sequence table now we are using md5sums
+    lcur = phageconn.cursor()
+    lengths = groupby(lcur.execute("""
+        SELECT m.cluster, m.protein_md5sum, min(p.length), max(p.length), count(p.length), sum(p.length),
+        max(p.protein_rowid)
+        FROM cluster_member m JOIN protein p ON p.protein_md5sum = m.protein_md5sum
+        GROUP BY m.cluster, m.protein_md5sum
+        ORDER BY m.cluster
+        """), key=lambda r: r[0])
+
+    # the function histograms. We sort these so the most abundant function is first. If the
+    # proteins have is_hypothetical we also get that, so we do not need to classify the functions again
+    hypothetical = "min(p.is_hypothetical)" if table_has_column(phageconn, 'protein', 'is_hypothetical') else "NULL"
+    fcur = phageconn.cursor()
+    functions = groupby(fcur.execute(f"""
+        SELECT m.cluster, p.product, count(*) AS n, {hypothetical}
+        FROM cluster_member m JOIN protein p ON p.protein_md5sum = m.protein_md5sum
+        GROUP BY m.cluster, p.product
+        ORDER BY m.cluster, n DESC, p.product
+        """), key=lambda r: r[0])
+
+    # both queries are sorted by cluster, so we can step through them together
     for cc, clu in enumerate(cls):
-        """
-        if verbose:
-            sys.stderr.write(f"{color.PINK}\tCluster {cc} of {cn}: {clu.id}{color.ENDC}\n")
-        """
-
-        plens = []
-
-        # note we retrieve the information for the exemplar first and
-        # then if it is the longest/shortest it remains that way
-        ex = cur.execute("select product, length from protein where protein_md5sum=?", [clu.exemplar])
-        tple = ex.fetchone()
-        if not tple:
+        (lcc, lrows) = next(lengths, (None, []))
+        members = {}
+        for (_, md5, minlen, maxlen, n, sumlen, prid) in lrows:
+            md5 = md5_hex(md5)
+            members[md5] = (minlen, maxlen, n, sumlen)
+            protein_info[md5] = prid
+        if lcc != cc or clu.exemplar not in members:
             sys.stderr.write(f"{color.RED}ERROR retrieving information about cluster exemplar {clu.exemplar} from the database.\nCan't continue{color.ENDC}\n")
             sys.exit(-1)
-        (prdct, seqlen) = tple
+        frows = list(next(functions)[1])
+
+        # the exemplar is longest/shortest unless another member is strictly longer/shorter
         shortestid = longestid = clu.exemplar
-        shortestlen = longestlen = seqlen
+        (shortestlen, longestlen) = members[clu.exemplar][0:2]
+        for md5, (minlen, maxlen, n, sumlen) in members.items():
+            if maxlen > longestlen:
+                longestid = md5
+                longestlen = maxlen
+            if minlen < shortestlen:
+                shortestid = md5
+                shortestlen = minlen
 
-        for c in clu.members:
-            ex = cur.execute("select product, length, protein_rowid from protein where protein_md5sum=?", [c])
-            for tple in ex.fetchall():
-                if not tple:
-                    sys.stderr.write(f"{color.RED}ERROR retrieving information about {c} from the database{color.ENDC}\n")
-                    continue
-                (prdct, seqlen, prid) = tple
-                # we only save one row id.
-                # this should probably refer to the protein_sequence table
-                # now we are using md5sums
-                protein_info[c] = prid
-                if seqlen > longestlen:
-                    longestid = c
-                    longestlen = seqlen
-                if seqlen < shortestlen:
-                    shortestid = c
-                    shortestlen = seqlen
-                plens.append(seqlen)
-                clu.functions[prdct] = clu.functions.get(prdct, 0) + 1
         clu.longest_id = longestid
         clu.longest_len = longestlen
         clu.shortest_id = shortestid
         clu.shortest_len = shortestlen
-        clu.average_size = sum(plens)/len(plens)
-        clu.number_of_functions = len(clu.functions)
-        allfn = sorted(clu.functions.items(), key=lambda item: item[1], reverse=True)
+        clu.average_size = sum(m[3] for m in members.values()) / sum(m[2] for m in members.values())
+        clu.set_functions({prdct: n for (_, prdct, n, _) in frows})
         assert isinstance(clu, Cluster)
-        clu.function = allfn[0][0]
-        clu.is_hypothetical()
+        clu.function = next(iter(clu.functions))
+        flags = [h for (_, _, _, h) in frows]
+        if None in flags:
+            clu.is_hypothetical()
+        else:
+            clu.only_hypothetical = all(flags)
+
+    lcur.close()
+    fcur.close()
+    cur.execute("DROP TABLE temp.cluster_member")
+    if commit:
+        phageconn.commit()
 
     return (cls, protein_info)
 
 
-def insert_cluster_metadata(clconn, name, desc, cli, verbose=False):
+def update_only_hypothetical(conn, verbose=False):
+    """
+    Set cluster.only_hypothetical for all the clusters from the is_hypothetical flags of
+    their proteins. This is one update in SQLite, so conn must have both the phage and
+    cluster databases (see connect_to_phage_and_clusters). This does not commit.
+    :param conn: the connection to both databases
+    :param verbose: more output
+    :return: the number of clusters
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Setting only_hypothetical for the clusters{color.ENDC}\n")
+
+    phage_schema = table_schema(conn, 'protein')
+    cluster_schema = table_schema(conn, 'cluster')
+    md5sql = md5_convert_sql('m.protein_md5sum', md5_format(conn, cluster_schema), md5_format(conn, phage_schema))
+    c = conn.cursor()
+    c.execute(f"""
+        UPDATE {cluster_schema}.cluster SET only_hypothetical = NOT EXISTS (
+            SELECT 1 FROM {cluster_schema}.md5cluster m JOIN {phage_schema}.protein p ON p.protein_md5sum = {md5sql}
+            WHERE m.cluster = cluster.cluster_rowid AND p.is_hypothetical = 0)
+        """)
+    return c.rowcount
+
+
+def insert_cluster_metadata(clconn, name, desc, cli, verbose=False, commit=True):
     """
     Insert the cluster metadata information in the SQL table and return its rowid.
     This is the information that describes how the clusters were made.
@@ -151,6 +236,7 @@ def insert_cluster_metadata(clconn, name, desc, cli, verbose=False):
     :param desc: a human readable description of the clustering
     :param cli: the command line command used for the clustering
     :param verbose: more output
+    :param commit: commit the metadata. Set this to False to add it in the same transaction as the clusters
     :return: the clusterdefinition_rowid for this metadata
     """
 
@@ -161,19 +247,31 @@ def insert_cluster_metadata(clconn, name, desc, cli, verbose=False):
     clcur.execute("INSERT INTO clusterdefinition(name, description, command) values (?,?,?)",
                 [name, desc, cli])
     cd_rowid = clcur.lastrowid
-    clconn.commit()
+    if commit:
+        clconn.commit()
     return cd_rowid
 
 
-def insert_into_database(clusters, clconn, phageconn, metadata_id, protein_info, verbose=False):
+def insert_into_database(clusters, clconn, phageconn, metadata_id, protein_info, verbose=False, commit=True,
+                         batch_size=10000):
     """
-    Insert information into the database
+    Insert information into the database.
+
+    We assign the cluster rowids ourselves so that we can write the clusters and
+    their members with executemany, batch_size clusters at a time.
+
+    If clconn is also phageconn (see connect_to_phage_and_clusters) we write the members
+    to md5cluster and then make the proteincluster rows with one join against the protein
+    table, rather than looking up the members that are not in protein_info one at a time.
+
     :param clusters: The array of clusters with their functions
     :param clconn: the clusters database connection
-    :param phageconn: the phage database connection
+    :param phageconn: the phage database connection. This can be the same as clconn
     :param metadata_id: the rowid of the cluster definition table
-    :param protein_info: a dict of [protein id: protein_rowid]
+    :param protein_info: a dict of [protein id: protein_rowid]. This is not needed if clconn is phageconn
     :param verbose: more output
+    :param commit: commit when we are done. Set this to False to add the clusters in the same transaction as the metadata
+    :param batch_size: the number of clusters to write with each executemany
     :return:
     """
 
@@ -188,32 +286,161 @@ def insert_into_database(clusters, clconn, phageconn, metadata_id, protein_info,
 
     clcur = clconn.cursor()
     phcur = phageconn.cursor()
-
-    for c in clusters:
-        sql = """
-            INSERT INTO cluster (uuid, clusterdefinition, members, exemplar, longest_id, longest_len, shortest_id, 
-            shortest_len, average_size, number_of_members, functions, function, 
-            number_of_functions, only_hypothetical)
-            VALUES  (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """
-        data = [
-            c.id, metadata_id, ",".join(c.members), c.exemplar, c.longest_id, c.longest_len, c.shortest_id,
-            c.shortest_len, c.average_size, c.number_of_members, json.dumps(c.functions), c.function,
-            c.number_of_functions, c.only_hypothetical
-        ]
-        clcur.execute(sql, data)
-        cluster_id = clcur.lastrowid
-        for m in c.members:
-            if m not in protein_info:
-                exc = phcur.execute("select protein_sequence_rowid from protein_sequence where protein_md5sum = ?", [m])
-                tple = exc.fetchone()
-                if not tple[0]:
-                    sys.stderr.write(f"{color.RED}No protein info for {m}{color.ENDC}\n")
+    attached = clconn is phageconn
+    phage_schema = table_schema(phageconn, 'protein')
+    cluster_schema = table_schema(clconn, 'cluster')
+    phage_format = md5_format(phageconn, phage_schema)
+    cluster_format = md5_format(clconn, cluster_schema)
+    # in a normalized database md5cluster is the only list of the members, so it must have all of them
+    normalized = members_are_normalized(clconn, cluster_schema)
+
+    cluster_id = (clcur.execute("select max(cluster_rowid) from cluster").fetchone()[0] or 0) + 1
+
+    for i in range(0, len(clusters), batch_size):
+        cluster_rows = []
+        protein_rows = []
+        md5_rows = []
+        first_id = cluster_id
+        for c in clusters[i:i+batch_size]:
+            cluster_rows.append([
+                cluster_id, c.id, metadata_id, None if normalized else ",".join(c.members), c.exemplar,
+                c.longest_id, c.longest_len,
+                c.shortest_id, c.shortest_len, c.average_size, c.number_of_members, json.dumps(c.functions),
+                c.function, c.number_of_functions, c.only_hypothetical
+            ])
+            for m in c.members:
+                if normalized or attached:
+                    md5_rows.append([md5_key(m, cluster_format), cluster_id])
+                if attached:
                     continue
-                protein_info[m] = tple[0]
-            clcur.execute("INSERT INTO proteincluster (protein, cluster) VALUES (?,?)", [protein_info[m], cluster_id])
-            clcur.execute("INSERT INTO md5cluster (protein_md5sum, cluster) VALUES (?,?)", [m, cluster_id])
-            clconn.commit()
+                if m not in protein_info:
+                    exc = phcur.execute("select protein_sequence_rowid from protein_sequence where protein_md5sum = ?",
+                                        [md5_key(m, phage_format)])
+                    tple = exc.fetchone()
+                    if not tple:
+                        sys.stderr.write(f"{color.RED}No protein info for {m}{color.ENDC}\n")
+                        continue
+                    protein_info[m] = tple[0]
+                protein_rows.append([protein_info[m], cluster_id])
+                if not normalized:
+                    md5_rows.append([md5_key(m, cluster_format), cluster_id])
+            cluster_id += 1
+
+        clcur.executemany("""
+            INSERT INTO cluster (cluster_rowid, uuid, clusterdefinition, members, exemplar, longest_id, longest_len, 
+            shortest_id, shortest_len, average_size, number_of_members, functions, function, 
+            number_of_functions, only_hypothetical)
+            VALUES  (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, cluster_rows)
+        if attached:
+            clcur.executemany(f"INSERT INTO {cluster_schema}.md5cluster (protein_md5sum, cluster) VALUES (?,?)",
+                              md5_rows)
+            _join_protein_clusters(clcur, first_id, cluster_id - 1, cluster_schema, phage_schema,
+                                   md5_convert_sql('m.protein_md5sum', cluster_format, phage_format), normalized)
+            continue
+        clcur.executemany("INSERT INTO proteincluster (protein, cluster) VALUES (?,?)", protein_rows)
+        clcur.executemany("INSERT INTO md5cluster (protein_md5sum, cluster) VALUES (?,?)", md5_rows)
+
+    if commit:
+        clconn.commit()
+
+
+def _join_protein_clusters(cur, first_id, last_id, cluster_schema, phage_schema, md5sql, normalized):
+    """
+    Make the proteincluster rows for some clusters from their md5cluster rows with one join
+    against the protein table in the attached phage database. Like insert_into_database we
+    report the members that are not in the phage database, and unless the database is
+    normalized they are not kept in md5cluster.
+    :param cur: the cursor with both databases
+    :param first_id: the first cluster_rowid
+    :param last_id: the last cluster_rowid
+    :param cluster_schema: the schema of the cluster database
+    :param phage_schema: the schema of the phage database
+    :param md5sql: the SQL for m.protein_md5sum in the format of the phage database
+    :param normalized: md5cluster is the only list of the members
+    """
+
+    missing = f"""NOT EXISTS (SELECT 1 FROM {phage_schema}.protein p WHERE p.protein_md5sum = {md5sql})"""
+    for (m,) in cur.execute(f"""SELECT m.protein_md5sum FROM {cluster_schema}.md5cluster m
+                               WHERE m.cluster BETWEEN ? AND ? AND {missing}""", [first_id, last_id]).fetchall():
+        sys.stderr.write(f"{color.RED}No protein info for {md5_hex(m)}{color.ENDC}\n")
+        if not normalized:
+            cur.execute(f"DELETE FROM {cluster_schema}.md5cluster WHERE cluster BETWEEN ? AND ? AND protein_md5sum = ?",
+                        [first_id, last_id, m])
+
+    # we use the last protein with each md5sum, like add_functions_to_clusters
+    cur.execute(f"""
+        INSERT INTO {cluster_schema}.proteincluster (protein, cluster)
+        SELECT (SELECT max(p.protein_rowid) FROM {phage_schema}.protein p WHERE p.protein_md5sum = {md5sql}), m.cluster
+        FROM {cluster_schema}.md5cluster m
+        WHERE m.cluster BETWEEN ? AND ? AND NOT {missing}
+        ORDER BY m.md5cluster_rowid
+        """, [first_id, last_id])
+
+
+def load_cluster_definition(clusters, clconn, phageconn, name, desc, cli, protein_info, verbose=False):
+    """
+    Add a cluster definition and all of its clusters in a single transaction. If
+    anything goes wrong we roll the whole definition back, so we never have half
+    a clustering in the database.
+    :param clusters: The array of clusters with their functions
+    :param clconn: the clusters database connection
+    :param phageconn: the phage database connection
+    :param name: the name of the clustering approach
+    :param desc: a human readable description of the clustering
+    :param cli: the command line command used for the clustering
+    :param protein_info: a dict of [protein id: protein_rowid]
+    :param verbose: more output
+    :return: the clusterdefinition_rowid for this clustering
+    """
+
+    try:
+        metadata_id = insert_cluster_metadata(clconn, name, desc, cli, verbose, commit=False)
+        insert_into_database(clusters, clconn, phageconn, metadata_id, protein_info, verbose, commit=False)
+        clconn.commit()
+    except BaseException:
+        # this includes sys.exit() so we do not commit the partial clustering when we disconnect
+        sys.stderr.write(f"{color.RED}Rolling back the clustering {name}{color.ENDC}\n")
+        clconn.rollback()
+        raise
+    return metadata_id
+
+
+def load_clusters(clf, clconn, phageconn, name, desc, cli, chunk_size=10000, verbose=False):
+    """
+    Read, enrich, and insert a clustering as a pipeline. We read chunk_size clusters
+    at a time from the cluster file, add their functions, and insert them, so the memory
+    we need does not depend on how big the clustering is.
+
+    Like load_cluster_definition everything goes in a single transaction, and if anything
+    goes wrong we roll the whole definition back.
+
+    :param clf: mmseqs cluster file that has [id1, id2] where id1 is the representative of the cluster
+    :param clconn: the clusters database connection
+    :param phageconn: the phage database connection. This can be the same as clconn (see connect_to_phage_and_clusters)
+    :param name: the name of the clustering approach
+    :param desc: a human readable description of the clustering
+    :param cli: the command line command used for the clustering
+    :param chunk_size: the number of clusters to work on at a time
+    :param verbose: more output
+    :return: the clusterdefinition_rowid for this clustering
+    """
+
+    n = 0
+    try:
+        metadata_id = insert_cluster_metadata(clconn, name, desc, cli, verbose, commit=False)
+        for chunk in chunk_clusters(stream_mmseqs_clusters(clf, verbose), chunk_size):
+            (chunk, protein_info) = add_functions_to_clusters(chunk, phageconn, commit=phageconn is not clconn)
+            insert_into_database(chunk, clconn, phageconn, metadata_id, protein_info, commit=False)
+            n += len(chunk)
+            if verbose:
+                sys.stderr.write(f"{color.BLUE}Loaded {n:,} clusters{color.ENDC}\n")
+        clconn.commit()
+    except BaseException:
+        sys.stderr.write(f"{color.RED}Rolling back the clustering {name}{color.ENDC}\n")
+        clconn.rollback()
+        raise
+    return metadata_id
 
 
 if __name__ == '__main__':
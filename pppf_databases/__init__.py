@@ -1,9 +1,16 @@
-from .define_database_tables import define_phage_tables, define_cluster_tables
-from .database_handles import connect_to_db, disconnect
+from .define_database_tables import define_phage_tables, define_phage_indexes, define_cluster_tables
+from .database_handles import connect_to_db, disconnect, bulk_load_pragmas, safe_pragmas
+from .database_handles import attach_database, connect_to_phage_and_clusters, table_schema, table_has_column
+from .md5_keys import md5_key, md5_hex, md5_format
 from .load_sequences_from_genbank import load_genbank_file
+from .parallel_loader import load_genbank_files
 from .db_to_fasta import protein_to_fasta
+from .sequences import genome_sequence, gene_sequence, trna_sequence, feature_sequences, compact_sequences
 from .download_databases import download_all_databases
 __all__ = [
-    'define_phage_tables', 'define_cluster_tables', 'connect_to_db', 'disconnect',
-    'load_genbank_file', 'protein_to_fasta', 'download_all_databases'
+    'define_phage_tables', 'define_phage_indexes', 'define_cluster_tables', 'connect_to_db', 'disconnect',
+    'bulk_load_pragmas', 'safe_pragmas', 'md5_key', 'md5_hex', 'md5_format',
+    'attach_database', 'connect_to_phage_and_clusters', 'table_schema', 'table_has_column',
+    'load_genbank_file', 'load_genbank_files', 'protein_to_fasta', 'download_all_databases',
+    'genome_sequence', 'gene_sequence', 'trna_sequence', 'feature_sequences', 'compact_sequences'
 ]
@@ -6,6 +6,7 @@ import sys
 import os
 import sqlite3
 from pppf_accessories import color
+from pppf_databases.md5_keys import register_md5_functions
 
 
 def connect_to_db(dbname, verbose=False):
@@ -29,6 +30,7 @@ def connect_to_db(dbname, verbose=False):
         sys.stderr.write(f"{color.GREEN}Connected to database: {sqlite3.version}{color.ENDC}\n")
 
     conn.execute("PRAGMA foreign_keys = ON;")
+    register_md5_functions(conn)
 
     return conn
 
@@ -47,4 +49,110 @@ def disconnect(conn, verbose=False):
         sys.stderr.write(f"{color.RED}There was no database connection!{color.ENDC}\n")
 
 
+def attach_database(conn, dbname, schema, verbose=False):
+    """
+    Attach another database to a connection, so we can join tables in both databases
+    :param conn: the database connection
+    :param dbname: the database file name to attach
+    :param schema: the name to use for the attached database (e.g. phage)
+    :param verbose: print addtional output
+    :return: the database connection
+    """
+    if not os.path.exists(dbname):
+        sys.stderr.write(f"{color.RED}FATAL: {dbname} does not exist. Cannot attach it{color.ENDC}\n")
+        sys.exit(-1)
+
+    conn.commit()
+    conn.execute("ATTACH DATABASE ? AS " + schema, [dbname])
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Attached {dbname} as {schema}{color.ENDC}\n")
+
+    return conn
+
+
+def connect_to_phage_and_clusters(phagedb, clustersdb, verbose=False):
+    """
+    Open one connection to both databases. The cluster database is main, and the
+    phage database is attached as phage. The table names are different in the two
+    databases so you can use them without the schema (except for pppf_metadata),
+    and pass the same connection as both clconn and phageconn.
+    :param phagedb: the phage database file name
+    :param clustersdb: the cluster database file name
+    :param verbose: print addtional output
+    :return: the database connection
+    """
 
+    conn = connect_to_db(clustersdb, verbose)
+    return attach_database(conn, phagedb, 'phage', verbose)
+
+
+def table_schema(conn, table):
+    """
+    Which of the databases on this connection has a table?
+    :param conn: the database connection
+    :param table: the table name
+    :return: the schema name (main if we do not find it)
+    """
+
+    for (_, schema, _) in conn.execute("PRAGMA database_list").fetchall():
+        if conn.execute(f"select 1 from {schema}.sqlite_master where type = 'table' and name = ?", [table]).fetchone():
+            return schema
+    return 'main'
+
+
+def table_has_column(conn, table, column):
+    """
+    Does a table have a column? We use this for columns that were added after the table
+    was first defined, which older databases may not have.
+    :param conn: the database connection
+    :param table: the table name
+    :param column: the column name
+    :return: True if the table has the column
+    """
+
+    schema = table_schema(conn, table)
+    return column in [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def bulk_load_pragmas(conn, verbose=False):
+    """
+    Set the database up for loading a lot of data into a new database. We turn off
+    the journal and syncing, and use a large cache. This is fast but it is not safe:
+    if the load crashes the database may be corrupt and you should start again.
+
+    We also turn off the foreign key checks, because the table that the foreign keys
+    point to will not have its indexes yet.
+
+    Use safe_pragmas() to go back to the normal settings when the load is complete.
+    :param conn: the database connection
+    :param verbose: print addtional output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Setting the database up for a bulk load{color.ENDC}\n")
+
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = OFF;")
+    conn.execute("PRAGMA journal_mode = OFF;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    conn.execute("PRAGMA cache_size = -1048576;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+
+def safe_pragmas(conn, verbose=False):
+    """
+    Restore the default, safe, settings for the database after a bulk load
+    :param conn: the database connection
+    :param verbose: print addtional output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Restoring the default database settings{color.ENDC}\n")
+
+    conn.commit()
+    conn.execute("PRAGMA journal_mode = DELETE;")
+    conn.execute("PRAGMA synchronous = FULL;")
+    conn.execute("PRAGMA cache_size = -2000;")
+    conn.execute("PRAGMA temp_store = DEFAULT;")
+    conn.execute("PRAGMA foreign_keys = ON;")
@@ -1,5 +1,6 @@
 
 from pppf_accessories import color
+from pppf_databases.md5_keys import md5_hex
 import sys
 __author__ = 'Rob Edwards'
 
@@ -24,7 +25,7 @@ def protein_to_fasta(conn, outputfile=None, verbose=False):
     ex = conn.cursor().execute("SELECT protein_md5sum, protein_sequence from protein_sequence")
     out = open(outputfile, 'w') if outputfile else sys.stdout
     for row in ex.fetchall():
-        out.write(f">{row[0]}\n{row[1]}\n")
+        out.write(f">{md5_hex(row[0])}\n{row[1]}\n")
     
     if out is not sys.stdout:
         out.close() 
@@ -7,12 +7,14 @@ import argparse
 
 from pppf_databases import database_handles
 from pppf_accessories import color
+from pppf_lib.functions import is_hypothetical
 
-def define_genome_table(conn, verbose=False):
+def define_genome_table(conn, verbose=False, indexes=True):
     """
     Define the genome table
     :param conn: The database connection
     :param verbose: more output
+    :param indexes: also create the indexes. Set this to False if you are going to bulk load the table
     :return:
     """
 
@@ -41,17 +43,35 @@ def define_genome_table(conn, verbose=False):
                 sequence_md5 TEXT,
                 length INTEGER
             )""")
-    conn.cursor().execute("CREATE UNIQUE INDEX genome_idx1 ON genome(genome_rowid);")
-    conn.cursor().execute("CREATE INDEX genome_idx2 ON genome(genome_rowid, identifier);")
-    conn.cursor().execute("CREATE INDEX genome_idx3 ON genome(genome_rowid, accession);")
-    conn.cursor().execute("CREATE INDEX genome_idx4 ON genome(accession, identifier);")
     conn.commit()
 
-def define_gene_table(conn, verbose=False):
+    if indexes:
+        define_genome_indexes(conn, verbose)
+
+def define_genome_indexes(conn, verbose=False):
+    """
+    Create the indexes on the genome table
+    :param conn: The database connection
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Indexing GENOME table{color.ENDC}\n")
+
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS genome_idx1 ON genome(genome_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS genome_idx2 ON genome(genome_rowid, identifier);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS genome_idx3 ON genome(genome_rowid, accession);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS genome_idx4 ON genome(accession, identifier);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS genome_idx5 ON genome(name);")
+    conn.commit()
+
+def define_gene_table(conn, verbose=False, indexes=True):
     """
     Define the gene table
     :param conn: The database connection
     :param verbose: more output
+    :param indexes: also create the indexes. Set this to False if you are going to bulk load the table
     :return:
     """
 
@@ -72,18 +92,35 @@ def define_gene_table(conn, verbose=False):
             db_xref TEXT,
             dna_sequence_md TEXT
         )""")
-    conn.cursor().execute("CREATE UNIQUE INDEX gene_idx1 ON gene(gene_rowid);")
-    conn.cursor().execute("CREATE INDEX gene_idx2 ON gene(accession, gene_rowid);")
-    conn.cursor().execute("CREATE INDEX gene_idx3 ON gene(protein, gene_rowid);")
-    conn.cursor().execute("CREATE INDEX gene_idx4 ON gene(dna_sequence_md, gene_rowid);")
     conn.commit()
 
+    if indexes:
+        define_gene_indexes(conn, verbose)
 
-def define_protein_table(conn, verbose=False):
+def define_gene_indexes(conn, verbose=False):
+    """
+    Create the indexes on the gene table
+    :param conn: The database connection
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Indexing GENE table{color.ENDC}\n")
+
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS gene_idx1 ON gene(gene_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS gene_idx2 ON gene(accession, gene_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS gene_idx3 ON gene(protein, gene_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS gene_idx4 ON gene(dna_sequence_md, gene_rowid);")
+    conn.commit()
+
+
+def define_protein_table(conn, verbose=False, indexes=True):
     """
     Define the protein table
     :param conn: The database connection
     :param verbose: more output
+    :param indexes: also create the indexes. Set this to False if you are going to bulk load the table
     :return:
     """
 
@@ -106,15 +143,54 @@ def define_protein_table(conn, verbose=False):
             note TEXT, 
             ribosomal_slippage TEXT, 
             transl_table TEXT,
+            is_hypothetical INTEGER,
             FOREIGN KEY (protein_md5sum) REFERENCES protein_sequence(protein_md5sum)
         )""")
-    conn.cursor().execute("CREATE UNIQUE INDEX protein_idx1 ON protein(protein_rowid);")
-    conn.cursor().execute("CREATE INDEX protein_idx2 ON protein(protein_id, protein_rowid);")
-    conn.cursor().execute("CREATE INDEX protein_idx3 ON protein(gene, protein_rowid);")
-    conn.cursor().execute("CREATE INDEX protein_idx4 ON protein(protein_md5sum, protein_rowid);")
     conn.commit()
 
-def define_protein_sequence_table(conn, verbose=False):
+    if indexes:
+        define_protein_indexes(conn, verbose)
+
+def define_protein_indexes(conn, verbose=False):
+    """
+    Create the indexes on the protein table
+    :param conn: The database connection
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Indexing PROTEIN table{color.ENDC}\n")
+
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS protein_idx1 ON protein(protein_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS protein_idx2 ON protein(protein_id, protein_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS protein_idx3 ON protein(gene, protein_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS protein_idx4 ON protein(protein_md5sum, protein_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS protein_idx5 ON protein(is_hypothetical, contig);")
+    conn.commit()
+
+def define_hypothetical_column(conn, verbose=False, indexes=True):
+    """
+    Add the is_hypothetical column to the protein table of an older database, and fill in
+    any proteins that do not have it. We only classify each different product once.
+    :param conn: The database connection
+    :param verbose: more output
+    :param indexes: also create the index on is_hypothetical
+    :return:
+    """
+
+    if not database_handles.table_has_column(conn, 'protein', 'is_hypothetical'):
+        if verbose:
+            sys.stderr.write(f"{color.GREEN}Adding is_hypothetical to the PROTEIN table{color.ENDC}\n")
+        conn.cursor().execute("ALTER TABLE protein ADD COLUMN is_hypothetical INTEGER")
+
+    conn.create_function("is_hypothetical", 1, lambda f: int(is_hypothetical(f)), deterministic=True)
+    conn.cursor().execute("UPDATE protein SET is_hypothetical = is_hypothetical(product) WHERE is_hypothetical IS NULL")
+    if indexes:
+        conn.cursor().execute("CREATE INDEX IF NOT EXISTS protein_idx5 ON protein(is_hypothetical, contig);")
+    conn.commit()
+
+def define_protein_sequence_table(conn, verbose=False, indexes=True):
     """
     The protein sequence only holds the md5sum and the sequence of the protein.
 
@@ -124,6 +200,7 @@ def define_protein_sequence_table(conn, verbose=False):
 
     :param conn: the connection
     :param verbose: more output
+    :param indexes: also create the indexes. Set this to False if you are going to bulk load the table
     :return:
     """
 
@@ -137,18 +214,35 @@ def define_protein_sequence_table(conn, verbose=False):
             protein_sequence TEXT
         )
     """)
-    conn.cursor().execute("CREATE UNIQUE INDEX ps_idx0 ON protein_sequence(protein_md5sum);")
-    conn.cursor().execute("CREATE UNIQUE INDEX ps_idx1 ON protein_sequence(protein_sequence_rowid);")
-    conn.cursor().execute("CREATE INDEX ps_idx2 ON protein_sequence(protein_md5sum, protein_sequence);")
-    conn.cursor().execute("CREATE INDEX ps_idx3 ON protein_sequence(protein_sequence, protein_md5sum);")
+    conn.commit()
+
+    if indexes:
+        define_protein_sequence_indexes(conn, verbose)
+
+def define_protein_sequence_indexes(conn, verbose=False):
+    """
+    Create the indexes on the protein_sequence table
+    :param conn: The database connection
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Indexing protein sequence table{color.ENDC}\n")
+
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS ps_idx0 ON protein_sequence(protein_md5sum);")
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS ps_idx1 ON protein_sequence(protein_sequence_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS ps_idx2 ON protein_sequence(protein_md5sum, protein_sequence);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS ps_idx3 ON protein_sequence(protein_sequence, protein_md5sum);")
     conn.commit()
     
 
-def define_trna_table(conn, verbose=False):
+def define_trna_table(conn, verbose=False, indexes=True):
     """
     Define the tRNA table
     :param conn: the connection
     :param verbose: more output
+    :param indexes: also create the indexes. Set this to False if you are going to bulk load the table
     :return:
     """
 
@@ -173,8 +267,78 @@ def define_trna_table(conn, verbose=False):
             is_tmRNA INTEGER
         )
     """)
-    conn.cursor().execute("CREATE UNIQUE INDEX trna_idx1 ON trna(trna_rowid);")
-    conn.cursor().execute("CREATE INDEX trna_idx2 ON trna(dna_sequence_md5, dna_sequence);")
+    conn.commit()
+
+    if indexes:
+        define_trna_indexes(conn, verbose)
+
+def define_trna_indexes(conn, verbose=False):
+    """
+    Create the indexes on the trna table
+    :param conn: The database connection
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Indexing tRNA table{color.ENDC}\n")
+
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS trna_idx1 ON trna(trna_rowid);")
+    conn.cursor().execute("CREATE INDEX IF NOT EXISTS trna_idx2 ON trna(dna_sequence_md5, dna_sequence);")
+    conn.commit()
+
+
+def define_load_journal_table(conn, verbose=False):
+    """
+    Define the load_journal table, which records which files we have loaded
+    (see load_journal.py). We create this if it does not exist so that we can
+    add it to older databases.
+    :param conn: the connection
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Creating LOAD_JOURNAL table{color.ENDC}\n")
+
+    conn.cursor().execute("""
+        CREATE TABLE IF NOT EXISTS load_journal (
+            load_journal_rowid INTEGER PRIMARY KEY,
+            source_file TEXT,
+            file_size INTEGER,
+            file_mtime REAL,
+            status TEXT,
+            genomes_loaded INTEGER,
+            genomes_skipped INTEGER,
+            started TEXT,
+            updated TEXT
+        )
+    """)
+    conn.cursor().execute("CREATE UNIQUE INDEX IF NOT EXISTS load_journal_idx1 ON load_journal(source_file);")
+    conn.commit()
+
+
+def define_metadata_table(conn, verbose=False, md5_format='text'):
+    """
+    Define the pppf_metadata table, which holds key/value settings for the database.
+    At the moment this is md5_format, which says whether the protein md5sums are stored as
+    text or as 16 byte blobs (see md5_keys.py). We only set md5_format if it is not already
+    set, so an existing database keeps its format.
+    :param conn: the connection
+    :param verbose: more output
+    :param md5_format: text or blob
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Creating PPPF_METADATA table{color.ENDC}\n")
+
+    if md5_format not in ('text', 'blob'):
+        sys.stderr.write(f"{color.RED}FATAL: md5 format must be text or blob, not {md5_format}{color.ENDC}\n")
+        sys.exit(-1)
+
+    conn.cursor().execute("CREATE TABLE IF NOT EXISTS pppf_metadata (key TEXT PRIMARY KEY, value TEXT)")
+    conn.cursor().execute("INSERT OR IGNORE INTO pppf_metadata (key, value) VALUES ('md5_format', ?)", [md5_format])
     conn.commit()
 
 
@@ -232,6 +396,7 @@ def define_cluster_table(conn, verbose=False):
     conn.cursor().execute("CREATE UNIQUE INDEX cluster_idx2 ON cluster(cluster_rowid, uuid);")
     conn.cursor().execute("CREATE INDEX cluster_id3 ON cluster(function, functions, cluster_rowid);")
     conn.cursor().execute("CREATE INDEX cluster_id4 ON cluster(functions, function, cluster_rowid);")
+    conn.cursor().execute("CREATE INDEX cluster_id5 ON cluster(only_hypothetical, clusterdefinition);")
     conn.commit()
 
 def define_proteinclusters_table(conn, verbose=False):
@@ -284,25 +449,48 @@ def define_md5clusters_table(conn, verbose=False):
 
 
 
-def define_phage_tables(conn, verbose=False):
+def define_phage_tables(conn, verbose=False, indexes=True, md5_format='text'):
+    """
+    Run the above definitions for phages.
+
+    If you are going to load a lot of data into new tables, it is much quicker to
+    create the tables without indexes, load the data, and then use define_phage_indexes()
+    :param conn: The database connection
+    :param verbose: more output
+    :param indexes: also create the indexes
+    :param md5_format: store the protein md5sums as text or blob
+    :return:
+    """
+
+    define_genome_table(conn, verbose, indexes)
+    define_gene_table(conn, verbose, indexes)
+    define_protein_table(conn, verbose, indexes)
+    define_trna_table(conn, verbose, indexes)
+    define_protein_sequence_table(conn, verbose, indexes)
+    define_load_journal_table(conn, verbose)
+    define_metadata_table(conn, verbose, md5_format)
+
+def define_phage_indexes(conn, verbose=False):
     """
-    Run the above definitions for phages
+    Create all the indexes on the phage tables
     :param conn: The database connection
     :param verbose: more output
     :return:
     """
 
-    define_genome_table(conn, verbose)
-    define_gene_table(conn, verbose)
-    define_protein_table(conn, verbose)
-    define_trna_table(conn, verbose)
-    define_protein_sequence_table(conn, verbose)
+    define_genome_indexes(conn, verbose)
+    define_gene_indexes(conn, verbose)
+    define_protein_indexes(conn, verbose)
+    define_trna_indexes(conn, verbose)
+    define_protein_sequence_indexes(conn, verbose)
 
-def define_cluster_tables(conn, verbose=False):
+def define_cluster_tables(conn, verbose=False, md5_format='text', normalized=False):
     """
     Run the above definitions for clusters
     :param conn: The database connection
     :param verbose: more output
+    :param md5_format: store the protein md5sums as text or blob
+    :param normalized: only store the cluster members in the md5cluster table, and leave cluster.members empty
     :return:
     """
 
@@ -310,22 +498,30 @@ def define_cluster_tables(conn, verbose=False):
     define_cluster_table(conn, verbose)
     define_proteinclusters_table(conn, verbose)
     define_md5clusters_table(conn, verbose)
+    define_metadata_table(conn, verbose, md5_format)
+    conn.cursor().execute("INSERT OR IGNORE INTO pppf_metadata (key, value) VALUES ('cluster_members', ?)",
+                          ['md5cluster' if normalized else 'text'])
+    conn.commit()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Create tables for a database')
     parser.add_argument('-p', help='phage genome database file name')
     parser.add_argument('-c', help='cluster genome database file name')
+    parser.add_argument('-n', help='do not index the phage tables (e.g. for a fresh load)', action='store_true')
+    parser.add_argument('-m', help='store the protein md5sums as text or blob (default=text)', default='text',
+                        choices=['text', 'blob'])
+    parser.add_argument('-z', help='only store the cluster members in the md5cluster table', action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
     if args.p:
         phageconn = database_handles.connect_to_db(args.p, args.v)
-        define_phage_tables(phageconn, args.v)
+        define_phage_tables(phageconn, args.v, not args.n, args.m)
         phageconn.commit()  # final commit to make sure everything saved!
         database_handles.disconnect(phageconn, args.v)
     if args.c:
         clconn    = database_handles.connect_to_db(args.c, args.v)
-        define_cluster_tables(clconn, args.v)
+        define_cluster_tables(clconn, args.v, args.m, args.z)
         clconn.commit()
         database_handles.disconnect(clconn, args.v)
@@ -0,0 +1,238 @@
+"""
+Write the rows we extract from GenBank records into the phage database in batches.
+
+Rather than executing (and committing) one statement per row, we collect the rows
+for complete genomes and write them with executemany, committing once per batch.
+We assign the rowids ourselves so that proteins and genes can refer to each other
+without needing to go back and update the rows.
+
+Most phage proteins are already in the protein_sequence table, so we read all the
+md5sums once when we start and keep them in memory as 16-byte digests. Checking
+whether we need to add a protein sequence is then a set lookup rather than a query.
+The protein md5sums are written as text or blobs depending on the md5_format of the
+database (see md5_keys.py).
+
+In incremental mode we also keep the identifier and md5sum of every genome, skip any
+genome that is already in the database, and update the load_journal for each file
+in the same transaction as its genomes.
+
+We classify each protein product as hypothetical (or not) as we write it. is_hypothetical
+is cached, so we only do that once for each different product.
+
+In compact mode we compress the genome sequences and leave out the DNA sequences of
+genes and tRNAs that we can extract from the genome (see sequences.py). The features are
+always extracted from the first genome with their contig name, so if we already have a
+genome with the same name (e.g. an older version) we keep all the feature sequences.
+"""
+
+import sys
+import time
+
+from pppf_accessories import color
+from pppf_databases.load_journal import load_genome_keys, update_files
+from pppf_databases.sequences import pack_sequence, is_extractable
+from pppf_databases.md5_keys import md5_key, md5_format
+from pppf_databases.database_handles import table_has_column
+from pppf_databases.define_database_tables import define_hypothetical_column
+from pppf_lib.functions import is_hypothetical
+
+
+def load_protein_md5s(conn, verbose=False):
+    """
+    Read all the md5sums in the protein_sequence table
+    :param conn: the database connection
+    :param verbose: more output
+    :return: a set of the 16-byte md5sum digests
+    """
+
+    md5s = {md5_key(m, 'blob') for (m,) in conn.cursor().execute("select protein_md5sum from protein_sequence")}
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Found {len(md5s):,} existing protein sequences{color.ENDC}\n")
+    return md5s
+
+
+class GenBankWriter:
+    """
+    Collect the rows for GenBank records and write them to the database in batches.
+
+    :ivar conn: the database connection
+    :ivar batch_size: the (approximate) number of rows to collect before we write them. 0 means only write when closed
+    :ivar verbose: more output
+    :ivar rows_written: the total number of rows we have written
+    :ivar protein_md5s: the set of md5sum digests that are (or will be) in the protein_sequence table
+    :ivar incremental: skip genomes that are already in the database and keep the load_journal up to date
+    :ivar genome_keys: in incremental mode, the set of (identifier, sequence_md5) for the genomes we have
+    :ivar compact: compress the genome sequences and do not store gene and tRNA sequences we can extract
+    :ivar genome_names: in compact mode, the names of the genomes we have
+    :ivar md5_format: whether the database stores the protein md5sums as text or blob
+    """
+
+    def __init__(self, conn, batch_size=10000, verbose=False, incremental=False, compact=False):
+        """
+        Create a new writer
+        :param conn: the database connection
+        :param batch_size: the number of rows to collect before writing. 0 means only write when closed
+        :param verbose: more output
+        :param incremental: skip genomes that are already in the database and update the load_journal
+        :param compact: use compact storage for the DNA sequences
+        """
+        self.conn = conn
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.incremental = incremental
+        self.compact = compact
+        self.md5_format = md5_format(conn)
+        if not table_has_column(conn, 'protein', 'is_hypothetical'):
+            define_hypothetical_column(conn, verbose, indexes=False)
+
+        c = conn.cursor()
+        self.next_protein = (c.execute("select max(protein_rowid) from protein").fetchone()[0] or 0) + 1
+        self.next_gene = (c.execute("select max(gene_rowid) from gene").fetchone()[0] or 0) + 1
+        self.protein_md5s = load_protein_md5s(conn, verbose)
+        self.genome_keys = load_genome_keys(conn, verbose) if incremental else set()
+        self.genome_names = {n for (n,) in c.execute("select distinct name from genome")} if compact else set()
+
+        self.protein_sequences = []
+        self.proteins = []
+        self.genes = []
+        self.trnas = []
+        self.genomes = []
+        self.file_counts = {}
+        self.pending = 0
+
+        self.rows_written = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def add(self, rows):
+        """
+        Add the rows for a single GenBank record. We only write complete
+        records, so a genome is always committed together with all of its
+        genes, proteins, and tRNAs.
+        :param rows: the dict of rows from record_to_rows()
+        :return: True if we are going to write the genome, False if it is already in the database
+        """
+
+        if self.incremental:
+            key = (rows['genome'][0], rows['genome'][16])
+            counts = self.file_counts.setdefault(rows['genome'][1], [0, 0])
+            if key in self.genome_keys:
+                counts[1] += 1
+                return False
+            self.genome_keys.add(key)
+            counts[0] += 1
+
+        if self.compact:
+            rows = self.compact_rows(rows)
+
+        for (prtmd5, translation, protein, gene) in rows['cds']:
+            digest = bytes.fromhex(prtmd5)
+            key = digest if self.md5_format == 'blob' else prtmd5
+            if digest not in self.protein_md5s:
+                self.protein_md5s.add(digest)
+                self.protein_sequences.append([key, translation])
+                self.pending += 1
+            # the protein md5sum is the fifth column of the protein row, and the product is the third
+            self.proteins.append([self.next_protein] + protein[0:2] + [self.next_gene] + protein[2:4] + [key] +
+                                 protein[5:] + [int(is_hypothetical(protein[2]))])
+            self.genes.append([self.next_gene] + gene + [self.next_protein])
+            self.next_protein += 1
+            self.next_gene += 1
+            self.pending += 2
+
+        self.trnas.extend(rows['trna'])
+        self.genomes.append(rows['genome'])
+        self.pending += len(rows['trna']) + 1
+
+        if self.batch_size and self.pending >= self.batch_size:
+            self.flush()
+        return True
+
+    def compact_rows(self, rows):
+        """
+        Compress the genome sequence, and remove the gene and tRNA sequences that we can extract from it.
+        We only remove them if this is the first genome with its name.
+        :param rows: the dict of rows from record_to_rows()
+        :return: a new dict of rows
+        """
+
+        seq = rows['genome'][15]
+        name = rows['genome'][3]
+        first = name not in self.genome_names
+        self.genome_names.add(name)
+
+        def drop(row):
+            (start, end, strand, dnaseq) = row[2:6]
+            if first and is_extractable(dnaseq, seq, start, end, strand):
+                return row[:5] + [None] + row[6:]
+            return row
+
+        return {
+            'genome': rows['genome'][:15] + [pack_sequence(seq)] + rows['genome'][16:],
+            'cds': [[prtmd5, translation, protein, drop(gene)] for (prtmd5, translation, protein, gene) in rows['cds']],
+            'trna': [drop(t) for t in rows['trna']]
+        }
+
+    def flush(self):
+        """
+        Write all the rows we have collected and commit them
+        """
+
+        c = self.conn.cursor()
+        # the protein sequences must go first as the proteins have a foreign key to them.
+        # protein_md5s should mean these are all new, but we ignore duplicates just in case
+        c.executemany("INSERT OR IGNORE INTO protein_sequence (protein_md5sum, protein_sequence) VALUES (?,?)",
+                      self.protein_sequences)
+        c.executemany("""
+            INSERT INTO protein(protein_rowid, protein_id, contig, gene, product, db_xref, protein_md5sum,
+            length, EC_number, genename, locus_tag, note, ribosomal_slippage, transl_table, is_hypothetical) values
+            (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, self.proteins)
+        c.executemany("""
+            INSERT INTO gene(gene_rowid, accession, contig, start, end, strand, dna_sequence, dna_sequence_md,
+            length, db_xref, protein) values (?,?,?,?,?,?,?,?,?,?,?)
+            """, self.genes)
+        c.executemany("""
+            INSERT INTO trna(accession, contig, start, end, strand, dna_sequence, dna_sequence_md5,
+            codon_recognized, db_xref, gene, note, product, is_tmRNA) values (?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, self.trnas)
+        c.executemany("""
+            INSERT INTO genome(identifier, source_file, accession,  name, source, organism, description, taxonomy,
+            collection_date, country, db_xref, host, isolation_source, strain, lab_host, sequence, sequence_md5, length)
+            values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, self.genomes)
+        if self.incremental:
+            update_files(self.conn, self.file_counts)
+        self.conn.commit()
+
+        self.rows_written += len(self.protein_sequences) + len(self.proteins) + len(self.genes) + \
+                             len(self.trnas) + len(self.genomes)
+        self.protein_sequences = []
+        self.proteins = []
+        self.genes = []
+        self.trnas = []
+        self.genomes = []
+        self.file_counts = {}
+        self.pending = 0
+
+        if self.verbose and time.time() - self.last_report > 10:
+            self.report()
+
+    def close(self):
+        """
+        Write anything that is left and report how we did
+        """
+        self.flush()
+        if self.verbose:
+            self.report()
+
+    def report(self):
+        """
+        Write the number of rows and the rows/second to stderr
+        """
+
+        self.last_report = time.time()
+        elapsed = self.last_report - self.start_time
+        rate = self.rows_written / elapsed if elapsed else 0
+        sys.stderr.write(f"{color.BLUE}Wrote {self.rows_written:,} rows in {elapsed:.1f} seconds " +
+                         f"({rate:,.0f} rows/second){color.ENDC}\n")
@@ -0,0 +1,110 @@
+"""
+Keep track of which GenBank files we have loaded, so that we can load
+incrementally.
+
+The load_journal table has one row per file. When we start loading a file we mark
+it as loading, as we commit each batch of genomes we update the number of genomes we
+have loaded and skipped in the same transaction, and when we reach the end of the file
+we mark it as complete. If the load stops part way through, the file stays as loading
+and the next load reads it again, skipping the genomes that are already in the database.
+
+A file that is complete, and has not changed size or modification time since, is not
+read again.
+"""
+
+import os
+import sys
+import time
+
+from pppf_accessories import color
+from pppf_databases.define_database_tables import define_load_journal_table
+
+
+def _now():
+    """
+    The current time as a string for the journal
+    """
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def load_genome_keys(conn, verbose=False):
+    """
+    Read the identifiers and sequence md5sums of the genomes in the database
+    :param conn: the database connection
+    :param verbose: more output
+    :return: a set of (identifier, sequence_md5) tuples
+    """
+
+    keys = set(conn.cursor().execute("select identifier, sequence_md5 from genome"))
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Found {len(keys):,} existing genomes{color.ENDC}\n")
+    return keys
+
+
+def file_is_loaded(conn, gbkf, verbose=False):
+    """
+    Have we already loaded all of this file?
+    :param conn: the database connection
+    :param gbkf: the genbank file
+    :param verbose: more output
+    :return: True if the journal says the file is complete and it has not changed since
+    """
+
+    define_load_journal_table(conn)
+    row = conn.cursor().execute("select file_size, file_mtime, status from load_journal where source_file = ?",
+                                [gbkf]).fetchone()
+    if not row:
+        return False
+    (size, mtime, status) = row
+    st = os.stat(gbkf)
+    if status == 'complete' and size == st.st_size and mtime == st.st_mtime:
+        if verbose:
+            sys.stderr.write(f"{color.BLUE}{gbkf} has already been loaded. Skipped{color.ENDC}\n")
+        return True
+    if verbose and status == 'loading':
+        sys.stderr.write(f"{color.YELLOW}Resuming the load of {gbkf}{color.ENDC}\n")
+    return False
+
+
+def start_file(conn, gbkf):
+    """
+    Mark a file as loading
+    :param conn: the database connection
+    :param gbkf: the genbank file
+    """
+
+    define_load_journal_table(conn)
+    st = os.stat(gbkf)
+    conn.cursor().execute("""
+        INSERT INTO load_journal (source_file, file_size, file_mtime, status, genomes_loaded, genomes_skipped,
+        started, updated) VALUES (?,?,?,'loading',0,0,?,?)
+        ON CONFLICT(source_file) DO UPDATE SET file_size=excluded.file_size, file_mtime=excluded.file_mtime,
+        status='loading', genomes_loaded=0, genomes_skipped=0, started=excluded.started, updated=excluded.updated
+        """, [gbkf, st.st_size, st.st_mtime, _now(), _now()])
+    conn.commit()
+
+
+def update_files(conn, counts):
+    """
+    Add to the number of genomes loaded and skipped for some files. This does not
+    commit, so that the journal is written in the same transaction as the genomes.
+    :param conn: the database connection
+    :param counts: a dict of file name: [genomes loaded, genomes skipped]
+    """
+
+    conn.cursor().executemany("""
+        UPDATE load_journal SET genomes_loaded = genomes_loaded + ?, genomes_skipped = genomes_skipped + ?,
+        updated = ? WHERE source_file = ?
+        """, [[loaded, skipped, _now(), gbkf] for (gbkf, (loaded, skipped)) in counts.items()])
+
+
+def finish_file(conn, gbkf):
+    """
+    Mark a file as completely loaded
+    :param conn: the database connection
+    :param gbkf: the genbank file
+    """
+
+    conn.cursor().execute("UPDATE load_journal SET status = 'complete', updated = ? WHERE source_file = ?",
+                          [_now(), gbkf])
+    conn.commit()
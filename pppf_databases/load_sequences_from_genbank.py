@@ -7,179 +7,252 @@ This is the correct way to do this!
 import sys
 import argparse
 
-from pppf_accessories import color
+from pppf_accessories import color, open_file
 from pppf_databases import connect_to_db, disconnect
+from pppf_databases.genbank_writer import GenBankWriter
+from pppf_databases.load_journal import file_is_loaded, start_file, finish_file
+from pppf_lib.genbank_parser import parse_genbank
 
 import hashlib
 from Bio import SeqIO
 
 
-def load_genbank_file(gbkf, conn, verbose=True):
+def record_to_rows(seq, gbkf, verbose=False):
     """
-    Load the sequences from a genbank file
+    Extract the rows that we load into the database from a single GenBank record
+    :param seq: the Biopython SeqRecord (or a GenBankRecord from the fast parser)
+    :param gbkf: the genbank file the record came from
+    :param verbose: more output
+    :return: a dict with the genome row, a list of [md5sum, translation, protein row, gene row] for each CDS and a list of tRNA rows
+    """
+
+    rows = {'genome': None, 'cds': [], 'trna': []}
+
+    # source metadata
+    srcmtd = {
+        'collection_date': "",
+        'country': "",
+        'db_xref': "",
+        'isolation_source': "",
+        'host': "",
+        'strain': "",
+        'lab_host': ""
+    }
+    # protein (CDS) metadata
+    prtmtd = {
+        'EC_number': "",
+        'db_xref': "",
+        'gene': "",
+        'locus_tag': "",
+        'note': "",
+        'product': "",
+        'protein_id': "",
+        'ribosomal_slippage': "",
+        'transl_table': 11,
+        'translation': ""
+    }
+    # tRNA metadata
+    trnmtd = {
+        'codon_recognized': "",
+        'db_xref': "",
+        'gene': "",
+        'locus_tag': "",
+        'note': "",
+        'product': "",
+        'is_tmRNA': False,
+    }
+
+    # the information for the genes
+    for feat in seq.features:
+        if feat.type == 'source':
+            for s in srcmtd.keys():
+                if s in feat.qualifiers:
+                    srcmtd[s] = feat.qualifiers[s][0]
+                if 'db_xref' in feat.qualifiers:
+                    # we handle this separately as we want them all
+                    srcmtd['db_xref'] = "|".join(feat.qualifiers['db_xref'])
+        elif feat.type == 'CDS':
+            (start, stop, strand) = (int(feat.location.start), int(feat.location.end), feat.location.strand)
+            for p in prtmtd:
+                if p in feat.qualifiers:
+                    prtmtd[p] = "|".join(feat.qualifiers[p])
+            prtmd5 = hashlib.md5(prtmtd['translation'].upper().encode('utf-8')).hexdigest()
+            if 'product' in prtmtd:
+                if len(prtmtd['product']) > 1:
+                    prtmtd['product'] = prtmtd['product'][0].upper() + prtmtd['product'][1:].lower()
+                elif len(prtmtd['product']) == 0:
+                    prtmtd['product'] = "Hypothetical protein"
+            else:
+                prtmtd['product'] = "Hypothetical protein"
+
+            # if there is no protein sequence (yes, there are some genbank records with no protein sequence)
+            # we don't continue
+            if len(prtmtd['translation']) == 0:
+                sys.stderr.write(f"SKIPPED: No translation for {prtmtd['protein_id']}\n")
+                continue
+
+            dnaseq = str(feat.extract(seq).seq)
+            dnamd5 = hashlib.md5(dnaseq.upper().encode('utf-8')).hexdigest()
+
+            rows['cds'].append([
+                prtmd5, prtmtd['translation'].upper(),
+                [
+                    prtmtd['protein_id'], seq.name, prtmtd['product'], prtmtd['db_xref'],
+                    prtmd5, len(prtmtd['translation']), prtmtd['EC_number'], prtmtd['gene'], prtmtd['locus_tag'],
+                    prtmtd['note'], prtmtd['ribosomal_slippage'], prtmtd['transl_table']
+                ],
+                [
+                    prtmtd['locus_tag'], seq.name, start, stop, strand, dnaseq, dnamd5, len(dnaseq), prtmtd['db_xref']
+                ]
+            ])
+
+        elif feat.type == 'tRNA' or feat.type == 'tmRNA':
+            (start, stop, strand) = (int(feat.location.start), int(feat.location.end), feat.location.strand)
+            for t in trnmtd:
+                if t in feat.qualifiers:
+                    trnmtd[t] = "|".join(feat.qualifiers[t])
+            if feat.type == 'tmRNA':
+                trnmtd['is_tmRNA'] = True
+            dnaseq = str(feat.extract(seq).seq)
+            dnamd5 = hashlib.md5(dnaseq.upper().encode('utf-8')).hexdigest()
+
+            rows['trna'].append([
+                trnmtd['locus_tag'], seq.name, start, stop, strand, dnaseq, dnamd5, trnmtd['codon_recognized'],
+                trnmtd['db_xref'], trnmtd['gene'], trnmtd['note'], trnmtd['product'], trnmtd['is_tmRNA']
+            ])
+
+    seqmd5 = hashlib.md5(str(seq.seq).upper().encode('utf-8')).hexdigest()
+    tax = "; ".join(seq.annotations['taxonomy'])
+
+    rows['genome'] = [seq.id, gbkf, seq.annotations['accessions'][0], seq.name, seq.annotations['source'],
+                      seq.annotations['organism'], seq.description, tax, srcmtd['collection_date'],
+                      srcmtd['country'], srcmtd['db_xref'], srcmtd['host'], srcmtd['isolation_source'], srcmtd['strain'],
+                      srcmtd['lab_host'], str(seq.seq), seqmd5, len(seq)]
+
+    return rows
+
+
+def genbank_to_rows(gbkf, verbose=False, parser="biopython"):
+    """
+    Parse a genbank file and yield the database rows for each record
+    :param gbkf: genbank file (which may be compressed)
+    :param verbose: more output
+    :param parser: the GenBank parser to use: biopython or fast (see pppf_lib.genbank_parser)
+    :return: a generator of the rows for each record (see record_to_rows)
+    """
+
+    if parser == "fast":
+        records = parse_genbank(gbkf, verbose=verbose)
+    elif parser == "biopython":
+        records = SeqIO.parse(open_file(gbkf), "genbank")
+    else:
+        sys.stderr.write(f"{color.RED}FATAL: Unknown GenBank parser {parser}. Please use biopython or fast{color.ENDC}\n")
+        sys.exit(-1)
+
+    for seq in records:
+        yield record_to_rows(seq, gbkf, verbose)
+
+
+def load_genbank_file(gbkf, conn, verbose=True, bulk=False, batch_size=10000, parser="biopython", incremental=False,
+                      compact=False):
+    """
+    Load the sequences from a genbank file.
+
+    By default we commit each genome (with all its genes, proteins, and tRNAs) as
+    we load it. In bulk mode we collect rows for many genomes and write them
+    with executemany, committing once per batch, which is much faster for large loads.
+
+    The fast parser only reads the parts of the records that we load, and gives
+    the same rows as Biopython.
+
+    In incremental mode we skip files that the load_journal says we have already
+    loaded, and genomes whose identifier and sequence md5sum are already in the
+    database, so it is safe to load the same file again, or to restart a load that
+    stopped part way through.
+
+    In compact mode we compress the genome sequences and only store the gene and
+    tRNA sequences that we can not extract from the genome. Use the functions in
+    sequences.py to read them.
+
     :param gbkf: genbank file
     :param conn: database connection
     :param verbose: more output
+    :param bulk: load in batches of batch_size rows rather than one genome at a time
+    :param batch_size: the number of rows per batch in bulk mode. Use 0 to commit once for the whole file
+    :param parser: the GenBank parser to use: biopython or fast
+    :param incremental: only load the genomes that are not already in the database
+    :param compact: use compact storage for the DNA sequences
     :return:
     """
 
+    if incremental:
+        if file_is_loaded(conn, gbkf, verbose):
+            return
+        start_file(conn, gbkf)
+
     if verbose:
         sys.stderr.write(f"{color.PINK}Parsing {gbkf}{color.ENDC}\n")
 
-    c = conn.cursor()
+    writer = GenBankWriter(conn, batch_size if bulk else 1, verbose, incremental, compact)
+    for rows in genbank_to_rows(gbkf, verbose, parser):
+        writer.add(rows)
+    writer.close()
 
-    for seq in SeqIO.parse(open(gbkf, 'r'), "genbank"):
-
-        # source metadata
-        srcmtd = {
-            'collection_date': "",
-            'country': "",
-            'db_xref': "",
-            'isolation_source': "",
-            'host': "",
-            'strain': "",
-            'lab_host': ""
-        }
-        # protein (CDS) metadata
-        prtmtd = {
-            'EC_number': "",
-            'db_xref': "",
-            'gene': "",
-            'locus_tag': "",
-            'note': "",
-            'product': "",
-            'protein_id': "",
-            'ribosomal_slippage': "",
-            'transl_table': 11,
-            'translation': ""
-        }
-        # tRNA metadata
-        trnmtd = {
-            'codon_recognized': "",
-            'db_xref': "",
-            'gene': "",
-            'locus_tag': "",
-            'note': "",
-            'product': "",
-            'is_tmRNA': False,
-        }
-
-        # the information for the genes
-        for feat in seq.features:
-            if feat.type == 'source':
-                for s in srcmtd.keys():
-                    if s in feat.qualifiers:
-                        srcmtd[s] = feat.qualifiers[s][0]
-                    if 'db_xref' in feat.qualifiers:
-                        # we handle this separately as we want them all
-                        srcmtd['db_xref'] = "|".join(feat.qualifiers['db_xref'])
-            elif feat.type == 'CDS':
-                (start, stop, strand) = (feat.location.start.position, feat.location.end.position, feat.strand)
-                for p in prtmtd:
-                    if p in feat.qualifiers:
-                        prtmtd[p] = "|".join(feat.qualifiers[p])
-                prtmd5 = hashlib.md5(prtmtd['translation'].upper().encode('utf-8')).hexdigest()
-                if 'product' in prtmtd:
-                    if len(prtmtd['product']) > 1:
-                        prtmtd['product'] = prtmtd['product'][0].upper() + prtmtd['product'][1:].lower()
-                    elif len(prtmtd['product']) == 0:
-                        prtmtd['product'] = "Hypothetical protein"
-                else:
-                    prtmtd['product'] = "Hypothetical protein"
+    if incremental:
+        finish_file(conn, gbkf)
 
-                # if there is no protein sequence (yes, there are some genbank records with no protein sequence)
-                # we don't continue
-                if len(prtmtd['translation']) == 0:
-                    sys.stderr.write(f"SKIPPED: No translation for {prtmtd['protein_id']}\n")
-                    continue
-
-                # add the protein sequence and md5sum and sequence if we don't already have it
-                ex = c.execute("select protein_md5sum from protein_sequence where protein_md5sum = ?", [prtmd5])
-                tple = ex.fetchone()
-                if not tple:
-                    c.execute("INSERT INTO protein_sequence (protein_md5sum, protein_sequence) VALUES (?,?)",
-                              [prtmd5, prtmtd['translation'].upper()])
-
-                sql = """
-                    INSERT INTO protein(protein_id, contig, product, db_xref, protein_md5sum, 
-                    length, EC_number, genename, locus_tag, note, ribosomal_slippage, transl_table) values 
-                    (?,?,?,?,?,?,?,?,?,?,?,?)                  
-                """
-                c.execute(sql, [
-                    prtmtd['protein_id'], seq.name, prtmtd['product'], prtmtd['db_xref'], 
-                    prtmd5, len(prtmtd['translation']), prtmtd['EC_number'], prtmtd['gene'], prtmtd['locus_tag'],
-                    prtmtd['note'], prtmtd['ribosomal_slippage'], prtmtd['transl_table']
-                ])
-
-                proteinrow = c.lastrowid
-
-                dnaseq = str(feat.extract(seq).seq)
-                dnamd5 = hashlib.md5(dnaseq.upper().encode('utf-8')).hexdigest()
-                sql = """
-                    INSERT INTO gene(accession, contig, start, end, strand, dna_sequence, dna_sequence_md, protein, length, db_xref)
-                    values (?,?,?,?,?,?,?,?,?,?)
-                """
-
-                c.execute(sql, [
-                    prtmtd['locus_tag'], seq.name, start, stop, strand, dnaseq, dnamd5, proteinrow, len(dnaseq), prtmtd['db_xref']
-                ])
-
-                dnarow = c.lastrowid
-
-                c.execute("UPDATE protein set gene=? where rowid = ?", (dnarow, proteinrow))
-
-                conn.commit()
-
-            elif feat.type == 'tRNA' or feat.type == 'tmRNA':
-                (start, stop, strand) = (feat.location.start.position, feat.location.end.position, feat.strand)
-                for t in trnmtd:
-                    if t in feat.qualifiers:
-                        trnmtd[t] = "|".join(feat.qualifiers[t])
-                if feat.type == 'tmRNA':
-                    trnmtd['is_tmRNA'] = True
-                dnaseq = str(feat.extract(seq).seq)
-                dnamd5 = hashlib.md5(dnaseq.upper().encode('utf-8')).hexdigest()
-                sql = """
-                    INSERT INTO trna(accession, contig, start, end, strand, dna_sequence, dna_sequence_md5, 
-                    codon_recognized, db_xref, gene, note, product, is_tmRNA) values (?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """
-
-                c.execute(sql, [
-                    trnmtd['locus_tag'], seq.name, start, stop, strand, dnaseq, dnamd5, trnmtd['codon_recognized'],
-                    trnmtd['db_xref'], trnmtd['gene'], trnmtd['note'], trnmtd['product'], trnmtd['is_tmRNA']
-                ])
-
-                conn.commit()
-
-        sql = """
-                        INSERT INTO genome(identifier, source_file, accession,  name, source, organism, description, taxonomy, 
-                            collection_date, country, db_xref, host, isolation_source, strain, lab_host, sequence, sequence_md5, length)
-                        values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                        """
-
-        seqmd5 = hashlib.md5(str(seq.seq).upper().encode('utf-8')).hexdigest()
-        tax = "; ".join(seq.annotations['taxonomy'])
-
-        c.execute(sql, [seq.id, gbkf, seq.annotations['accessions'][0], seq.name, seq.annotations['source'],
-                             seq.annotations['organism'], seq.description, tax, srcmtd['collection_date'],
-                             srcmtd['country'], srcmtd['db_xref'], srcmtd['host'], srcmtd['isolation_source'], srcmtd['strain'], srcmtd['lab_host'],
-                             str(seq.seq), seqmd5, len(seq)])
-        conn.commit()
 
 def create_full_text_search(conn, verbose=True):
     """
-    Create a full text search virtual table on the protein products
+    Create a full text search virtual table on the protein products.
+
+    protein_fts is an external content FTS5 table: it indexes protein.product but does
+    not keep its own copy, and triggers on the protein table keep it up to date as
+    proteins are added, changed, or deleted. We only build the index from scratch when
+    we first create the table (or replace an older protein_fts that kept its own copy),
+    so it is safe (and quick) to call this after every load.
+
     :param conn: the database connection
     :param verbose: more output
     :return: 
     """
 
+    c = conn.cursor()
+    row = c.execute("select sql from sqlite_master where type='table' and name='protein_fts'").fetchone()
+    if row and 'content=' in row[0]:
+        return
+
+    if row:
+        if verbose:
+            sys.stderr.write(f"{color.GREEN}Replacing the old full text search table{color.ENDC}\n")
+        c.execute("DROP TABLE protein_fts")
+
     if verbose:
         sys.stderr.write(f"{color.GREEN}Adding full text search capabilities{color.ENDC}\n")
-    
-    c = conn.cursor()
-    c.execute("CREATE VIRTUAL TABLE protein_fts using FTS5(protein_rowid, product);")
-    c.execute("INSERT INTO protein_fts SELECT protein_rowid, product FROM protein;")
+
+    c.execute("""
+        CREATE VIRTUAL TABLE protein_fts USING FTS5(protein_rowid UNINDEXED, product,
+        content='protein', content_rowid='protein_rowid');
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS protein_fts_insert AFTER INSERT ON protein BEGIN
+            INSERT INTO protein_fts(rowid, protein_rowid, product) VALUES (new.protein_rowid, new.protein_rowid, new.product);
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS protein_fts_delete AFTER DELETE ON protein BEGIN
+            INSERT INTO protein_fts(protein_fts, rowid, protein_rowid, product)
+            VALUES ('delete', old.protein_rowid, old.protein_rowid, old.product);
+        END;
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS protein_fts_update AFTER UPDATE OF protein_rowid, product ON protein BEGIN
+            INSERT INTO protein_fts(protein_fts, rowid, protein_rowid, product)
+            VALUES ('delete', old.protein_rowid, old.protein_rowid, old.product);
+            INSERT INTO protein_fts(rowid, protein_rowid, product) VALUES (new.protein_rowid, new.protein_rowid, new.product);
+        END;
+    """)
+    c.execute("INSERT INTO protein_fts(protein_fts) VALUES ('rebuild');")
     conn.commit()
 
 
@@ -187,10 +260,18 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Load genbank data into an SQLite table')
     parser.add_argument('-f', help='GenBank file to parse', required=True)
     parser.add_argument('-p', help='Phage SQLite database', required=True)
+    parser.add_argument('-b', help='bulk load the data in batches', action='store_true')
+    parser.add_argument('-s', help='number of rows per batch for bulk loading (default=10000, 0 = one batch per file)',
+                        type=int, default=10000)
+    parser.add_argument('-g', help='GenBank parser to use (default=biopython)', choices=['biopython', 'fast'],
+                        default='biopython')
+    parser.add_argument('-i', help='incremental load: skip genomes that are already in the database',
+                        action='store_true')
+    parser.add_argument('-z', help='compact storage for the DNA sequences', action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
     conn = connect_to_db(args.p, args.v)
-    load_genbank_file(args.f, conn, args.v)
+    load_genbank_file(args.f, conn, args.v, args.b, args.s, args.g, args.i, args.z)
     create_full_text_search(conn, args.v)
     disconnect(conn, args.v)
@@ -0,0 +1,128 @@
+"""
+Protein md5sums as database keys.
+
+The protein md5sums join the phage and cluster databases (protein.protein_md5sum,
+protein_sequence.protein_md5sum and md5cluster.protein_md5sum). By default we store
+them as 32 character hex strings, but they can also be stored as 16 byte BLOBs, which
+halves the size of those columns and their indexes and makes the lookups faster.
+
+Each database records which format it uses in the pppf_metadata table (md5_format is
+either text or blob, and a database without that setting uses text). Everywhere we read
+or write a protein md5sum we use md5_key() to convert our hex md5sum to the format of
+the database, and md5_hex() to convert what we read back to hex.
+
+We also register two SQL functions on our connections: md5_hex(x) and md5_unhex(x).
+
+Note that the DNA md5sums (genome, gene and trna) are always text.
+"""
+
+import sqlite3
+
+MD5_TEXT = 'text'
+MD5_BLOB = 'blob'
+
+
+def md5_key(md5, md5_format=MD5_TEXT):
+    """
+    Convert an md5sum to the format we store in the database
+    :param md5: the md5sum (hex string or 16 bytes)
+    :param md5_format: text or blob
+    :return: the key to use in the database
+    """
+
+    if md5_format == MD5_BLOB and isinstance(md5, str):
+        return bytes.fromhex(md5)
+    if md5_format == MD5_TEXT and isinstance(md5, bytes):
+        return md5.hex()
+    return md5
+
+
+def md5_hex(value):
+    """
+    Convert an md5sum from the database to a hex string
+    :param value: the value from the database
+    :return: the hex md5sum
+    """
+
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def md5_convert_sql(column, from_format, to_format):
+    """
+    The SQL to compare a protein md5sum column with one in another database that
+    may use a different format. Convert the column on the side you are not looking up,
+    so that the index on the other side can still be used.
+    :param column: the column (e.g. m.protein_md5sum)
+    :param from_format: the format of column (text or blob)
+    :param to_format: the format we are comparing it to (text or blob)
+    :return: the SQL expression
+    """
+
+    if from_format == to_format:
+        return column
+    if to_format == MD5_BLOB:
+        return f"md5_unhex({column})"
+    return f"md5_hex({column})"
+
+
+def _md5_unhex(value):
+    """
+    Convert a hex md5sum to bytes (the md5_unhex SQL function)
+    """
+
+    if isinstance(value, str):
+        return bytes.fromhex(value)
+    return value
+
+
+def register_md5_functions(conn):
+    """
+    Add the md5_hex() and md5_unhex() functions to a database connection
+    :param conn: the database connection
+    """
+
+    conn.create_function("md5_hex", 1, md5_hex, deterministic=True)
+    conn.create_function("md5_unhex", 1, _md5_unhex, deterministic=True)
+
+
+def get_metadata(conn, key, default=None, schema='main'):
+    """
+    Get a value from the pppf_metadata table
+    :param conn: the database connection
+    :param key: the key to look up
+    :param default: the value to return if the key (or the table) is not there
+    :param schema: the database schema (e.g. the name of an attached database)
+    :return: the value
+    """
+
+    try:
+        row = conn.cursor().execute(f"select value from {schema}.pppf_metadata where key = ?", [key]).fetchone()
+    except sqlite3.OperationalError:
+        # no pppf_metadata table
+        return default
+    return row[0] if row else default
+
+
+def set_metadata(conn, key, value, schema='main'):
+    """
+    Set a value in the pppf_metadata table. This does not commit.
+    :param conn: the database connection
+    :param key: the key
+    :param value: the value
+    :param schema: the database schema (e.g. the name of an attached database)
+    """
+
+    conn.cursor().execute(f"INSERT OR REPLACE INTO {schema}.pppf_metadata (key, value) VALUES (?,?)", [key, value])
+
+
+def md5_format(conn, schema='main'):
+    """
+    How are the protein md5sums stored in this database?
+    :param conn: the database connection
+    :param schema: the database schema (e.g. the name of an attached database)
+    :return: text or blob
+    """
+
+    return get_metadata(conn, 'md5_format', MD5_TEXT, schema)
@@ -0,0 +1,192 @@
+"""
+Load GenBank files using several processes.
+
+Most of the time loading GenBank files goes into parsing the records, so we split
+the work up:
+
+    - a reader process splits the files into chunks of records (this is just text, so it is quick)
+    - worker processes parse the chunks and compute the md5sums, sequences and rows for each record
+    - the calling process is the only one that talks to SQLite, and writes the rows in batches
+
+Everything is passed around on bounded queues, so if the database can not keep up the
+workers wait rather than filling the memory. Because only one process ever writes to the
+database, we never have to wait for another process to release the lock.
+
+Note that the genomes will not necessarily be loaded in the same order as they are in the files.
+"""
+
+import io
+import sys
+import queue
+import traceback
+import multiprocessing
+
+from Bio import SeqIO
+
+from pppf_accessories import color, open_file
+from pppf_databases.genbank_writer import GenBankWriter
+from pppf_databases.load_journal import file_is_loaded, start_file, finish_file
+from pppf_databases.load_sequences_from_genbank import record_to_rows
+from pppf_lib.genbank_parser import parse_genbank_lines
+
+# how long to wait for results before we check that the other processes are still running (seconds)
+poll_seconds = 5
+
+
+def split_genbank_file(gbkf, records_per_chunk=50):
+    """
+    Split a GenBank file into chunks of records without parsing them
+    :param gbkf: the genbank file (which may be compressed)
+    :param records_per_chunk: the number of records in each chunk
+    :return: a generator of the text of each chunk
+    """
+
+    lines = []
+    n = 0
+    with open_file(gbkf) as f:
+        for l in f:
+            lines.append(l)
+            if l.startswith('//'):
+                n += 1
+                if n == records_per_chunk:
+                    yield "".join(lines)
+                    lines = []
+                    n = 0
+    if n:
+        yield "".join(lines)
+
+
+def read_genbank_files(gbkfiles, tasks, results, workers, records_per_chunk=50):
+    """
+    Put chunks of the GenBank files onto the task queue, followed by one
+    None for each worker so they know we are done. If we can't read a file
+    we put the error message on the results queue, like the workers do.
+    :param gbkfiles: the list of genbank files
+    :param tasks: the task queue
+    :param results: the results queue
+    :param workers: the number of worker processes
+    :param records_per_chunk: the number of records in each chunk
+    """
+
+    try:
+        for gbkf in gbkfiles:
+            for chunk in split_genbank_file(gbkf, records_per_chunk):
+                tasks.put((gbkf, chunk))
+    except Exception:
+        results.put(traceback.format_exc())
+    finally:
+        for i in range(workers):
+            tasks.put(None)
+
+
+def parse_genbank_chunks(tasks, results, verbose=False, parser="biopython"):
+    """
+    Parse chunks of GenBank records from the task queue and put the rows for
+    each chunk on the results queue. When we are done we put a None on the
+    results queue. If something goes wrong we put the error message there instead.
+    :param tasks: the task queue
+    :param results: the results queue
+    :param verbose: more output
+    :param parser: the GenBank parser to use: biopython or fast
+    """
+
+    try:
+        for (gbkf, chunk) in iter(tasks.get, None):
+            if parser == "fast":
+                records = parse_genbank_lines(io.StringIO(chunk), verbose=verbose)
+            else:
+                records = SeqIO.parse(io.StringIO(chunk), "genbank")
+            results.put([record_to_rows(seq, gbkf, verbose) for seq in records])
+    except Exception:
+        results.put(traceback.format_exc())
+        return
+    results.put(None)
+
+
+def _check_processes(processes):
+    """
+    Exit if any of the processes failed. If a process is killed (e.g. by the OOM killer) it
+    never sends us its None, so we would wait for it forever.
+    :param processes: the reader and worker processes
+    """
+    for p in processes:
+        if p.exitcode not in (None, 0):
+            sys.stderr.write(f"{color.RED}FATAL: The process {p.name} reading the GenBank files failed " +
+                             f"(exit code {p.exitcode}){color.ENDC}\n")
+            sys.exit(-1)
+
+
+def load_genbank_files(gbkfiles, conn, processes=4, batch_size=10000, queue_size=None, records_per_chunk=50,
+                       verbose=False, parser="biopython", incremental=False, compact=False):
+    """
+    Load several GenBank files in parallel. We use processes to parse the
+    files and write all the data from this process.
+    :param gbkfiles: the list of genbank files
+    :param conn: the database connection
+    :param processes: the number of processes to use to parse the files
+    :param batch_size: the number of rows to write per batch (see GenBankWriter)
+    :param queue_size: the maximum number of chunks waiting on each queue (default: 2 * processes)
+    :param records_per_chunk: the number of records each process parses at a time
+    :param verbose: more output
+    :param parser: the GenBank parser to use: biopython or fast
+    :param incremental: only load the genomes that are not already in the database (see load_genbank_file)
+    :param compact: use compact storage for the DNA sequences (see load_genbank_file)
+    """
+
+    if not queue_size:
+        queue_size = 2 * processes
+
+    if incremental:
+        gbkfiles = [f for f in gbkfiles if not file_is_loaded(conn, f, verbose)]
+        if not gbkfiles:
+            return
+        for f in gbkfiles:
+            start_file(conn, f)
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Loading {len(gbkfiles)} files with {processes} processes{color.ENDC}\n")
+
+    tasks = multiprocessing.Queue(queue_size)
+    results = multiprocessing.Queue(queue_size)
+
+    reader = multiprocessing.Process(target=read_genbank_files,
+                                     args=(gbkfiles, tasks, results, processes, records_per_chunk))
+    workers = [multiprocessing.Process(target=parse_genbank_chunks, args=(tasks, results, verbose, parser))
+               for i in range(processes)]
+    reader.start()
+    for w in workers:
+        w.start()
+
+    writer = GenBankWriter(conn, batch_size, verbose, incremental, compact)
+    running = processes
+    try:
+        while running:
+            try:
+                chunk = results.get(timeout=poll_seconds)
+            except queue.Empty:
+                _check_processes([reader] + workers)
+                continue
+            if chunk is None:
+                running -= 1
+            elif isinstance(chunk, str):
+                # we don't write what we have not committed yet
+                sys.stderr.write(f"{color.RED}FATAL: Error reading GenBank data:\n{chunk}{color.ENDC}\n")
+                sys.exit(-1)
+            else:
+                for rows in chunk:
+                    writer.add(rows)
+        # only mark the files complete if the reader and all the workers finished cleanly.
+        # Otherwise they stay as loading, and the next incremental load tries them again
+        for p in [reader] + workers:
+            p.join()
+        _check_processes([reader] + workers)
+        writer.close()
+        if incremental:
+            # the chunks from different files are mixed up, so we only know the files are complete at the end
+            for f in gbkfiles:
+                finish_file(conn, f)
+    finally:
+        for p in [reader] + workers:
+            if p.is_alive():
+                p.terminate()
+            p.join()
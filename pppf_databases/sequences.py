@@ -0,0 +1,227 @@
+"""
+Read and write the DNA sequences in the phage database.
+
+By default genome.sequence, gene.dna_sequence and trna.dna_sequence are plain
+upper case text. In compact mode we store each genome sequence as a zlib compressed
+BLOB, and we do not store the DNA sequence of a gene or tRNA if it is just the slice of
+the genome between start and end (reverse complemented on the - strand). Those
+sequences are NULL and we extract them from the genome when you ask for them.
+
+Either way, use the functions here to get the sequences, and you get the same answer.
+
+The genes and tRNAs only have the name of their contig, and genome.name is not unique
+(e.g. when we load a new version of a genome). We always extract a feature from the first
+genome (lowest genome_rowid) with its contig name, and we only leave out the DNA sequence
+of a feature when that is the genome it came from.
+"""
+
+import sys
+import zlib
+import argparse
+
+from pppf_accessories import color
+from pppf_databases.define_database_tables import define_genome_indexes
+from pppf_lib.genbank_parser import reverse_complement
+
+
+def pack_sequence(seq, level=6):
+    """
+    Compress a sequence for compact storage
+    :param seq: the sequence
+    :param level: the zlib compression level
+    :return: the compressed bytes
+    """
+    return zlib.compress(seq.encode('ascii'), level)
+
+
+def unpack_sequence(value):
+    """
+    Decode a sequence from the database. This works for both plain text and compressed sequences
+    :param value: the value from the database
+    :return: the sequence
+    """
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('ascii')
+    return value
+
+
+def extract_sequence(genome, start, end, strand):
+    """
+    Extract the sequence of a feature from its genome
+    :param genome: the genome sequence
+    :param start: the 0-based start of the feature
+    :param end: the end of the feature
+    :param strand: the strand of the feature (1 or -1)
+    :return: the sequence of the feature
+    """
+    if strand == -1:
+        return reverse_complement(genome[start:end])
+    return genome[start:end]
+
+
+def is_extractable(dnaseq, genome, start, end, strand):
+    """
+    Can we get the DNA sequence of a feature back from the genome?
+    :param dnaseq: the DNA sequence of the feature
+    :param genome: the genome sequence
+    :param start: the 0-based start of the feature
+    :param end: the end of the feature
+    :param strand: the strand of the feature
+    :return: True if we do not need to store the DNA sequence
+    """
+    return strand in (1, -1) and len(dnaseq) == end - start and extract_sequence(genome, start, end, strand) == dnaseq
+
+
+def genome_sequence(conn, identifier):
+    """
+    Get the sequence of a genome
+    :param conn: the database connection
+    :param identifier: the genome identifier
+    :return: the sequence or None if we do not have that genome
+    """
+
+    row = conn.cursor().execute("select sequence from genome where identifier = ?", [identifier]).fetchone()
+    return unpack_sequence(row[0]) if row else None
+
+
+def _contig_sequence(cursor, contig):
+    """
+    Get the genome sequence that we extract the genes and tRNAs on a contig from
+    :param cursor: the database cursor
+    :param contig: the contig name of the feature
+    :return: the sequence of the first genome with that name, or None if there isn't one
+    """
+
+    row = cursor.execute("select sequence from genome where name = ? order by genome_rowid limit 1",
+                         [contig]).fetchone()
+    return unpack_sequence(row[0]) if row else None
+
+
+def _feature_sequence(conn, table, rowid):
+    """
+    Get the DNA sequence of a gene or tRNA
+    :param conn: the database connection
+    :param table: gene or trna
+    :param rowid: the rowid of the feature
+    :return: the sequence or None if we do not have that feature
+    """
+
+    c = conn.cursor()
+    row = c.execute(f"select dna_sequence, contig, start, end, strand from {table} where {table}_rowid = ?",
+                    [rowid]).fetchone()
+    if not row:
+        return None
+    (dnaseq, contig, start, end, strand) = row
+    if dnaseq is not None:
+        return dnaseq
+    genome = _contig_sequence(c, contig)
+    return extract_sequence(genome, start, end, strand) if genome is not None else None
+
+
+def gene_sequence(conn, gene_rowid):
+    """
+    Get the DNA sequence of a gene
+    :param conn: the database connection
+    :param gene_rowid: the gene rowid
+    :return: the sequence or None if we do not have that gene
+    """
+    return _feature_sequence(conn, 'gene', gene_rowid)
+
+
+def trna_sequence(conn, trna_rowid):
+    """
+    Get the DNA sequence of a tRNA
+    :param conn: the database connection
+    :param trna_rowid: the trna rowid
+    :return: the sequence or None if we do not have that tRNA
+    """
+    return _feature_sequence(conn, 'trna', trna_rowid)
+
+
+def feature_sequences(conn, table='gene'):
+    """
+    Get the DNA sequences of all the genes (or tRNAs). We sort these by contig
+    so we only decode each genome once.
+    :param conn: the database connection
+    :param table: gene or trna
+    :return: a generator of (rowid, sequence). The sequence is None if we don't have it or its genome
+    """
+
+    genome_name = None
+    genome = None
+    c = conn.cursor()
+    ex = conn.cursor().execute(f"select {table}_rowid, contig, dna_sequence, start, end, strand from {table} " +
+                               "order by contig")
+    for (rowid, contig, dnaseq, start, end, strand) in ex:
+        if dnaseq is None:
+            if contig != genome_name:
+                genome_name = contig
+                genome = _contig_sequence(c, contig)
+            if genome is not None:
+                dnaseq = extract_sequence(genome, start, end, strand)
+        yield rowid, dnaseq
+
+
+def compact_sequences(conn, level=6, verbose=False):
+    """
+    Convert the sequences in an existing database to compact storage. Run VACUUM
+    afterwards to get the space back.
+    :param conn: the database connection
+    :param level: the zlib compression level
+    :param verbose: more output
+    :return: the number of genomes we compressed
+    """
+
+    # we look the genomes up by name, so make sure that is indexed
+    define_genome_indexes(conn, verbose)
+    c = conn.cursor()
+    for table in ['gene', 'trna']:
+        if verbose:
+            sys.stderr.write(f"{color.GREEN}Removing {table} sequences we can extract from the genomes{color.ENDC}\n")
+        clear = []
+        genome_name = None
+        genome = None
+        for (rowid, contig, dnaseq, start, end, strand) in conn.cursor().execute(
+                f"select {table}_rowid, contig, dna_sequence, start, end, strand from {table} " +
+                "where dna_sequence is not null order by contig"):
+            if contig != genome_name:
+                genome_name = contig
+                genome = _contig_sequence(c, contig)
+            # if there is more than one genome with this name, this only matches if the feature
+            # is the same in the first one, which is where we will extract it from
+            if genome is not None and is_extractable(dnaseq, genome, start, end, strand):
+                clear.append([rowid])
+        c.executemany(f"update {table} set dna_sequence = NULL where {table}_rowid = ?", clear)
+        conn.commit()
+        if verbose:
+            sys.stderr.write(f"{color.BLUE}Removed {len(clear):,} {table} sequences{color.ENDC}\n")
+
+    rowids = [r for (r,) in c.execute("select genome_rowid from genome where typeof(sequence) = 'text'").fetchall()]
+    for n, rowid in enumerate(rowids, 1):
+        (seq,) = c.execute("select sequence from genome where genome_rowid = ?", [rowid]).fetchone()
+        c.execute("update genome set sequence = ? where genome_rowid = ?", [pack_sequence(seq, level), rowid])
+        if n % 1000 == 0:
+            conn.commit()
+    conn.commit()
+    if verbose:
+        sys.stderr.write(f"{color.BLUE}Compressed {len(rowids):,} genomes{color.ENDC}\n")
+    return len(rowids)
+
+
+if __name__ == '__main__':
+    from pppf_databases import connect_to_db, disconnect
+
+    parser = argparse.ArgumentParser(description='Convert the sequences in a phage database to compact storage')
+    parser.add_argument('-p', help='Phage SQLite database', required=True)
+    parser.add_argument('-l', help='zlib compression level (default=6)', type=int, default=6)
+    parser.add_argument('-n', help='do not vacuum the database afterwards', action='store_true')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    conn = connect_to_db(args.p, args.v)
+    compact_sequences(conn, args.l, args.v)
+    if not args.n:
+        if args.v:
+            sys.stderr.write(f"{color.GREEN}Vacuuming the database{color.ENDC}\n")
+        conn.execute("VACUUM")
+    disconnect(conn, args.v)
@@ -1,9 +1,14 @@
-from .functions import is_hypothetical
+from .functions import is_hypothetical, are_hypothetical
 from .genbank import GenBank
 from .genbank_download import GenBankDownload
+from .genbank_parser import parse_genbank, parse_genbank_lines
 from .genbank_search import GenBankSearch
+from .pairwise_scores import PairwiseScores
+from .union_find import UnionFind
 
 __all__ = [
-    'is_hypothetical',
-    'GenBank', 'GenBankDownload', 'GenBankSearch'
+    'is_hypothetical', 'are_hypothetical',
+    'GenBank', 'GenBankDownload', 'GenBankSearch',
+    'parse_genbank', 'parse_genbank_lines',
+    'PairwiseScores', 'UnionFind'
 ]
@@ -5,12 +5,28 @@ The normalized bit score is generally defined as 1 - (bitscore / average(self-se
 note that it is 1-b so that identical proteins have a score of 0 and can thus be used immediately as a distance
 measure.
 
+bit_scores() reads the blast file once. It keeps the self:self bitscores and the raw bitscore
+of every hit (in compact arrays) as it reads, and then normalizes all the hits at once with
+numpy. self_bit_scores() and pairwise_bit_scores() read the file twice and give the same answer
+as a dict of dicts.
+
+bit_scores() returns the scores as a PairwiseScores (see pairwise_scores.py), which only needs
+about 12 bytes for each pair of proteins. write_pb(), write_matrix() and precluster() take either.
+
+precluster() makes single linkage clusters at one cutoff. cluster_sweep() makes them at a list of
+cutoffs, sorting the scores once and growing the same clusters as the cutoff goes up, e.g.
+
+    python bit_score.py -b blast.m8 -o out -s 0.1 0.2 0.3 0.4 0.5 -l
 """
 
 import os
 import sys
 import argparse
-from pppf_accessories import color, stream_blast_results
+from array import array
+import numpy as np
+from pppf_accessories import color, stream_blast_columns
+from pppf_lib.pairwise_scores import PairwiseScores
+from pppf_lib.union_find import UnionFind
 
 __author__ = 'Rob Edwards'
 
@@ -24,11 +40,11 @@ def self_bit_scores(blastf, verbose=False):
         sys.stderr.write(f"{color.GREEN}Calculating self:self bitscores{color.ENDC}\n")
 
     ss = {}
-    for b in stream_blast_results(blastf, verbose):
-        if b.query == b.db:
-            if b.query in ss and ss[b.query] > b.bitscore:
+    for (query, db, bitscore) in stream_blast_columns(blastf, ['query', 'db', 'bitscore'], verbose):
+        if query == db:
+            if query in ss and ss[query] > bitscore:
                 continue
-            ss[b.query] = b.bitscore
+            ss[query] = bitscore
     return ss
 
 
@@ -48,51 +64,171 @@ def pairwise_bit_scores(blastf, ss, verbose=False):
 
     pb = {}
 
-    for b in stream_blast_results(blastf, verbose):
-        if b.query not in pb:
-            pb[b.query] = {}
-        if b.db not in pb:
-            pb[b.db] = {}
+    columns = ['query', 'db', 'bitscore', 'query_length', 'subject_length']
+    for (query, db, bitscore, query_length, subject_length) in stream_blast_columns(blastf, columns, verbose):
+        if query not in pb:
+            pb[query] = {}
+        if db not in pb:
+            pb[db] = {}
 
         # we normalize by the bitscore of the two proteins if we can!
-        if b.query in ss and b.db in ss:
-            nb = 1 - (b.bitscore / ((ss[b.query] + ss[b.db])/2))
+        if query in ss and db in ss:
+            nb = 1 - (bitscore / ((ss[query] + ss[db])/2))
         else:
             # if we can't do that, we cheat and normalize 
             # the bit score by twice
             # the average length of the proteins
             # i.e. the sum of the lengths
             if verbose:
-                sys.stderr.write(f"{color.PINK}Had to guess self:self score for {b.query} to {b.db}{color.ENDC}\n")
-            nb = 1 - (b.bitscore / (b.query_length + b.subject_length + 3.3))
+                sys.stderr.write(f"{color.PINK}Had to guess self:self score for {query} to {db}{color.ENDC}\n")
+            nb = 1 - (bitscore / (query_length + subject_length + 3.3))
 
-        if b.query in pb[b.db] and pb[b.db][b.query] > nb:
+        if query in pb[db] and pb[db][query] > nb:
             continue
-        pb[b.db][b.query] = pb[b.db][b.query] = nb
+        pb[db][query] = pb[db][query] = nb
 
     return pb
 
 
+def read_bit_scores(blastf, verbose=False):
+    """
+    Read the blast file once, and keep the self:self bitscores and every hit
+    :param blastf: the blastfile
+    :param verbose: more output
+    :return: the list of protein ids (in the order we first saw them), the self:self bitscores,
+        and numpy arrays of the query and subject (indexes into the ids), bitscore, and
+        the sum of the query and subject lengths (nan if they are not in the file)
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Reading bitscores from {blastf}{color.ENDC}\n")
+
+    ids = {}
+    ss = {}
+    queries = array('I')
+    subjects = array('I')
+    bitscores = array('d')
+    lengths = array('d')
+    nan = float('nan')
+
+    # this loop is most of the time, so we look the methods up once
+    (add_query, add_subject, add_bitscore, add_length) = \
+        (queries.append, subjects.append, bitscores.append, lengths.append)
+    intern = ids.setdefault
+    columns = ['query', 'db', 'bitscore', 'query_length', 'subject_length']
+    for (query, db, bitscore, query_length, subject_length) in stream_blast_columns(blastf, columns, verbose):
+        if query == db and (query not in ss or ss[query] <= bitscore):
+            ss[query] = bitscore
+        add_query(intern(query, len(ids)))
+        add_subject(intern(db, len(ids)))
+        add_bitscore(bitscore)
+        add_length(nan if query_length is None or subject_length is None else query_length + subject_length)
+
+    if verbose:
+        sys.stderr.write(f"{color.BLUE}Read {len(bitscores):,} hits between {len(ids):,} proteins{color.ENDC}\n")
+
+    return (list(ids), ss, np.frombuffer(queries, dtype=np.uint32), np.frombuffer(subjects, dtype=np.uint32),
+            np.frombuffer(bitscores, dtype=np.float64), np.frombuffer(lengths, dtype=np.float64))
+
+
+def normalize_bit_scores(ids, ss, queries, subjects, bitscores, lengths, verbose=False):
+    """
+    Normalize all the hits at once. We divide by the average of the self:self bitscores of
+    the query and subject if we can, and the sum of their lengths if we can't.
+    :param ids: the list of protein ids
+    :param ss: the self:self bitscores
+    :param queries: the query of each hit (indexes into ids)
+    :param subjects: the subject of each hit (indexes into ids)
+    :param bitscores: the bitscore of each hit
+    :param lengths: the sum of the query and subject lengths of each hit
+    :param verbose: more output
+    :return: the normalized bitscore of each hit
+    """
+
+    selfbits = np.array([ss.get(p, np.nan) for p in ids], dtype=np.float64)
+    average = (selfbits[queries] + selfbits[subjects]) / 2
+    guess = np.isnan(average)
+    if guess.any():
+        if np.isnan(lengths[guess]).any():
+            i = np.flatnonzero(guess & np.isnan(lengths))[0]
+            sys.stderr.write(f"{color.RED}FATAL: We don't have the self:self bitscores or the lengths for " +
+                             f"{ids[queries[i]]} and {ids[subjects[i]]}{color.ENDC}\n")
+            sys.exit(-1)
+        if verbose:
+            sys.stderr.write(f"{color.PINK}Had to guess self:self score for {guess.sum():,} hits{color.ENDC}\n")
+    return np.where(guess, 1 - (bitscores / (lengths + 3.3)), 1 - (bitscores / average))
+
+
+def bit_scores(blastf, verbose=False, dtype=np.float32):
+    """
+    Make the pairwise normalized bit scores, reading the blast file only once. This gives the
+    same answer as self_bit_scores() and pairwise_bit_scores()
+    :param blastf: the blastfile
+    :param verbose: more output
+    :param dtype: the numpy type to store the normalized scores as
+    :return: the self-self bitscores and a PairwiseScores of all vs. all normalized bit scores
+    """
+
+    (ids, ss, queries, subjects, bitscores, lengths) = read_bit_scores(blastf, verbose)
+    nb = normalize_bit_scores(ids, ss, queries, subjects, bitscores, lengths, verbose)
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Creating scores{color.ENDC}\n")
+
+    if len(nb) == 0:
+        # an empty blast file
+        return ss, PairwiseScores(ids, [], [], [], dtype)
+
+    # keep the highest score for each subject/query pair, in the order we first saw them
+    key = subjects.astype(np.int64) * len(ids) + queries
+    order = np.argsort(key, kind='stable')
+    starts = np.flatnonzero(np.r_[True, key[order][1:] != key[order][:-1]])
+    best = np.maximum.reduceat(nb[order], starts)
+    first = order[starts]
+    seen = np.argsort(first, kind='stable')
+    del key, order, starts
+
+    pb = PairwiseScores(ids, subjects[first[seen]], queries[first[seen]], best[seen], dtype)
+    if verbose:
+        sys.stderr.write(f"{color.BLUE}Scores: {pb}{color.ENDC}\n")
+    return ss, pb
+
+
+def _pairwise_scores(pb):
+    """
+    Make sure we have a PairwiseScores
+    :param pb: a PairwiseScores or a dict of dicts of scores
+    :return: the PairwiseScores
+    """
+
+    if isinstance(pb, PairwiseScores):
+        return pb
+    # don't lose any precision from the dict
+    return PairwiseScores.from_dict(pb, np.float64)
+
+
 def write_pb(outf, pb, verbose=False):
     """
     Write the pairwise bitscores to a tsv
     :param outf: output file
-    :param pb: pairwise bit scores
+    :param pb: pairwise bit scores (a PairwiseScores or dict of dicts)
     :param verbose: more output
     :return:
     """
 
+    pb = _pairwise_scores(pb)
     with open(outf + ".tsv", 'w') as out:
         out.write("Query\tSubject\tnBits\n")
-        for p in pb:
-            for q in pb[p]:
-                out.write(f"{p}\t{q}\t{pb[p][q]}\n")
+        for (i, p) in enumerate(pb.ids):
+            (cols, scores) = pb.row(i)
+            for (q, s) in zip(cols.tolist(), scores.astype(str).tolist()):
+                out.write(f"{p}\t{pb.ids[q]}\t{s}\n")
 
 def write_matrix(outf, pb, verbose=False):
     """
     Print a matrix version of the pairwise bitscores
     :param outf: the matrix file to write
-    :param pb: the pairwise bitscores
+    :param pb: the pairwise bitscores (a PairwiseScores or dict of dicts)
     :param verbose: more output
     :return:
     """
@@ -100,84 +236,87 @@ def write_matrix(outf, pb, verbose=False):
     if verbose:
         sys.stderr.write(f"{color.GREEN}Creating scores{color.ENDC}\n")
 
-    allkeys = list(pb.keys())
+    pb = _pairwise_scores(pb)
+    allkeys = pb.ids
 
     with open(outf + ".mat", 'w') as out:
         out.write("\t".join([""] + allkeys))
         out.write("\n")
-        for p in allkeys:
-            out.write(p)
-            for q in allkeys:
-                if p == q:
-                    out.write("\t0")
-                elif q in pb[p]:
-                    out.write(f"\t{pb[p][q]}")
-                else:
-                    out.write("\t1")
-            out.write("\n")
+        for (i, p) in enumerate(allkeys):
+            row = np.full(len(allkeys), "1", dtype=object)
+            (cols, scores) = pb.row(i)
+            row[cols] = scores.astype(str)
+            row[i] = "0"
+            out.write(p + "\t" + "\t".join(row) + "\n")
 
 
 def precluster(pb, cutoff, verbose=False):
     """
-    Form some clusters based on the pairwise bitscores
-    :param pb: pair wise bit score dictionary
-    :param cutoff: maximum value to be included in a cluster (< this)
+    Form some clusters based on the pairwise bitscores. This is single linkage clustering:
+    two proteins are in the same cluster if there is a chain of scores <= cutoff between them.
+    Every protein is in exactly one cluster.
+    :param pb: pair wise bit scores (a PairwiseScores or dict of dicts)
+    :param cutoff: maximum value to be included in a cluster (<= this)
     :param verbose: more output
-    :return: a set of clusters
+    :return: a dict of clusters. The key is the first protein in the cluster and the value is the list of members
     """
 
     if verbose:
         sys.stderr.write(f"{color.GREEN}Creating clusters{color.ENDC}\n")
 
-    clusters_by_id = {}
-    id_by_clusters = {}
-    clustercount = 0
+    pb = _pairwise_scores(pb)
+    uf = UnionFind(len(pb.ids))
+    join = (pb.scores <= pb.scores.dtype.type(cutoff)) & (pb.rows != pb.cols)
+    rounds = uf.union_edges(pb.rows[join], pb.cols[join])
+    clusters = _named_clusters(uf, pb.ids)
 
-    allkeys = list(pb.keys())
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Joined {np.count_nonzero(join):,} pairs in {rounds} rounds and have " +
+                         f"{len(clusters):,} clusters. The largest has {max(map(len, clusters.values()), default=0):,} " +
+                         f"proteins{color.ENDC}\n")
 
-    # niaive clustering. Add the first protein to a cluster, and add all similar ones to it
-    # repeat!
+    return clusters
 
 
-    for k in allkeys:
-        currentcluster = None
-        if k in clusters_by_id:
-            currentcluster = clusters_by_id[k]
-        else:
-            currentcluster = clusters_by_id[k] = clustercount
-            clustercount += 1
-
-        # first, figure out who are friends are and what is the lowest cluster from them
-        friends = {k}
-        freindclusters = {clustercount}
-        for j in pb[k]:
-            if j == k:
-                # ignore self clusters!
-                continue
-            if pb[k][j] > cutoff:
-                continue
-            friends.add(j)
-            if j in clusters_by_id:
-                freindclusters.add(clusters_by_id[j])
-                if clusters_by_id[j] < currentcluster:
-                    currentcluster = clusters_by_id[j]
+def _named_clusters(uf, ids):
+    """
+    Convert the sets in a UnionFind to clusters of protein ids
+    :param uf: the UnionFind
+    :param ids: the protein ids
+    :return: a dict of clusters. The key is the first protein in the cluster and the value is the list of members
+    """
+    return {c: [ids[x] for x in members.tolist()] for c, members in uf.sets().items()}
 
-        # now update friends with all members of the sets in friend clusters
-        for c in freindclusters:
-            if c in id_by_clusters:
-                friends.update(id_by_clusters[c])
 
-        # finally set friends to be in clustercount cluster and set id_by_clusters to include our friends
+def cluster_sweep(pb, cutoffs, verbose=False):
+    """
+    Make the single linkage clusters at a lot of cutoffs. We sort the pairs by their score once,
+    and then for each cutoff (from the lowest) we only join the pairs with scores between the
+    previous cutoff and this one, so the clusters grow from the ones before.
+    :param pb: pair wise bit scores (a PairwiseScores or dict of dicts)
+    :param cutoffs: the cutoffs (maximum value to be included in a cluster)
+    :param verbose: more output
+    :return: a generator of (cutoff, clusters) from the lowest cutoff to the highest. The clusters
+        are the same as precluster() at that cutoff
+    """
 
-        clusters_by_id.update({x:currentcluster for x in friends})
-        id_by_clusters[currentcluster] = friends
+    pb = _pairwise_scores(pb)
+    join = pb.rows != pb.cols
+    order = np.argsort(pb.scores[join], kind='stable')
+    (rows, cols, scores) = (pb.rows[join][order], pb.cols[join][order], pb.scores[join][order])
+    del join, order
+
+    cutoffs = sorted(set(cutoffs))
+    # compare the cutoffs with the scores at the precision of the scores, like precluster() does
+    ends = np.searchsorted(scores, np.asarray(cutoffs, dtype=scores.dtype), side='right')
+    uf = UnionFind(len(pb.ids))
+    start = 0
+    for (cutoff, end) in zip(cutoffs, ends.tolist()):
+        uf.union_edges(rows[start:end], cols[start:end])
+        start = end
         if verbose:
-            sys.stderr.write(f"{color.BLUE}Added cluster {currentcluster}{color.ENDC}\n")
-
-    if verbose:
-        sys.stderr.write(f"{color.GREEN}Maximum cluster is {clustercount} but we have {len(id_by_clusters.keys())} clusters{color.ENDC}\n")
-
-    return id_by_clusters
+            sys.stderr.write(f"{color.GREEN}At {cutoff} we have joined {end:,} pairs and have {len(uf):,} clusters{color.ENDC}\n")
+        yield cutoff, _named_clusters(uf, pb.ids)
 
 def write_clusters(outf, cls, verbose=False):
     """
@@ -201,6 +340,27 @@ def write_clusters(outf, cls, verbose=False):
 
     out.close()
 
+
+def write_cluster_sweep(outf, sweep, verbose=False):
+    """
+    Write the clusters at all the cutoffs to one table
+    :param outf: output file base (we write .sweep.tsv)
+    :param sweep: the (cutoff, clusters) from cluster_sweep()
+    :param verbose: more output
+    :return:
+    """
+
+    if verbose:
+        sys.stderr.write(f"{color.GREEN}Writing clusters to {outf}.sweep.tsv{color.ENDC}\n")
+
+    with open(outf + ".sweep.tsv", 'w') as out:
+        out.write("cutoff\tcluster\tproteinID\n")
+        for (cutoff, cls) in sweep:
+            for i, j in enumerate(sorted(cls.keys())):
+                for c in cls[j]:
+                    out.write(f"{cutoff}\t{i}\t{c}\n")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=' ')
     parser.add_argument('-b', help='blast input file', required=True)
@@ -209,11 +369,20 @@ if __name__ == "__main__":
     parser.add_argument('-m', help='write matrix output', action='store_true')
     parser.add_argument('-c', help='write clusters output', action='store_true')
     parser.add_argument('-x', help='maximum normalized bit score for clusters (default=1)', type=float, default=1)
+    parser.add_argument('-s', help='write clusters output for all of these maximum normalized bit scores ' +
+                        '(a .cls file for each one)', type=float, nargs='+')
+    parser.add_argument('-l', help='with -s, write the clusters for all the cutoffs to one .sweep.tsv file',
+                        action='store_true')
+    parser.add_argument('-d', help='keep the normalized bit scores as float64 (uses 16 bytes rather than 12 per pair)',
+                        action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
-    ss = self_bit_scores(args.b, args.v)
-    pb = pairwise_bit_scores(args.b, ss, args.v)
+    if not args.o and (args.t or args.m or args.c or args.s):
+        sys.stderr.write(f"{color.RED}FATAL: Please provide an output file base (-o){color.ENDC}\n")
+        sys.exit(-1)
+
+    (ss, pb) = bit_scores(args.b, args.v, np.float64 if args.d else np.float32)
 
     if args.t:
         write_pb(args.o, pb, args.v)
@@ -222,3 +391,10 @@ if __name__ == "__main__":
     if args.c:
         cl = precluster(pb, args.x, args.v)
         write_clusters(args.o, cl, args.v)
+    if args.s:
+        sweep = cluster_sweep(pb, args.s, args.v)
+        if args.l:
+            write_cluster_sweep(args.o, sweep, args.v)
+        else:
+            for (cutoff, cl) in sweep:
+                write_clusters(f"{args.o}.{cutoff}", cl, args.v)
@@ -10,46 +10,11 @@ import pickle
 import jsonpickle
 
 from pppf_clusters.cluster import Cluster
+from pppf_clusters.load_clusters_to_database import read_mmseqs_clusters, stream_mmseqs_clusters
 from pppf_databases import connect_to_db
 from pppf_lib import is_hypothetical
 from pppf_accessories import color
 
-def read_mmseqs_clusters(clf, verbose=False):
-    """
-    Read all the clusters at once and return an array of clusters.
-    :param clf: cluster file
-    :param verbose: more output
-    :return: the list of clusters
-    """
-
-    cls = []
-    cc = 0
-    if verbose:
-        sys.stderr.write(f"{color.GREEN}Reading {clf}{color.ENDC}\n")
-
-    lastclid = None
-    thiscls = set()
-    with open(clf, 'r') as f:
-        for l in f:
-            p = l.strip().split("\t")
-            if lastclid != p[0]:
-                # this is a new cluster
-                if lastclid:
-                    cls.append(Cluster(None, lastclid, thiscls))
-                    cc += 1
-                lastclid = p[0]
-                thiscls = set()
-            thiscls.add(p[1])
-
-    # don't forget the last cluster!
-    if lastclid:
-        cls.append(Cluster(lastclid, lastclid, thiscls))
-        cc += 1
-
-    if verbose:
-        sys.stderr.write(f"{color.BLUE}There were {cc} clusters{color.ENDC}\n")
-    return cls
-
 def cluster_is_hypothetical(cl, verbose=False):
     """
     Check the functions of the members of a cluster and determine whether they are
@@ -121,7 +86,7 @@ def enrich_a_cluster(clid, mems, phagedb, exout=None, verbose=False):
 def enrich_cluster_data(cls, summf, exout=None, verbose=False):
     """
     Extract some information about each cluster and add it to the Cluster object
-    :param cls: the cluster object
+    :param cls: the clusters. This can be a list or a generator (e.g. from stream_mmseqs_clusters)
     :param summf: the summary file to write
     :param verbose: more output
     :return: the modified cluster object
@@ -198,7 +163,7 @@ if __name__ == '__main__':
 
     clusters = None
     if args.t:
-        clusters = read_mmseqs_clusters(args.t, args.v)
+        clusters = stream_mmseqs_clusters(args.t, args.v)
     else:
         sys.stderr.write(f"{color.RED}Please provide a cluster file{color.ENDC}\n")
 
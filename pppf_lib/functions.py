@@ -1,12 +1,33 @@
 import re
+from functools import lru_cache
 
 
 """
 
 Methods related to the functions of proteins.
 
+We decide whether a function is hypothetical with a list of regular expressions. Rather than
+calling re.search for each of them, we join them into a single alternation that we compile
+once, and we cache the answer for each function because the same functions come up again and
+again (e.g. for every cluster that has a hypothetical protein in it).
+
 """
 
+# The patterns are all case insensitive. Note that '^y[a-z]{2,4}\x08' ends with a backspace
+# character rather than a word boundary: the original rules used '\b' in a normal (not raw)
+# string, and we keep it so that we classify everything the same way.
+HYPOTHETICAL_PATTERNS = [
+    r'lmo\d+ protein', 'hypoth', 'conserved protein', 'gene product', 'interpro', r'B[sl][lr]\d', r'^U\d',
+    '^orf[^_]', 'uncharacterized', 'pseudogene', '^predicted', 'AGR_', 'similar to', 'similarity', 'glimmer',
+    'unknown', 'domain', '^y[a-z]{2,4}\x08', 'complete', 'ensang', 'unnamed', 'EG:', r'orf\d+', 'RIKEN',
+    'Expressed', r'[a-zA-Z]{2,3}\|', 'predicted by Psort', r'^bh\d+', 'cds_', r'^[a-z]{2,3}\d+[^:\+\-0-9]',
+    ' identi', 'ortholog of', 'structural feature', 'Phage protein', 'mobile element'
+]
+
+hypothetical_regexp = re.compile("|".join(f"(?:{p})" for p in HYPOTHETICAL_PATTERNS), re.IGNORECASE)
+
+
+@lru_cache(maxsize=2 ** 18)
 def is_hypothetical(func):
     """
     Returns True if the function is hypothetical. Otherwise returns false
@@ -16,53 +37,22 @@ def is_hypothetical(func):
 
     if not func: return True
     if func.lower() == 'hypothetical protein': return True
-    if re.search('lmo\d+ protein', func, re.IGNORECASE): return True
-    if re.search('hypoth', func, re.IGNORECASE): return True
-    if re.search('conserved protein', func, re.IGNORECASE): return True
-    if re.search('gene product', func, re.IGNORECASE): return True
-    if re.search('interpro', func, re.IGNORECASE): return True
-    if re.search('B[sl][lr]\d', func, re.IGNORECASE): return True
-    if re.search('^U\d', func, re.IGNORECASE): return True
-    if re.search('^orf[^_]', func, re.IGNORECASE): return True
-    if re.search('uncharacterized', func, re.IGNORECASE): return True
-    if re.search('pseudogene', func, re.IGNORECASE): return True
-    if re.search('^predicted', func, re.IGNORECASE): return True
-    if re.search('AGR_', func, re.IGNORECASE): return True
-    if re.search('similar to', func, re.IGNORECASE): return True
-    if re.search('similarity', func, re.IGNORECASE): return True
-    if re.search('glimmer', func, re.IGNORECASE): return True
-    if re.search('unknown', func, re.IGNORECASE): return True
-    if re.search('domain', func, re.IGNORECASE): return True
-    if re.search('^y[a-z]{2,4}\b', func, re.IGNORECASE): return True
-    if re.search('complete', func, re.IGNORECASE): return True
-    if re.search('ensang', func, re.IGNORECASE): return True
-    if re.search('unnamed', func, re.IGNORECASE): return True
-    if re.search('EG:', func, re.IGNORECASE): return True
-    if re.search('orf\d+', func, re.IGNORECASE): return True
-    if re.search('RIKEN', func, re.IGNORECASE): return True
-    if re.search('Expressed', func, re.IGNORECASE): return True
-    if re.search('[a-zA-Z]{2,3}\|', func, re.IGNORECASE): return True
-    if re.search('predicted by Psort', func, re.IGNORECASE): return True
-    if re.search('^bh\d+', func, re.IGNORECASE): return True
-    if re.search('cds_', func, re.IGNORECASE): return True
-    if re.search('^[a-z]{2,3}\d+[^:\+\-0-9]', func, re.IGNORECASE): return True
-    if re.search('similar to', func, re.IGNORECASE): return True
-    if re.search(' identi', func, re.IGNORECASE): return True
-    if re.search('ortholog of', func, re.IGNORECASE): return True
-    if re.search('ortholog of', func, re.IGNORECASE): return True
-    if re.search('structural feature', func, re.IGNORECASE): return True
-    if re.search('Phage protein', func, re.IGNORECASE): return True
-    if re.search('mobile element', func, re.IGNORECASE): return True
-
-
-
-    return False
+    return hypothetical_regexp.search(func) is not None
 
 
+def are_hypothetical(funcs):
+    """
+    Classify a lot of functions at once (e.g. a column of products from the database)
+    :param funcs: an iterable of functions
+    :return: a list of booleans, True for each function that is hypothetical
+    """
 
+    funcs = list(funcs)
+    answers = {f: is_hypothetical(f) for f in set(funcs)}
+    return [answers[f] for f in funcs]
 
 
 if __name__ == "__main__":
 
     for fn in ['Real Function', 'lmo24 protein', 'Hypothetical Protein']:
-        print("{}\t{}".format(fn, is_hypothetical(fn)))
\ No newline at end of file
+        print("{}\t{}".format(fn, is_hypothetical(fn)))
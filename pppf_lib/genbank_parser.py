@@ -0,0 +1,465 @@
+"""
+A fast, streaming GenBank parser.
+
+When we load the phage database we only need a few fields from each record: the
+LOCUS name, the ACCESSION, VERSION, DEFINITION, SOURCE and ORGANISM lines, the
+source, CDS, tRNA and tmRNA features, and the sequence. Biopython builds complete
+SeqRecords with positions, references, and every feature, which is where most of the
+load time goes.
+
+This parser reads each record once and only builds the features we ask for. The
+records, features and locations it returns behave like the Biopython objects for the
+attributes that we use, so anything that takes a SeqRecord (e.g. record_to_rows) can
+take one of these instead, and gets the same values.
+
+We only handle the common locations: ranges, single bases, complement(), join() and
+order(). If a record has anything else (remote references, between positions, one-of
+positions, origin-spanning ranges, ...) we hand that record to Biopython so we still
+get the same answer.
+"""
+
+import io
+import re
+import sys
+import argparse
+
+from Bio import SeqIO
+
+from pppf_accessories import color, open_file
+
+__author__ = 'Rob Edwards'
+
+FEATURE_TYPES = ('source', 'CDS', 'tRNA', 'tmRNA')
+SEQUENCE_HEADERS = ('CONTIG', 'ORIGIN', 'BASE COUNT', 'WGS', 'TSA', 'TLS')
+HEADER_SPACER = " " * 12
+FEATURE_SPACER = " " * 21
+
+_range = re.compile(r'^[<>]?(\d+)(?:\.\.[<>]?(\d+))?$')
+_complement = str.maketrans("ACGTUMRWSYKVHDBXNacgtumrwsykvhdbxn", "TGCAAKYWSRMBDHVXNtgcaakywsrmbdhvxn")
+
+
+class UnsupportedRecord(Exception):
+    """
+    This record has something in it that we do not parse, so we will use Biopython instead
+    """
+    pass
+
+
+def reverse_complement(seq):
+    """
+    Reverse complement a DNA sequence (using the IUPAC codes)
+    :param seq: the sequence
+    :return: the reverse complement
+    """
+    return seq.translate(_complement)[::-1]
+
+
+class GenBankLocation:
+    """
+    The location of a feature.
+
+    :ivar start: the 0-based start of the feature (the smallest start of any part)
+    :ivar end: the end of the feature (the largest end of any part)
+    :ivar strand: 1 or -1, or None if the parts are on different strands
+    :ivar parts: a list of (start, end, strand) tuples
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.start = min(p[0] for p in parts)
+        self.end = max(p[1] for p in parts)
+        strands = {p[2] for p in parts}
+        self.strand = strands.pop() if len(strands) == 1 else None
+
+    def extract(self, seq):
+        """
+        Extract the sequence for this location
+        :param seq: the sequence of the record
+        :return: the sequence of the feature
+        """
+        return "".join(seq[s:e] if strand == 1 else reverse_complement(seq[s:e]) for (s, e, strand) in self.parts)
+
+
+class GenBankFeature:
+    """
+    A feature from a GenBank record.
+
+    :ivar type: the feature key (e.g. CDS)
+    :ivar location: the GenBankLocation
+    :ivar qualifiers: a dict of the qualifiers. Each value is a list
+    """
+
+    def __init__(self, type, location, qualifiers):
+        self.type = type
+        self.location = location
+        self.qualifiers = qualifiers
+
+    def extract(self, record):
+        """
+        Extract the sequence of this feature from the record
+        :param record: the record the feature came from
+        :return: a GenBankRecord with just the sequence
+        """
+        return GenBankRecord(seq=self.location.extract(record.seq))
+
+
+class GenBankRecord:
+    """
+    A GenBank record with only the fields we need.
+
+    :ivar id: the accession.version
+    :ivar name: the LOCUS name
+    :ivar description: the DEFINITION
+    :ivar annotations: a dict with the accessions, source, organism, and taxonomy
+    :ivar features: the list of GenBankFeatures
+    :ivar seq: the sequence as an upper case string
+    """
+
+    def __init__(self, id=None, name=None, description="", annotations=None, features=None, seq=""):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.annotations = annotations if annotations is not None else {}
+        self.features = features if features is not None else []
+        self.seq = seq
+
+    def __len__(self):
+        return len(self.seq)
+
+
+def parse_location(text):
+    """
+    Parse a GenBank location string
+    :param text: the location with all the whitespace removed
+    :return: a list of (start, end, strand) tuples, with 0-based starts
+    """
+
+    if text.startswith('complement(') and text.endswith(')'):
+        return [(s, e, -strand) for (s, e, strand) in reversed(parse_location(text[11:-1]))]
+
+    if text.startswith('join(') or text.startswith('order('):
+        inner = text[text.index('(') + 1:-1]
+        parts = []
+        depth = 0
+        last = 0
+        for i, c in enumerate(inner):
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif c == ',' and depth == 0:
+                parts += parse_location(inner[last:i])
+                last = i + 1
+        parts += parse_location(inner[last:])
+        return parts
+
+    m = _range.match(text)
+    if not m:
+        raise UnsupportedRecord(f"Can not parse the location {text}")
+    start = int(m.group(1)) - 1
+    end = int(m.group(2)) if m.group(2) else start + 1
+    if start >= end:
+        raise UnsupportedRecord(f"Can not parse the location {text}")
+    return [(start, end, 1)]
+
+
+def split_taxonomy(lineage):
+    """
+    Split the ORGANISM lineage into a list
+    :param lineage: the lineage
+    :return: the list of taxa
+    """
+
+    if not lineage or lineage == ".":
+        return []
+    if lineage[-1] == ".":
+        lineage = lineage[:-1]
+    return [t.strip() for t in lineage.split(";") if t != ""]
+
+
+def parse_qualifiers(lines):
+    """
+    Parse the qualifiers of a feature
+    :param lines: the (stripped) lines of the feature after the location
+    :return: a dict of the qualifiers
+    """
+
+    qualifiers = []
+    iterator = iter(lines)
+    for line in iterator:
+        if line[0] == "/":
+            i = line.find("=")
+            if i == -1:
+                # a qualifier with no value, e.g. /pseudo
+                qualifiers.append([line[1:], None])
+                continue
+            (key, value) = (line[1:i], line[i + 1:])
+            if value.startswith(" ") and value.lstrip().startswith('"'):
+                value = value.lstrip()
+            if value and value[0] == '"' and value != '"':
+                # read lines until we find the closing quote
+                value_list = [value]
+                while value_list[-1][-1] != '"':
+                    try:
+                        value_list.append(next(iterator))
+                    except StopIteration:
+                        raise UnsupportedRecord(f"Unterminated /{key} qualifier")
+                value = "\n".join(value_list)
+            qualifiers.append([key, value])
+        else:
+            if not qualifiers or qualifiers[-1][1] is None:
+                raise UnsupportedRecord(f"Unexpected qualifier line {line}")
+            qualifiers[-1][1] += "\n" + line
+
+    result = {}
+    for (key, value) in qualifiers:
+        if value is None:
+            if key not in result:
+                result[key] = [""]
+            continue
+        value = value.replace("\n", " ")
+        if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1]
+        value = value.replace('""', '"')
+        if key == "translation":
+            value = "".join(value.split())
+        result.setdefault(key, []).append(value)
+    return result
+
+
+def parse_feature(key, lines):
+    """
+    Parse a single feature
+    :param key: the feature key
+    :param lines: the lines of the feature (stripped of the first 21 characters)
+    :return: the GenBankFeature
+    """
+
+    lines = [l for l in lines if l]
+    location = lines[0].strip()
+    n = 1
+    while location.endswith(",") and n < len(lines):
+        location += lines[n].strip()
+        n += 1
+    while location.count("(") > location.count(")") and n < len(lines):
+        location += lines[n].strip()
+        n += 1
+    if n < len(lines) and lines[n].startswith(")"):
+        location += lines[n]
+        n += 1
+    location = "".join(location.split())
+    return GenBankFeature(key, GenBankLocation(parse_location(location)), parse_qualifiers(lines[n:]))
+
+
+def parse_header(record, lines):
+    """
+    Parse the header lines we need (DEFINITION, ACCESSION, VERSION, SOURCE, and ORGANISM)
+    :param record: the GenBankRecord
+    :param lines: the header lines, starting with the LOCUS line
+    """
+
+    entries = []
+    for line in lines:
+        line = line.rstrip()
+        if not line:
+            continue
+        if line.startswith(HEADER_SPACER) and entries:
+            entries[-1].append(line)
+        else:
+            entries.append([line])
+
+    version = None
+    for entry in entries:
+        line_type = entry[0][:12].strip()
+        if line_type in ('DEFINITION', 'ACCESSION', 'SOURCE'):
+            data = entry[0][12:].strip()
+            for line in entry[1:]:
+                data += " " + line[12:]
+            if line_type == 'DEFINITION':
+                if data.endswith("."):
+                    data = data[:-1]
+                if record.description:
+                    record.description += " " + data
+                else:
+                    record.description = data
+            elif line_type == 'ACCESSION':
+                for acc in data.replace(";", " ").split():
+                    if acc not in record.annotations['accessions']:
+                        record.annotations['accessions'].append(acc)
+                if not record.id and record.annotations['accessions']:
+                    record.id = record.annotations['accessions'][0]
+            else:
+                if data.endswith("."):
+                    data = data[:-1]
+                record.annotations['source'] = data
+        elif line_type == 'VERSION':
+            if len(entry) > 1:
+                raise UnsupportedRecord("VERSION spans several lines")
+            data = entry[0][12:].strip()
+            while "  " in data:
+                data = data.replace("  ", " ")
+            if " GI:" in data:
+                data = data.split(" GI:")[0]
+            if data.count(".") == 1 and data.split(".")[1].isdigit():
+                (acc, version) = data.split(".")
+                if acc not in record.annotations['accessions']:
+                    record.annotations['accessions'].append(acc)
+                if not record.id:
+                    record.id = acc
+            elif data:
+                record.id = data
+        elif line_type == 'ORGANISM':
+            organism = entry[0][12:].strip()
+            lineage = ""
+            for line in entry[1:]:
+                if lineage or ";" in line:
+                    lineage += " " + line[12:]
+                elif line[12:].strip() == ".":
+                    pass
+                else:
+                    organism += " " + line[12:].strip()
+            record.annotations['organism'] = organism
+            record.annotations.setdefault('taxonomy', []).extend(split_taxonomy(lineage.strip()))
+
+    if not record.id:
+        if record.annotations['accessions']:
+            raise UnsupportedRecord("No id for the record")
+        record.id = record.name
+    elif "." not in record.id and version:
+        record.id = record.id + "." + version
+
+
+def parse_record(lines, feature_types=FEATURE_TYPES):
+    """
+    Parse the lines of a single GenBank record.
+    :param lines: the lines of the record, up to and including the // line
+    :param feature_types: the types of features we keep
+    :return: the GenBankRecord, or None if there is no record in the lines
+    """
+
+    n = 0
+    while n < len(lines) and not lines[n].startswith("LOCUS       "):
+        n += 1
+    if n == len(lines):
+        return None
+
+    locus = lines[n].split()
+    if len(locus) < 3 or not locus[2].isdigit():
+        raise UnsupportedRecord(f"Can not parse the LOCUS line {lines[n]}")
+    record = GenBankRecord(name=locus[1], annotations={'accessions': []})
+
+    # the header
+    header = n
+    while n < len(lines):
+        line = lines[n].rstrip()
+        if line.startswith("FEATURES") or line[:12].rstrip() in SEQUENCE_HEADERS:
+            break
+        if line == "//":
+            raise UnsupportedRecord("Premature end of record")
+        n += 1
+    parse_header(record, lines[header:n])
+
+    # the features
+    if lines[n].startswith("FEATURES"):
+        n += 1
+        while n < len(lines):
+            line = lines[n].rstrip()
+            if line[:12].rstrip() in SEQUENCE_HEADERS or line == "//":
+                break
+            n += 1
+            if line[2:21].strip() == "":
+                continue
+            if len(line) < 21:
+                continue
+            if line[21] != " " and " " in line[21:]:
+                raise UnsupportedRecord(f"Can not parse the feature line {line}")
+            key = line[2:21].strip()
+            feature_lines = [line[21:]]
+            while n < len(lines) and (lines[n][:21] == FEATURE_SPACER or
+                                      (lines[n].rstrip("\n") != "" and lines[n].strip() == "")):
+                feature_lines.append(lines[n][21:].strip())
+                n += 1
+            if key in feature_types:
+                record.features.append(parse_feature(key, feature_lines))
+
+    # the sequence
+    while n < len(lines) and (lines[n][:12].rstrip() in SEQUENCE_HEADERS or lines[n][:12] == HEADER_SPACER
+                              or lines[n][:3] == "WGS"):
+        n += 1
+    seq = []
+    while n < len(lines):
+        line = lines[n].rstrip()
+        n += 1
+        if line == "//" or line.startswith("CONTIG"):
+            break
+        if not line:
+            continue
+        if len(line) > 9 and line[9:10] != " ":
+            raise UnsupportedRecord(f"Can not parse the sequence line {line}")
+        seq.append(line[10:])
+    record.seq = "".join(seq).replace(" ", "").upper()
+
+    return record
+
+
+def parse_genbank_lines(lines, feature_types=FEATURE_TYPES, verbose=False):
+    """
+    Parse GenBank records from an iterable of lines (e.g. an open file)
+    :param lines: the lines
+    :param feature_types: the types of features we keep
+    :param verbose: more output
+    :return: a generator of records. These are GenBankRecords, or Biopython SeqRecords when we could not parse the record
+    """
+
+    record = []
+    for line in lines:
+        record.append(line)
+        if line.startswith("//") and line.rstrip() == "//":
+            rec = _parse_or_fallback(record, feature_types, verbose)
+            if rec is not None:
+                yield rec
+            record = []
+    if record:
+        rec = _parse_or_fallback(record, feature_types, verbose)
+        if rec is not None:
+            yield rec
+
+
+def _parse_or_fallback(lines, feature_types, verbose):
+    """
+    Parse a record, or use Biopython if we can not
+    :param lines: the lines of the record
+    :param feature_types: the types of features we keep
+    :param verbose: more output
+    :return: the record, or None if there is no record
+    """
+
+    try:
+        return parse_record(lines, feature_types)
+    except UnsupportedRecord as e:
+        if verbose:
+            sys.stderr.write(f"{color.YELLOW}{e}. Using Biopython for this record{color.ENDC}\n")
+        return SeqIO.read(io.StringIO("".join(lines)), "genbank")
+
+
+def parse_genbank(gbkf, feature_types=FEATURE_TYPES, verbose=False):
+    """
+    Parse a (possibly compressed) GenBank file
+    :param gbkf: the GenBank file
+    :param feature_types: the types of features we keep
+    :param verbose: more output
+    :return: a generator of records
+    """
+
+    with open_file(gbkf) as f:
+        yield from parse_genbank_lines(f, feature_types, verbose)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parse a GenBank file and print a summary of each record')
+    parser.add_argument('-f', help='GenBank file to parse', required=True)
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    for rec in parse_genbank(args.f, verbose=args.v):
+        print("\t".join(map(str, [rec.id, rec.name, len(rec), len(rec.features), rec.description])))
@@ -0,0 +1,139 @@
+"""
+A sparse matrix of pairwise scores between proteins.
+
+A dict of dicts keyed by the protein ids costs hundreds of bytes for every pair, so we can't
+hold an all vs. all of the phage proteins in memory that way. Instead we number the proteins
+and keep three arrays: the row and column of each pair (uint32) and its score (float32 by
+default), which is 12 bytes a pair. The pairs are sorted by row, so like a CSR matrix
+we can get all the pairs for one protein with a slice.
+
+scores[p][q] in the dict of dicts is the pair with row p and column q. from_dict() and
+to_dict() convert between the two, and to_scipy() makes a scipy.sparse matrix if you have
+scipy installed.
+"""
+
+import sys
+import numpy as np
+
+from pppf_accessories import color
+
+__author__ = 'Rob Edwards'
+
+
+class PairwiseScores:
+    """
+    The scores between pairs of proteins.
+
+    :ivar ids: the protein ids. The rows and columns are indexes into this list
+    :ivar rows: the row of each pair (uint32)
+    :ivar cols: the column of each pair (uint32)
+    :ivar scores: the score of each pair
+    :ivar indptr: the pairs for row i are indptr[i]:indptr[i+1]
+    """
+
+    def __init__(self, ids, rows, cols, scores, dtype=np.float32):
+        """
+        Create the scores. We keep the order of the pairs in each row.
+        :param ids: the list of protein ids
+        :param rows: the row of each pair (indexes into ids)
+        :param cols: the column of each pair (indexes into ids)
+        :param scores: the score of each pair
+        :param dtype: the numpy type to store the scores as
+        """
+        self.ids = list(ids)
+        order = np.argsort(rows, kind='stable')
+        self.rows = np.asarray(rows, dtype=np.uint32)[order]
+        self.cols = np.asarray(cols, dtype=np.uint32)[order]
+        self.scores = np.asarray(scores, dtype=dtype)[order]
+        self.indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.rows, minlength=len(self.ids)), out=self.indptr[1:])
+        self._index = None
+
+    @classmethod
+    def from_dict(cls, pb, dtype=np.float32):
+        """
+        Convert a dict of dicts of scores
+        :param pb: the dict of dicts (pb[p][q] = score)
+        :param dtype: the numpy type to store the scores as
+        :return: the PairwiseScores
+        """
+        ids = {p: i for i, p in enumerate(pb)}
+        rows = []
+        cols = []
+        scores = []
+        for p in pb:
+            for q in pb[p]:
+                rows.append(ids[p])
+                cols.append(ids.setdefault(q, len(ids)))
+                scores.append(pb[p][q])
+        return cls(list(ids), rows, cols, scores, dtype)
+
+    def to_dict(self):
+        """
+        :return: the scores as a dict of dicts
+        """
+        pb = {p: {} for p in self.ids}
+        for (r, c, s) in zip(self.rows.tolist(), self.cols.tolist(), self.scores.tolist()):
+            pb[self.ids[r]][self.ids[c]] = s
+        return pb
+
+    def to_scipy(self, fmt='csr'):
+        """
+        Convert the scores to a scipy.sparse matrix. You need to have scipy installed.
+        :param fmt: the sparse format (csr, coo, ...)
+        :return: the scipy.sparse matrix
+        """
+        try:
+            from scipy import sparse
+        except ImportError:
+            sys.stderr.write(f"{color.RED}FATAL: Please install scipy to make a sparse matrix{color.ENDC}\n")
+            sys.exit(-1)
+        n = len(self.ids)
+        return sparse.coo_matrix((self.scores, (self.rows, self.cols)), shape=(n, n)).asformat(fmt)
+
+    def index(self, proteinid):
+        """
+        Get the index of a protein id
+        :param proteinid: the protein id
+        :return: the index, or None if we don't have that protein
+        """
+        if self._index is None:
+            self._index = {p: i for i, p in enumerate(self.ids)}
+        return self._index.get(proteinid)
+
+    def row(self, i):
+        """
+        Get the pairs in a row
+        :param i: the row
+        :return: arrays of the columns and their scores
+        """
+        (start, end) = self.indptr[i], self.indptr[i + 1]
+        return self.cols[start:end], self.scores[start:end]
+
+    def score(self, p, q, default=None):
+        """
+        Get the score for a pair of proteins
+        :param p: the row protein id
+        :param q: the column protein id
+        :param default: what to return if we don't have a score
+        :return: the score
+        """
+        (i, j) = (self.index(p), self.index(q))
+        if i is None or j is None:
+            return default
+        (cols, scores) = self.row(i)
+        found = np.flatnonzero(cols == j)
+        return scores[found[0]].item() if len(found) else default
+
+    @property
+    def nbytes(self):
+        """
+        :return: the memory used by the arrays
+        """
+        return self.rows.nbytes + self.cols.nbytes + self.scores.nbytes + self.indptr.nbytes
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __repr__(self):
+        return f"PairwiseScores({len(self.ids):,} proteins, {len(self):,} pairs, {self.nbytes:,} bytes)"
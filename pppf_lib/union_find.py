@@ -0,0 +1,116 @@
+"""
+A disjoint-set (union-find) structure for single linkage clustering.
+
+The proteins are numbered 0..n-1, and each one points to a parent with a lower number, so
+the root of each set is its lowest numbered protein. You can join a lot of pairs at once
+with union_edges(), which does the work with numpy: in each round every pair that is in
+two different sets hooks the higher root onto the lower one, and then we compress the paths
+so everything points straight at its root. Each round removes the pairs that are already
+joined, so that scales to hundreds of millions of pairs.
+
+You can keep calling union_edges() with more pairs (e.g. as you raise a cutoff) and the sets
+grow from where they were.
+"""
+
+import numpy as np
+
+__author__ = 'Rob Edwards'
+
+
+class UnionFind:
+    """
+    Disjoint sets of the numbers 0..n-1
+
+    :ivar parent: the parent of each number. A root is its own parent
+    """
+
+    def __init__(self, n):
+        """
+        Start with every number in its own set
+        :param n: how many numbers
+        """
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def find(self, x):
+        """
+        Find the root of the set that x is in
+        :param x: the number
+        :return: the root
+        """
+        parent = self.parent
+        while parent[x] != x:
+            # path halving
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return int(x)
+
+    def union(self, x, y):
+        """
+        Join the sets of x and y
+        :param x: a number
+        :param y: another number
+        :return: the root of the joined set
+        """
+        (rx, ry) = (self.find(x), self.find(y))
+        if rx > ry:
+            (rx, ry) = (ry, rx)
+        self.parent[ry] = rx
+        return rx
+
+    def _compress(self):
+        """
+        Point everything straight at its root
+        """
+        parent = self.parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        self.parent = parent
+
+    def union_edges(self, a, b):
+        """
+        Join the sets of a lot of pairs at once
+        :param a: an array of numbers
+        :param b: an array of the numbers to join them to
+        :return: the number of rounds it took
+        """
+        self._compress()
+        (ra, rb) = (self.parent[a], self.parent[b])
+        rounds = 0
+        while True:
+            join = ra != rb
+            if not join.any():
+                break
+            (ra, rb) = (ra[join], rb[join])
+            # hook the higher root on to the lower one. If a root has more than one pair we
+            # keep the lowest, and the others are joined in the next round
+            np.minimum.at(self.parent, np.maximum(ra, rb), np.minimum(ra, rb))
+            self._compress()
+            (ra, rb) = (self.parent[ra], self.parent[rb])
+            rounds += 1
+        return rounds
+
+    def labels(self):
+        """
+        :return: the root of every number
+        """
+        self._compress()
+        return self.parent.copy()
+
+    def sets(self):
+        """
+        Get all the sets
+        :return: a dict of root: array of the members (in order)
+        """
+        labels = self.labels()
+        order = np.argsort(labels, kind='stable')
+        (roots, starts) = np.unique(labels[order], return_index=True)
+        return dict(zip(roots.tolist(), np.split(order, starts[1:])))
+
+    def __len__(self):
+        """
+        :return: the number of sets
+        """
+        return int(np.count_nonzero(self.parent == np.arange(len(self.parent))))
@@ -0,0 +1,37 @@
+"""
+Add the is_hypothetical column to the protein table of an existing phage database,
+and (optionally) recalculate cluster.only_hypothetical from those flags.
+
+New databases already have is_hypothetical, and the loader fills it in.
+"""
+
+import sys
+import argparse
+
+from pppf_accessories import color
+from pppf_databases import connect_to_db, connect_to_phage_and_clusters, disconnect
+from pppf_databases.define_database_tables import define_hypothetical_column
+from pppf_clusters.load_clusters_to_database import update_only_hypothetical
+
+__author__ = 'Rob Edwards'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Add is_hypothetical to the proteins and update the clusters")
+    parser.add_argument('-p', help='phage SQLite database', required=True)
+    parser.add_argument('-c', help='clusters SQLite database. We recalculate only_hypothetical for all the clusters')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    conn = connect_to_db(args.p, args.v)
+    define_hypothetical_column(conn, args.v)
+    disconnect(conn, args.v)
+
+    if args.c:
+        conn = connect_to_phage_and_clusters(args.p, args.c, args.v)
+        conn.execute("CREATE INDEX IF NOT EXISTS cluster_id5 ON cluster(only_hypothetical, clusterdefinition);")
+        n = update_only_hypothetical(conn, args.v)
+        conn.commit()
+        if args.v:
+            sys.stderr.write(f"{color.BLUE}Updated {n:,} clusters{color.ENDC}\n")
+        disconnect(conn, args.v)
@@ -6,6 +6,8 @@ import os
 import sys
 import argparse
 from pppf_databases import connect_to_db, disconnect
+from pppf_databases.md5_keys import md5_key, md5_format
+from pppf_clusters.cluster_members import members_are_normalized
 from pppf_accessories import color
 
 if __name__ == '__main__':
@@ -16,6 +18,10 @@ if __name__ == '__main__':
     dbc = connect_to_db(args.c, args.v)
     cur = dbc.cursor()
 
+    if members_are_normalized(dbc):
+        sys.stderr.write(f"{color.RED}FATAL: {args.c} is normalized and md5cluster is already the only list of cluster members{color.ENDC}\n")
+        sys.exit(-1)
+
     # define the table
     if args.v:
         sys.stderr.write(f"{color.GREEN}Creating MD5CLUSTERS table{color.ENDC}\n")
@@ -37,8 +43,9 @@ if __name__ == '__main__':
 
 
     # get all the clusters
+    fmt = md5_format(dbc)
     ex = cur.execute("select cluster_rowid, members from cluster")
     for (i,m) in ex.fetchall():
         for o in m.split(","):
-            cur.execute("INSERT INTO md5cluster (protein_md5sum, cluster) VALUES (?,?)", [o, i])
+            cur.execute("INSERT INTO md5cluster (protein_md5sum, cluster) VALUES (?,?)", [md5_key(o, fmt), i])
     dbc.commit()
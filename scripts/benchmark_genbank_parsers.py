@@ -0,0 +1,132 @@
+"""
+Compare the speed of the Biopython and fast GenBank parsers, and check they
+give the same database rows.
+
+We also check that both parsers return the same records, including a record with an empty
+sequence (e.g. a CONTIG or WGS master record, or an entry with no ORIGIN sequence). We can not
+make the database rows for those with Biopython, so we compare the records themselves.
+
+We time how long it takes to get from the GenBank file to the rows we would
+load into the database, so this includes the md5sums and feature extraction
+but not the SQLite writes.
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+from itertools import zip_longest
+
+from Bio import SeqIO
+
+from pppf_accessories import color, open_file
+from pppf_lib.genbank_parser import parse_genbank_lines
+from pppf_databases.load_sequences_from_genbank import genbank_to_rows
+
+__author__ = 'Rob Edwards'
+__copyright__ = 'Copyright 2020, Rob Edwards'
+__credits__ = ['Rob Edwards']
+__license__ = 'MIT'
+__maintainer__ = 'Rob Edwards'
+__email__ = 'raedwards@gmail.com'
+
+# a record with no sequence after ORIGIN, like NM_006141.1
+empty_sequence_record = """LOCUS       NM_006141               1622 bp    mRNA    linear   PRI 01-NOV-2000
+DEFINITION  Homo sapiens dynein, cytoplasmic, light intermediate polypeptide 2
+            (DNCLI2), mRNA.
+ACCESSION   NM_006141
+VERSION     NM_006141.1
+KEYWORDS    .
+SOURCE      Homo sapiens (human)
+  ORGANISM  Homo sapiens
+            Eukaryota; Metazoa; Chordata; Craniata; Vertebrata; Euteleostomi;
+            Mammalia; Eutheria; Primates; Catarrhini; Hominidae; Homo.
+FEATURES             Location/Qualifiers
+     source          1..1622
+                     /organism="Homo sapiens"
+ORIGIN      
+//
+"""
+
+
+def time_parser(gbkfiles, parser, verbose=False):
+    """
+    Time how long a parser takes to generate the rows for some files
+    :param gbkfiles: the list of GenBank files
+    :param parser: the parser to use (biopython or fast)
+    :param verbose: more output
+    :return: the number of records and the time taken
+    """
+
+    records = 0
+    start = time.time()
+    for f in gbkfiles:
+        for rows in genbank_to_rows(f, verbose, parser):
+            records += 1
+    return records, time.time() - start
+
+
+def compare_parsers(gbkfiles, verbose=False):
+    """
+    Check that both parsers give the same rows
+    :param gbkfiles: the list of GenBank files
+    :param verbose: more output
+    :return: the number of records that are different
+    """
+
+    different = 0
+    for f in gbkfiles:
+        for bio, fast in zip_longest(genbank_to_rows(f, verbose, 'biopython'), genbank_to_rows(f, verbose, 'fast')):
+            if bio != fast:
+                different += 1
+                sys.stderr.write(f"{color.RED}The parsers give different rows for {(bio or fast)['genome'][0]} " +
+                                 f"in {f}{color.ENDC}\n")
+    return different
+
+
+def compare_records(name, text, verbose=False):
+    """
+    Check that both parsers return the same records, with the same ids, names, and descriptions
+    :param name: the name of the text to use in the messages
+    :param text: the GenBank records
+    :param verbose: more output
+    :return: the number of records that are different
+    """
+
+    different = 0
+    bio = SeqIO.parse(io.StringIO(text), 'genbank')
+    fast = parse_genbank_lines(io.StringIO(text), verbose=verbose)
+    for b, r in zip_longest(bio, fast):
+        (b, r) = [(x.id, x.name, x.description) if x is not None else None for x in (b, r)]
+        if b != r:
+            different += 1
+            sys.stderr.write(f"{color.RED}The parsers give different records in {name}: {b} {r}{color.ENDC}\n")
+    return different
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the GenBank parsers")
+    parser.add_argument('-f', help='genbank file(s) to parse', nargs="+", required=True)
+    parser.add_argument('-c', help='check that both parsers give the same rows', action='store_true')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    size = sum(os.path.getsize(f) for f in args.f) / 1e6
+    times = {}
+    for p in ['biopython', 'fast']:
+        (n, times[p]) = time_parser(args.f, p, args.v)
+        print(f"{p}\t{n:,} records\t{times[p]:.2f} seconds\t{size / times[p]:.1f} MB/second")
+    if times['fast']:
+        print(f"speedup\t{times['biopython'] / times['fast']:.1f}x")
+
+    if args.c:
+        d = compare_records('the empty sequence record', empty_sequence_record, args.v)
+        for f in args.f:
+            with open_file(f) as gbk:
+                d += compare_records(f, gbk.read(), args.v)
+        d += compare_parsers(args.f, args.v)
+        if d:
+            sys.stderr.write(f"{color.RED}{d} records are different{color.ENDC}\n")
+            sys.exit(1)
+        sys.stderr.write(f"{color.GREEN}Both parsers give the same records and rows{color.ENDC}\n")
@@ -0,0 +1,129 @@
+"""
+Benchmark is_hypothetical, and check that it gives the same answers as the original
+rules (a separate re.search for each pattern).
+
+We time the original rules, the combined regular expression without the cache, and
+are_hypothetical (combined and cached) on a list of functions. Those can come from the
+products in a phage database, or a file with one function per line, or both.
+"""
+
+import re
+import sys
+import time
+import argparse
+
+from pppf_accessories import color
+from pppf_databases import connect_to_db, disconnect
+from pppf_lib.functions import is_hypothetical, are_hypothetical
+
+__author__ = 'Rob Edwards'
+__copyright__ = 'Copyright 2020, Rob Edwards'
+__credits__ = ['Rob Edwards']
+__license__ = 'MIT'
+__maintainer__ = 'Rob Edwards'
+__email__ = 'raedwards@gmail.com'
+
+
+def reference_is_hypothetical(func):
+    """
+    The original rules for is_hypothetical, one re.search at a time. We check the
+    combined regular expression against these
+    :param func: string
+    :return: boolean
+    """
+
+    if not func: return True
+    if func.lower() == 'hypothetical protein': return True
+    if re.search('lmo\d+ protein', func, re.IGNORECASE): return True
+    if re.search('hypoth', func, re.IGNORECASE): return True
+    if re.search('conserved protein', func, re.IGNORECASE): return True
+    if re.search('gene product', func, re.IGNORECASE): return True
+    if re.search('interpro', func, re.IGNORECASE): return True
+    if re.search('B[sl][lr]\d', func, re.IGNORECASE): return True
+    if re.search('^U\d', func, re.IGNORECASE): return True
+    if re.search('^orf[^_]', func, re.IGNORECASE): return True
+    if re.search('uncharacterized', func, re.IGNORECASE): return True
+    if re.search('pseudogene', func, re.IGNORECASE): return True
+    if re.search('^predicted', func, re.IGNORECASE): return True
+    if re.search('AGR_', func, re.IGNORECASE): return True
+    if re.search('similar to', func, re.IGNORECASE): return True
+    if re.search('similarity', func, re.IGNORECASE): return True
+    if re.search('glimmer', func, re.IGNORECASE): return True
+    if re.search('unknown', func, re.IGNORECASE): return True
+    if re.search('domain', func, re.IGNORECASE): return True
+    if re.search('^y[a-z]{2,4}\b', func, re.IGNORECASE): return True
+    if re.search('complete', func, re.IGNORECASE): return True
+    if re.search('ensang', func, re.IGNORECASE): return True
+    if re.search('unnamed', func, re.IGNORECASE): return True
+    if re.search('EG:', func, re.IGNORECASE): return True
+    if re.search('orf\d+', func, re.IGNORECASE): return True
+    if re.search('RIKEN', func, re.IGNORECASE): return True
+    if re.search('Expressed', func, re.IGNORECASE): return True
+    if re.search('[a-zA-Z]{2,3}\|', func, re.IGNORECASE): return True
+    if re.search('predicted by Psort', func, re.IGNORECASE): return True
+    if re.search('^bh\d+', func, re.IGNORECASE): return True
+    if re.search('cds_', func, re.IGNORECASE): return True
+    if re.search('^[a-z]{2,3}\d+[^:\+\-0-9]', func, re.IGNORECASE): return True
+    if re.search('similar to', func, re.IGNORECASE): return True
+    if re.search(' identi', func, re.IGNORECASE): return True
+    if re.search('ortholog of', func, re.IGNORECASE): return True
+    if re.search('ortholog of', func, re.IGNORECASE): return True
+    if re.search('structural feature', func, re.IGNORECASE): return True
+    if re.search('Phage protein', func, re.IGNORECASE): return True
+    if re.search('mobile element', func, re.IGNORECASE): return True
+
+    return False
+
+
+def time_classifier(classifier, funcs):
+    """
+    Time how long a classifier takes for all the functions
+    :param classifier: a function that takes the list of functions and returns a list of booleans
+    :param funcs: the list of functions
+    :return: the answers and the time taken
+    """
+
+    start = time.time()
+    answers = classifier(funcs)
+    return answers, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark and check is_hypothetical")
+    parser.add_argument('-p', help='phage database to read the protein products from')
+    parser.add_argument('-f', help='file with one function per line')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    funcs = []
+    if args.p:
+        conn = connect_to_db(args.p, args.v)
+        funcs += [p for (p,) in conn.cursor().execute("select product from protein")]
+        disconnect(conn, args.v)
+    if args.f:
+        with open(args.f, 'r') as f:
+            funcs += [l.rstrip("\n") for l in f]
+    if not funcs:
+        sys.stderr.write(f"{color.RED}FATAL: Please provide a phage database (-p) or a file of functions (-f){color.ENDC}\n")
+        sys.exit(-1)
+
+    print(f"{len(funcs):,} functions ({len(set(funcs)):,} different)")
+    classifiers = {
+        'original': lambda fns: [reference_is_hypothetical(f) for f in fns],
+        'combined': lambda fns: [is_hypothetical.__wrapped__(f) for f in fns],
+        'cached': are_hypothetical
+    }
+    answers = {}
+    times = {}
+    for name, classifier in classifiers.items():
+        (answers[name], times[name]) = time_classifier(classifier, funcs)
+        print(f"{name}\t{times[name]:.3f} seconds\t{times['original'] / max(times[name], 1e-9):.1f}x")
+
+    different = [f for f, a, b, c in zip(funcs, answers['original'], answers['combined'], answers['cached'])
+                 if not a == b == c]
+    if different:
+        for f in different[:10]:
+            sys.stderr.write(f"{color.RED}Different answers for '{f}'{color.ENDC}\n")
+        sys.stderr.write(f"{color.RED}{len(different):,} functions are classified differently{color.ENDC}\n")
+        sys.exit(1)
+    sys.stderr.write(f"{color.GREEN}All the functions are classified the same way{color.ENDC}\n")
@@ -0,0 +1,91 @@
+"""
+Convert the protein md5sums in existing phage and cluster databases between
+32 character hex text and 16 byte blobs (see pppf_databases/md5_keys.py).
+
+We convert protein.protein_md5sum and protein_sequence.protein_md5sum in the phage
+database, and md5cluster.protein_md5sum in the cluster database, and record the new
+format in the pppf_metadata table. Convert both databases to the same format. The
+cluster members, exemplar, longest_id, and shortest_id are always hex text.
+
+Each database is converted in a single transaction, so if this stops part way through
+the database is unchanged.
+"""
+
+import sys
+import argparse
+
+from pppf_accessories import color
+from pppf_databases import connect_to_db, disconnect
+from pppf_databases.define_database_tables import define_metadata_table
+from pppf_databases.md5_keys import md5_format, set_metadata
+
+__author__ = 'Rob Edwards'
+
+phage_columns = [('protein_sequence', 'protein_md5sum'), ('protein', 'protein_md5sum')]
+cluster_columns = [('md5cluster', 'protein_md5sum')]
+
+
+def convert_md5_keys(conn, columns, fmt, verbose=False):
+    """
+    Convert the md5sums in some columns to text or blob
+    :param conn: the database connection
+    :param columns: a list of (table, column) to convert
+    :param fmt: text or blob
+    :param verbose: more output
+    :return: the number of values we converted
+    """
+
+    define_metadata_table(conn, verbose)
+    if md5_format(conn) == fmt:
+        if verbose:
+            sys.stderr.write(f"{color.BLUE}The md5sums are already stored as {fmt}{color.ENDC}\n")
+        return 0
+
+    (fromtype, func) = ('text', 'md5_unhex') if fmt == 'blob' else ('blob', 'md5_hex')
+    tables = {t for (t,) in conn.execute("select name from sqlite_master where type = 'table'")}
+    n = 0
+    c = conn.cursor()
+    c.execute("BEGIN")
+    # protein has a foreign key to protein_sequence, so we only check them once both are converted
+    c.execute("PRAGMA defer_foreign_keys = ON")
+    try:
+        for (table, column) in columns:
+            if table not in tables:
+                continue
+            if verbose:
+                sys.stderr.write(f"{color.GREEN}Converting {table}.{column} to {fmt}{color.ENDC}\n")
+            c.execute(f"UPDATE {table} SET {column} = {func}({column}) WHERE typeof({column}) = ?", [fromtype])
+            n += c.rowcount
+        set_metadata(conn, 'md5_format', fmt)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if verbose:
+        sys.stderr.write(f"{color.BLUE}Converted {n:,} md5sums{color.ENDC}\n")
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Store the protein md5sums as text or as 16 byte blobs")
+    parser.add_argument('-p', help='phage SQLite database')
+    parser.add_argument('-c', help='clusters SQLite database')
+    parser.add_argument('-f', help='the md5 format to convert to (default=blob)', default='blob',
+                        choices=['text', 'blob'])
+    parser.add_argument('-n', help='do not vacuum the databases afterwards', action='store_true')
+    parser.add_argument('-v', help='verbose output', action='store_true')
+    args = parser.parse_args()
+
+    if not args.p and not args.c:
+        sys.stderr.write(f"{color.RED}Nothing to do!{color.ENDC}\n")
+        sys.exit(0)
+
+    for (dbfile, columns) in [(args.p, phage_columns), (args.c, cluster_columns)]:
+        if not dbfile:
+            continue
+        conn = connect_to_db(dbfile, args.v)
+        if convert_md5_keys(conn, columns, args.f, args.v) and not args.n:
+            if args.v:
+                sys.stderr.write(f"{color.GREEN}Vacuuming {dbfile}{color.ENDC}\n")
+            conn.execute("VACUUM")
+        disconnect(conn, args.v)
@@ -15,6 +15,12 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Create a database and load it with GenBank data")
     parser.add_argument('-p', help='Phage SQL output database')
     parser.add_argument('-c', help='clusters SQLite database')
+    parser.add_argument('-n', help='do not index the phage tables. Use this with load_databases.py -x for a fresh load',
+                        action='store_true')
+    parser.add_argument('-m', help='store the protein md5sums as text or blob (default=text). Blobs are smaller and faster',
+                        default='text', choices=['text', 'blob'])
+    parser.add_argument('-z', help='normalized clusters: only store the cluster members in the md5cluster table',
+                        action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
@@ -25,7 +31,7 @@ if __name__ == '__main__':
             with open(args.p, 'w') as out:
                 True
         phageconn = connect_to_db(args.p, args.v)
-        define_phage_tables(phageconn, args.v)
+        define_phage_tables(phageconn, args.v, not args.n, args.m)
         phageconn.commit()  # final commit to make sure everything saved!
         disconnect(phageconn, args.v)
 
@@ -35,7 +41,7 @@ if __name__ == '__main__':
             with open(args.c, 'w') as out:
                 True
         clconn    = connect_to_db(args.c, args.v)
-        define_cluster_tables(clconn, args.v)
+        define_cluster_tables(clconn, args.v, args.m, args.z)
         clconn.commit()
         disconnect(clconn, args.v)
 
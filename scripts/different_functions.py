@@ -6,6 +6,7 @@ import os
 import sys
 import argparse
 from pppf_databases import connect_to_db, disconnect
+from pppf_databases.md5_keys import md5_hex
 
 
 if __name__ == '__main__':
@@ -25,4 +26,4 @@ if __name__ == '__main__':
         counts[m][p] = counts[m].get(p, 0) + 1
 
     for m in counts:
-        print(f"{len(counts[m])}\t{m}")
\ No newline at end of file
+        print(f"{len(counts[m])}\t{md5_hex(m)}")
\ No newline at end of file
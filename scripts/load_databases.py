@@ -7,7 +7,9 @@ import sys
 import argparse
 
 from pppf_accessories import color
-from pppf_databases import load_genbank_file, connect_to_db, disconnect
+from pppf_databases import load_genbank_file, load_genbank_files, connect_to_db, disconnect
+from pppf_databases import define_phage_indexes, bulk_load_pragmas, safe_pragmas
+from pppf_databases.load_sequences_from_genbank import create_full_text_search
 
 
 
@@ -15,16 +17,51 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Load the phage database with GenBank data")
     parser.add_argument('-f', help='genbank file to load', nargs="+", required=True)
     parser.add_argument('-p', help='Phage SQL database', required=True)
+    parser.add_argument('-b', help='bulk load the data in batches', action='store_true')
+    parser.add_argument('-s', help='number of rows per batch for bulk loading (default=10000, 0 = one batch per file)',
+                        type=int, default=10000)
+    parser.add_argument('-j', help='number of processes to parse the genbank files with (default=1). ' +
+                                   'If more than one we always bulk load', type=int, default=1)
+    parser.add_argument('-x', help='fresh load into a new database made with create_databases.py -n. ' +
+                                   'We bulk load the data and then create the indexes and full text search', action='store_true')
+    parser.add_argument('-g', help='GenBank parser to use (default=biopython). fast only reads what we load',
+                        choices=['biopython', 'fast'], default='biopython')
+    parser.add_argument('-i', help='incremental load: skip files and genomes we have already loaded. ' +
+                                   'You can rerun this on the same files, or after a load has stopped part way through',
+                        action='store_true')
+    parser.add_argument('-z', help='compact storage: compress the genome sequences and do not store gene and ' +
+                                   'tRNA sequences that we can extract from the genome', action='store_true')
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
+    if args.x and args.i:
+        sys.stderr.write(f"{color.RED}FATAL: Please use either -x for a fresh load or -i for an incremental load{color.ENDC}\n")
+        sys.exit(-1)
+
     conn = connect_to_db(args.p, args.v)
+    if args.x:
+        bulk_load_pragmas(conn, args.v)
+        args.b = True
     sys.stderr.write(f"{color.BOLD}{color.BLUE}Loading data{color.ENDC}\n")
-    count = 0
-    tc = len(args.f)
-    for f in args.f:
-        count+=1
-        if args.v:
-            sys.stderr.write(f"{color.GREEN}File {count} of {tc}: {f}\n{color.ENDC}")
-        load_genbank_file(f, conn, args.v)
+    if args.j > 1:
+        load_genbank_files(args.f, conn, args.j, args.s, verbose=args.v, parser=args.g, incremental=args.i,
+                           compact=args.z)
+    else:
+        count = 0
+        tc = len(args.f)
+        for f in args.f:
+            count+=1
+            if args.v:
+                sys.stderr.write(f"{color.GREEN}File {count} of {tc}: {f}\n{color.ENDC}")
+            load_genbank_file(f, conn, args.v, args.b, args.s, args.g, args.i, args.z)
+
+    if args.x:
+        define_phage_indexes(conn, args.v)
+    # we only build the full text search the first time, after that the triggers keep it up to date
+    create_full_text_search(conn, args.v)
+    if args.x:
+        # we turned off the foreign key checks during the load, so check them now
+        for (tbl, rowid, parent, fkid) in conn.execute("PRAGMA foreign_key_check;"):
+            sys.stderr.write(f"{color.RED}WARNING: {tbl} row {rowid} has no matching row in {parent}{color.ENDC}\n")
+        safe_pragmas(conn, args.v)
     disconnect(conn, args.v)
@@ -1,5 +1,5 @@
 """
-Make a fasta file of all the proteins
+Make a fasta file of all the proteins that are not in a cluster
 """
 
 import os
@@ -7,7 +7,8 @@ import sys
 import argparse
 
 from pppf_accessories import color
-from pppf_databases import connect_to_db, disconnect
+from pppf_databases import connect_to_phage_and_clusters, disconnect
+from pppf_clusters import unclustered_proteins
 
 
 if __name__ == '__main__':
@@ -17,27 +18,13 @@ if __name__ == '__main__':
     parser.add_argument('-v', help='verbose output', action='store_true')
     args = parser.parse_args()
 
+    conn = connect_to_phage_and_clusters(args.p, args.c, args.v)
 
-    pbc = connect_to_db(args.p, args.v)
-    pcur = pbc.cursor()
-
-    dbc = connect_to_db(args.c, args.v)
-    ccur = dbc.cursor()
-
-    cl = set()
-    ex = ccur.execute("select protein_md5sum, cluster from md5cluster")
-    for (m, c) in ex.fetchall():
-        cl.add(m)
-
-    if args.v:
-        sys.stderr.write(f"{color.GREEN}Loaded {len(cl)} proteins{color.ENDC}\n")
-
-    ex = pcur.execute("select protein_md5sum, protein_sequence from protein_sequence")
     n = 0
-    for (m, s) in ex.fetchall():
+    for (m, s) in unclustered_proteins(conn, args.v):
         n += 1
-        if m not in cl:
-            print(f">{m}\n{s}")
+        print(f">{m}\n{s}")
     if args.v:
-        sys.stderr.write(f"{color.GREEN}Tested {n} proteins{color.ENDC}\n")
+        sys.stderr.write(f"{color.GREEN}Found {n} proteins that are not in a cluster{color.ENDC}\n")
 
+    disconnect(conn, args.v)
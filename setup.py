@@ -19,6 +19,7 @@ setuptools.setup(
         'jsonpickle',
         'biopython',
         'requests',
+        'numpy',
     ],
     classifiers=[
         "Programming Language :: Python :: 3",